@@ -0,0 +1,359 @@
+"""
+Reproducible benchmarks of this example.
+
+Each profile is a set of parameter values changed from setrun.py (named as
+in sweep.py):
+    smoke           2 hours of simulated time on 3 levels, a few minutes
+    default         setrun.py as is (5 levels)
+    paper           amr_levels_max = 6, as in the paper
+    harbor_restart  restart from a checkpoint at 7 hours (made once by a
+                    setup run, reused from the run cache) to the end with
+                    6 levels, i.e. only the part with the harbor refined
+Every repeat of a profile runs the code from scratch in
+_benchmark/<profile>/run_NN (never from the run cache) with the given number
+of OpenMP threads and records
+    wall, cpu           wall and CPU time (s) of the run
+    peak_rss_mb         peak resident memory of the run (MB)
+    cell_updates        total cell updates, from timing.csv (see timing.py)
+    updates_per_second  cell_updates / wall
+    skill ...           RMS error and time shift of each comparison of
+                        skill.py, if the observation store exists
+The mean, standard deviation and minimum over the repeats are appended,
+with the date, host, number of threads, Clawpack version, git commit and
+fingerprint of the run, to the results file benchmark_results.json, so the
+performance can be tracked over time.  The summary is also compared with
+the baseline of the profile in benchmark_baselines.json (written with
+--save-baseline), flagging times more than threshold slower and skill
+scores that got worse.
+
+Example:
+    make .exe
+    python benchmark.py smoke default --repeat 3 --threads 4
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import subprocess
+
+import numpy as np
+
+import sweep
+import runcache
+import timing
+import skill
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+
+results_file = os.path.join(example_dir, 'benchmark_results.json')
+baselines_file = os.path.join(example_dir, 'benchmark_baselines.json')
+
+# Version of the format of the results file:
+results_version = 1
+
+# Relative increase of a time, or of an RMS error, that is flagged:
+threshold = 0.1
+
+profiles = {
+    'smoke': {'params': {'tfinal': 2*3600., 'num_output_times': 2,
+                         'amr_levels_max': 3}},
+    'default': {'params': {}},
+    'paper': {'params': {'amr_levels_max': 6}},
+    'harbor_restart': {
+        'setup': {'amr_levels_max': 6, 'tfinal': 7*3600.,
+                  'num_output_times': 1, 'checkpt_style': 1},
+        'params': {'amr_levels_max': 6, 'restart': True}},
+    }
+
+# Metrics where smaller is better, and larger is better:
+smaller_better = ['wall', 'cpu', 'peak_rss_mb']
+larger_better = ['updates_per_second']
+
+
+def peak_rss_mb(rusage):
+    """
+    Return the peak resident memory in MB from a resource usage (ru_maxrss
+    is in kB on Linux and in bytes on macOS).
+    """
+    scale = 2.**20 if sys.platform == 'darwin' else 2.**10
+    return rusage.ru_maxrss / scale
+
+
+def write_data(rundata, outdir):
+    """
+    Write the data files of rundata to outdir, replacing any old output.
+    """
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)
+    os.makedirs(outdir)
+    cwd = os.getcwd()
+    os.chdir(outdir)
+    try:
+        rundata.write()
+    finally:
+        os.chdir(cwd)
+
+
+def run_timed(xclawcmd, outdir, threads):
+    """
+    Run the code in outdir with threads OpenMP threads.  Returns the exit
+    status, wall time and resource usage of the run.
+    """
+    env = dict(os.environ)
+    env['OMP_NUM_THREADS'] = str(threads)
+    with open(os.path.join(outdir, 'xclaw.out'), 'w') as out:
+        t0 = time.time()
+        proc = subprocess.Popen([xclawcmd], cwd=outdir, env=env, stdout=out,
+                                stderr=subprocess.STDOUT)
+        pid, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.time() - t0
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    return proc.returncode, wall, rusage
+
+
+def setup_checkpoint(profile_dir, setup_params, xclawcmd, threads):
+    """
+    Run (or fetch from the run cache) the setup run of a restart profile
+    and return the path of its last checkpoint file.
+    """
+    outdir = os.path.join(profile_dir, 'setup')
+    rundata = sweep.make_rundata(setup_params)
+    fp = runcache.fingerprint(rundata, xclawcmd)
+    if not runcache.fetch_output(fp, outdir):
+        write_data(rundata, outdir)
+        status, wall, rusage = run_timed(xclawcmd, outdir, threads)
+        if status != 0:
+            raise RuntimeError("*** Setup run in %s failed" % outdir)
+        runcache.store_output(fp, outdir)
+    checkpoints = sorted((os.path.getmtime(os.path.join(outdir, f)), f)
+                         for f in os.listdir(outdir) if f.startswith('fort.chk'))
+    if not checkpoints:
+        raise IOError("*** No checkpoint file in %s" % outdir)
+    return os.path.join(outdir, checkpoints[-1][1])
+
+
+def run_repeat(profile, outdir, xclawcmd, threads, store=None,
+               checkpoint=None):
+    """
+    Run one repeat of profile in outdir and return its metrics.
+    """
+    params = dict(profiles[profile]['params'])
+    if checkpoint is not None:
+        params['restart_file'] = os.path.basename(checkpoint)
+    rundata = sweep.make_rundata(params)
+    write_data(rundata, outdir)
+    if checkpoint is not None:
+        shutil.copy(checkpoint, outdir)
+    fp = runcache.fingerprint(rundata, xclawcmd)
+
+    status, wall, rusage = run_timed(xclawcmd, outdir, threads)
+    if status != 0:
+        raise RuntimeError("*** Run in %s failed with status %i, see "
+                           "xclaw.out" % (outdir, status))
+    runcache.write_fingerprint(outdir, fp)
+
+    metrics = {'wall': wall, 'cpu': rusage.ru_utime + rusage.ru_stime,
+               'peak_rss_mb': peak_rss_mb(rusage)}
+    try:
+        cells = timing.read_timing_csv(outdir)['cells']
+        metrics['cell_updates'] = float(cells[:, -1].sum())
+        metrics['updates_per_second'] = metrics['cell_updates'] / wall
+    except (IOError, IndexError, ValueError):
+        pass
+    if store is not None:
+        table = skill.score(skill.read_output(outdir), store)
+        for row in table:
+            name = 'skill %i %s' % (row['gaugeno'], row['variable'])
+            metrics[name + ' rms'] = float(row['rms'])
+            metrics[name + ' tshift'] = float(row['tshift'])
+    return fp, metrics
+
+
+def summarize(repeats):
+    """
+    Return {metric: {'mean', 'std', 'min', 'max'}} over the list of metrics
+    dictionaries of the repeats.
+    """
+    summary = {}
+    for name in sorted(set().union(*repeats)):
+        values = np.array([r[name] for r in repeats if name in r], dtype=float)
+        values = values[np.isfinite(values)]
+        if len(values):
+            summary[name] = {'mean': float(values.mean()),
+                             'std': float(values.std(ddof=1)) if len(values) > 1
+                             else 0., 'min': float(values.min()),
+                             'max': float(values.max())}
+    return summary
+
+
+def environment(threads):
+    """
+    Return a dictionary describing where and with what the benchmark ran.
+    """
+    try:
+        import clawpack
+        version = getattr(clawpack, '__version__', None)
+    except ImportError:
+        version = None
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=example_dir,
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': socket.gethostname(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'ncpus': os.cpu_count(),
+            'threads': threads, 'clawpack_version': version,
+            'git_commit': commit, 'fflags': os.environ.get('FFLAGS', '')}
+
+
+def read_json(fname, default):
+    """
+    Return the contents of the JSON file fname, or default if it is missing.
+    """
+    if not os.path.isfile(fname):
+        return default
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_json(fname, data):
+    """
+    Write data to the JSON file fname, replacing it atomically.
+    """
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_fname, fname)
+
+
+def append_result(entry, fname=results_file):
+    """
+    Append entry to the list of runs in the results file.
+    """
+    results = read_json(fname, {'version': results_version, 'runs': []})
+    if results.get('version') != results_version:
+        raise ValueError("*** %s has format version %s, expected %i"
+                         % (fname, results.get('version'), results_version))
+    results['runs'].append(entry)
+    write_json(fname, results)
+
+
+def compare_baseline(profile, summary, fname=baselines_file,
+                     threshold=threshold):
+    """
+    Return a list of [metric, baseline mean, mean, relative change, worse]
+    comparing summary with the baseline of profile (empty if none).
+    """
+    baseline = read_json(fname, {}).get(profile)
+    if baseline is None:
+        return []
+    rows = []
+    for name in sorted(set(baseline['summary']) & set(summary)):
+        a = baseline['summary'][name]['mean']
+        b = summary[name]['mean']
+        change = (b - a) / abs(a) if a else 0.
+        if name in smaller_better or name.endswith(' rms'):
+            worse = change > threshold
+        elif name in larger_better:
+            worse = change < -threshold
+        else:
+            continue
+        rows.append([name, a, b, change, bool(worse)])
+    return rows
+
+
+def save_baseline(profile, entry, fname=baselines_file):
+    """
+    Make the summary of entry the baseline of profile.
+    """
+    baselines = read_json(fname, {})
+    baselines[profile] = entry
+    write_json(fname, baselines)
+
+
+def run_benchmark(profile, repeat=1, threads=1, xclawcmd=None,
+                  bench_dir='_benchmark'):
+    """
+    Run profile repeat times and return the entry for the results file.
+    """
+    if profile not in profiles:
+        raise ValueError("*** Unknown profile %s, use one of %s"
+                         % (profile, ', '.join(sorted(profiles))))
+    if xclawcmd is None:
+        xclawcmd = os.path.join(example_dir, 'xgeoclaw')
+    if not os.path.isfile(xclawcmd):
+        raise IOError("*** Missing %s, first do: make .exe" % xclawcmd)
+    profile_dir = os.path.join(bench_dir, profile)
+
+    checkpoint = None
+    if 'setup' in profiles[profile]:
+        checkpoint = setup_checkpoint(profile_dir, profiles[profile]['setup'],
+                                      xclawcmd, threads)
+    store = sweep.open_obs_store()
+
+    repeats = []
+    for k in range(repeat):
+        outdir = os.path.join(profile_dir, 'run_%02i' % k)
+        fp, metrics = run_repeat(profile, outdir, xclawcmd, threads, store,
+                                 checkpoint)
+        print("%s run %i: %.1f s wall" % (profile, k, metrics['wall']))
+        repeats.append(metrics)
+
+    entry = {'profile': profile, 'params': profiles[profile]['params'],
+             'fingerprint': fp, 'repeats': repeats,
+             'summary': summarize(repeats)}
+    entry.update(environment(threads))
+    return entry
+
+
+def print_summary(entry, rows):
+    """
+    Print the summary of entry and its comparison with the baseline.
+    """
+    print('\n%s (%i repeats, %i threads)' % (entry['profile'],
+                                            len(entry['repeats']),
+                                            entry['threads']))
+    for name, s in sorted(entry['summary'].items()):
+        print('  %-28s %12.4g +- %-10.3g min %.4g'
+              % (name, s['mean'], s['std'], s['min']))
+    for name, a, b, change, worse in rows:
+        print('  %-28s baseline %10.4g now %10.4g %+7.1f%% %s'
+              % (name, a, b, 100*change, '*** WORSE' if worse else ''))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark this example.')
+    parser.add_argument('profiles', nargs='*', default=['smoke'],
+                        help='profiles: %s' % ', '.join(sorted(profiles)))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int,
+                        default=int(os.environ.get('OMP_NUM_THREADS', 1)))
+    parser.add_argument('--results', default=results_file)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--xclawcmd', default=None)
+    args = parser.parse_args()
+
+    worse = False
+    for profile in args.profiles:
+        entry = run_benchmark(profile, args.repeat, args.threads,
+                              args.xclawcmd)
+        append_result(entry, args.results)
+        rows = compare_baseline(profile, entry['summary'])
+        print_summary(entry, rows)
+        worse = worse or any(row[4] for row in rows)
+        if args.save_baseline:
+            save_baseline(profile, entry)
+    sys.exit(1 if worse else 0)
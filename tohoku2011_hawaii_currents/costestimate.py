@@ -0,0 +1,277 @@
+"""
+Estimate the cost of a run from its rundata, before running it.
+
+For each AMR level the number of cells is estimated at times every
+sample_dt seconds from t0 to tfinal as the wet cells (from the topo files
+in the topocache, see landlayers.topo_raster) in the part of the domain
+where the level is
+    - forced by a region active at that time with minlevel >= level, or
+    - allowed by a region with maxlevel >= level and the tsunami has
+      arrived (from the travel times of regionplanner.py) no more than
+      regionplanner.trail_time before, so that cells would be flagged.
+Level 1 always covers the whole domain.  The time step on each level is set
+by cfl_desired and the largest wave speed sqrt(g*h) in its part of the
+domain, and with variable_dt_refinement_ratios the time refinement ratio
+is the smallest integer that satisfies it, as GeoClaw chooses them,
+otherwise refinement_ratios_t are used.  This gives the cell updates on
+each level, and the CPU time from the CPU time per cell update.
+
+The CPU time per update and a scale factor for the number of updates on
+each level are calibrated from the timing output of a previous run (see
+timing.py) with
+    python costestimate.py --calibrate _output
+which writes cost_calibration.json, used by later estimates:
+    python costestimate.py                          # the current setrun.py
+    python costestimate.py amr_levels_max=5,6       # members of a sweep
+Without calibration, cost_per_update is used for all levels, so only the
+relative costs are meaningful.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import json
+
+import numpy as np
+
+import topotiles
+import landlayers
+import regionplanner
+import timing
+
+# Times at which the cells are estimated are this far apart (s):
+sample_dt = 600.
+
+# Largest size of the raster on which the wet cells of a level are counted:
+raster_max = 400
+
+# CPU time (s) per cell update if not calibrated:
+cost_per_update = 2.e-6
+
+calibration_file = 'cost_calibration.json'
+
+
+def level_raster(box, dx, dy, nmax=raster_max):
+    """
+    Return the pixel centers xp, yp of a raster over box = [x1, x2, y1, y2]
+    with pixels of size dx by dy, or larger if that needs more than nmax
+    pixels in a direction, and the number of cells in each pixel.
+    """
+    nx = int(min(max(np.ceil((box[1] - box[0]) / dx), 1), nmax))
+    ny = int(min(max(np.ceil((box[3] - box[2]) / dy), 1), nmax))
+    px = (box[1] - box[0]) / nx
+    py = (box[3] - box[2]) / ny
+    xp = box[0] + (np.arange(nx) + 0.5) * px
+    yp = box[2] + (np.arange(ny) + 0.5) * py
+    return xp, yp, (px / dx) * (py / dy)
+
+
+def region_mask(regions, xp, yp, t, level, kind):
+    """
+    Return the mask of the raster xp, yp covered by the regions active at
+    time t with minlevel >= level (kind='forced') or maxlevel >= level
+    (kind='allowed').
+    """
+    k = 0 if kind == 'forced' else 1
+    mask = np.zeros((len(yp), len(xp)), dtype=bool)
+    for r in regions:
+        if r[k] >= level and r[2] <= t <= r[3]:
+            mask |= ((xp >= r[4]) & (xp <= r[5]))[None, :] & \
+                    ((yp >= r[6]) & (yp <= r[7]))[:, None]
+    return mask
+
+
+def raster_arrival(xp, yp, arrival):
+    """
+    Return the arrival time at the raster xp, yp from arrival = (x, y, T)
+    of regionplanner.arrival_times, using the nearest point and, where that
+    is land on the coarse grid of T, the earliest arrival around the raster.
+    """
+    x, y, T = arrival
+    i = np.clip(np.round((xp - x[0]) / (x[1] - x[0])).astype(int), 0, len(x)-1)
+    j = np.clip(np.round((yp - y[0]) / (y[1] - y[0])).astype(int), 0, len(y)-1)
+    Tp = T[j[:, None], i[None, :]]
+    Tb = regionplanner.box_times(x, y, T, [xp[0], xp[-1], yp[0], yp[-1]])[0]
+    fill = np.min(Tb[np.isfinite(Tb)]) if np.isfinite(Tb).any() else np.inf
+    return np.where(np.isfinite(Tp), Tp, fill)
+
+
+def min_cell_size(rundata, dx, dy, box):
+    """
+    Return the smallest width in meters of a dx by dy cell (degrees) in box.
+    """
+    radius = rundata.geo_data.earth_radius
+    lat = np.radians(max(abs(box[2]), abs(box[3])))
+    return radius * np.radians(min(dx * np.cos(lat), dy))
+
+
+def estimate(rundata, calibration=None, arrival=None, dt_sample=sample_dt):
+    """
+    Return a dictionary with the estimated
+        t               sample times, shape (ntimes,)
+        cells           cells on each level at t, shape (nlevels, ntimes)
+        dt              time step on each level
+        steps, updates, cpu     time steps, cell updates and CPU time (s)
+                        on each level
+        cpu_total       total CPU time (s)
+    for rundata, with calibration from calibrate (None to read
+    cost_calibration.json if it exists) and arrival = (x, y, T) travel
+    times (None to use regionplanner.arrival_times for the dtopo file).
+    """
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+    regions = rundata.regiondata.regions
+    gravity = rundata.geo_data.gravity
+    cfl = clawdata.cfl_desired
+    levels = amrdata.amr_levels_max
+
+    if calibration is None:
+        calibration = read_calibration()
+    if arrival is None:
+        arrival = regionplanner.arrival_times(
+            dtopo_path=rundata.dtopo_data.dtopofiles[0][-1], verbose=False)
+
+    t = np.arange(clawdata.t0, clawdata.tfinal, dt_sample) + dt_sample / 2.
+    dx, dy = topotiles.level_resolutions(rundata)
+    boxes = topotiles.level_boxes(rundata)
+    domain = [clawdata.lower[0], clawdata.upper[0],
+              clawdata.lower[1], clawdata.upper[1]]
+
+    cells = np.zeros((levels, len(t)))
+    dt = np.full(levels, np.inf)
+    for level in range(1, levels+1):
+        box = domain if level == 1 else boxes[level-1]
+        if box is None:
+            continue
+        xp, yp, pixel_cells = level_raster(box, dx[level-1], dy[level-1])
+        B = landlayers.topo_raster(box, len(xp), len(yp))[2]
+        wet = ~(B >= 0.)
+        depth = np.nanmax(np.where(wet, -B, 0.))
+        dt_cfl = cfl * min_cell_size(rundata, dx[level-1], dy[level-1], box) \
+            / np.sqrt(gravity * max(depth, 1.))
+        if level == 1:
+            dt[0] = dt_cfl
+            cells[0] = clawdata.num_cells[0] * clawdata.num_cells[1]
+            continue
+        if rundata.refinement_data.variable_dt_refinement_ratios:
+            ratio = np.ceil(dt[level-2] / dt_cfl - 1e-9)
+        else:
+            ratio = amrdata.refinement_ratios_t[level-2]
+        dt[level-1] = dt[level-2] / max(ratio, 1)
+
+        Tp = raster_arrival(xp, yp, arrival)
+        for k, tk in enumerate(t):
+            refined = region_mask(regions, xp, yp, tk, level, 'forced')
+            waved = (Tp <= tk) & (tk - Tp <= regionplanner.trail_time)
+            refined |= waved & region_mask(regions, xp, yp, tk, level,
+                                           'allowed')
+            cells[level-1, k] = np.sum(wet & refined) * pixel_cells
+
+    scale = np.ones(levels)
+    cost = np.full(levels, cost_per_update)
+    if calibration:
+        for name, values in [('scale', scale), ('cost', cost)]:
+            calibrated = np.asarray(calibration[name], dtype=float)[:levels]
+            ok = np.isfinite(calibrated)
+            values[:len(calibrated)][ok] = calibrated[ok]
+
+    steps = np.array([np.sum(cells[L] > 0) * dt_sample / dt[L]
+                      for L in range(levels)])
+    updates = scale * cells.sum(axis=1) * dt_sample / dt
+    cpu = cost * updates
+    return {'t': t, 'cells': cells, 'dt': dt, 'steps': steps,
+            'updates': updates, 'cpu': cpu, 'cpu_total': cpu.sum()}
+
+
+def calibrate(outdir='_output', rundata=None, arrival=None):
+    """
+    Return the calibration from the timing output in outdir: the CPU time
+    per cell update on each level and, if the rundata of the run is given,
+    the ratio of the cell updates to those estimated for it.
+    """
+    timing_data = timing.read_timing_csv(outdir)
+    cpu = timing_data['cpu'][:, -1]
+    updates = timing_data['cells'][:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = np.where(updates > 0, cpu / updates, np.nan)
+    if np.isfinite(cost).any():
+        overall = cpu.sum() / updates.sum()
+        cost = np.where(np.isfinite(cost), cost, overall)
+    scale = np.full(len(cost), np.nan)
+    if rundata is not None:
+        predicted = estimate(rundata, {}, arrival)['updates'][:len(scale)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale[:len(predicted)] = np.where(
+                predicted > 0, updates[:len(predicted)] / predicted, np.nan)
+    return {'cost': [float(c) for c in cost],
+            'scale': [float(s) for s in scale]}
+
+
+def read_calibration(fname=calibration_file):
+    """
+    Return the calibration saved in fname, or {} if there is none.
+    """
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def write_calibration(calibration, fname=calibration_file):
+    """
+    Save the calibration returned by calibrate to fname.
+    """
+    with open(fname, 'w') as f:
+        json.dump(calibration, f, indent=1)
+
+
+def estimate_members(params, calibration=None):
+    """
+    Return the list of member parameters of a sweep over params (see
+    sweep.py) and the estimate for each member.
+    """
+    import sweep
+    members = sweep.make_members(params)
+    return members, [estimate(sweep.make_rundata(member), calibration)
+                     for member in members]
+
+
+def print_estimate(est):
+    """
+    Print the estimate per level and the total CPU time.
+    """
+    print('level      max cells    dt (s)      steps       updates   CPU (s)')
+    for L in range(len(est['dt'])):
+        print('%5i %14.0f %9.3g %10.0f %13.3g %9.0f'
+              % (L+1, est['cells'][L].max(), est['dt'][L], est['steps'][L],
+                 est['updates'][L], est['cpu'][L]))
+    print('total CPU time %.0f s (%.2f hours)'
+          % (est['cpu_total'], est['cpu_total'] / 3600.))
+
+
+if __name__ == '__main__':
+    import argparse
+    import sweep
+    parser = argparse.ArgumentParser(description='Estimate the cost of runs.')
+    parser.add_argument('params', nargs='*', help='name=value1,value2,...')
+    parser.add_argument('--calibrate', metavar='OUTDIR', default=None,
+                        help='calibrate from the timing output in OUTDIR')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        calibration = calibrate(args.calibrate, sweep.make_rundata({}))
+        write_calibration(calibration)
+        print("Wrote %s" % calibration_file)
+
+    params = {}
+    for param in args.params:
+        name, values = param.split('=')
+        params[name] = [sweep.parse_value(v) for v in values.split(',')]
+    members, estimates = estimate_members(params)
+    for member, est in zip(members, estimates):
+        if member:
+            print('\n%s' % json.dumps(member, sort_keys=True))
+        print_estimate(est)
+    if len(members) > 1:
+        print('\nTotal CPU time of %i members: %.2f hours'
+              % (len(members), sum(e['cpu_total'] for e in estimates) / 3600.))
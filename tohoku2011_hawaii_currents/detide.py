@@ -0,0 +1,412 @@
+"""
+Tide removal routines, from TG_DART_tools.py in the archive of the paper.
+
+    fit_tide_poly        polynomial fit, used to detide the ADCP velocities
+    fit_tide_harmonic    fit of tidal harmonic constituents, used to detide
+                         the tide gauge surface elevations
+    get_periods          periods of the tidal harmonic constituents
+
+harmonic_fit and poly_fit fit many series at once (the u and v of all ADCP
+stations, tide gauges, or the gauge output of the members of a sweep).  The
+design matrix and its pseudo-inverse are computed once for each time grid,
+pattern of NaN values and constituent set or degree, and remembered for
+later calls, so each fit is one matrix product.  poly_fit can also read
+long records a chunk at a time.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Degree of the polynomial fit to the ADCP velocities:
+poly_degree = 15
+
+# Constituents and SVD tolerance used for the tide gauges near Hawaii:
+constituents_hawaii = ['J1','K1','K2','M2','N2','O1','P1','Q1','S2','SA']
+svd_tol_hawaii = 1e-5
+
+# Number of design matrices and pseudo-inverses remembered:
+max_cached = 32
+
+# Design matrices and pseudo-inverses, by time grid, constituents, ...:
+_cache = OrderedDict()
+
+
+def nan_groups(valid):
+    """
+    Return a list of [mask, cols] grouping the columns of the boolean array
+    valid (True where a series has a value) that have the same mask.
+    """
+    packed = np.packbits(valid, axis=0)
+    groups = {}
+    for j in range(valid.shape[1]):
+        groups.setdefault(packed[:,j].tobytes(), []).append(j)
+    if len(groups) == 1:
+        return [[valid[:,0], slice(None)]]   # avoid copying the columns
+    return [[valid[:,cols[0]], np.array(cols)] for cols in groups.values()]
+
+
+def poly_basis(t, tpts):
+    """
+    Return the Newton polynomial basis matrix with columns 1, (t - tpts[1]),
+    (t - tpts[1])*(t - tpts[2]), ... for the scaled times t.
+    """
+    A = np.empty((len(t), len(tpts)))
+    A[:,0] = 1.
+    A[:,1:] = t[:,None] - tpts[None,1:]
+    return np.cumprod(A, axis=1)
+
+
+def poly_points(t, degree, mask=None):
+    """
+    Return the scale factor of the times and the Newton points (in the
+    scaled times) for a fit of the given degree to the times t[mask].
+    """
+    t_valid = t if mask is None else t[mask]
+    # Scale data so matrix better conditioned:
+    scale_factor = abs(t_valid).max()
+    tpts = np.linspace(t_valid.min(), t_valid.max(), degree+1) / scale_factor
+    return scale_factor, tpts
+
+
+def poly_pinv(t, degree, mask=None):
+    """
+    Return the pseudo-inverse of the Newton basis matrix for the times
+    t[mask], with the cutoff used by numpy.linalg.lstsq, together with the
+    scale factor and Newton points.  Cached for each time grid, mask and
+    degree.
+    """
+    def compute():
+        scale_factor, tpts = poly_points(t, degree, mask)
+        t_valid = t if mask is None else t[mask]
+        A = poly_basis(t_valid / scale_factor, tpts)
+        rcond = np.finfo(float).eps * max(A.shape)
+        return np.linalg.pinv(A, rcond=rcond), scale_factor, tpts
+
+    key = ('poly_pinv', _array_key(t, mask if mask is not None else []), degree)
+    return _cached(key, compute)
+
+
+def poly_r(t, degree, mask, chunk_size):
+    """
+    Return the triangular factor R of the QR factorization of the Newton
+    basis matrix for the times t[mask], computed chunk_size times at a time,
+    together with the scale factor and Newton points.  Cached for each time
+    grid, mask and degree.
+    """
+    def compute():
+        scale_factor, tpts = poly_points(t, degree, mask)
+        R = np.zeros((0, degree+1))
+        for i in range(0, len(t), chunk_size):
+            tc = t[i:i+chunk_size]
+            if mask is not None:
+                tc = tc[mask[i:i+chunk_size]]
+            A = poly_basis(tc / scale_factor, tpts)
+            R = np.linalg.qr(np.vstack([R, A]), mode='r')
+        return R, scale_factor, tpts
+
+    key = ('poly_r', _array_key(t, mask if mask is not None else []), degree)
+    return _cached(key, compute)
+
+
+def _poly_fit_streaming(t, eta, cols, mask, degree, chunk_size):
+    """
+    Return the coefficients of the fit to the series eta[:,cols] with valid
+    values t[mask], reading chunk_size times at a time, from the corrected
+    seminormal equations R.T*R*c = A.T*eta with R from poly_r.
+    """
+    R, scale_factor, tpts = poly_r(t, degree, mask, chunk_size)
+
+    def solve(rhs):
+        return np.linalg.solve(R, np.linalg.solve(R.T, rhs))
+
+    def residual_product(c):
+        # A.T * (eta - A*c), one chunk at a time:
+        rhs = 0.
+        for i in range(0, len(t), chunk_size):
+            m = slice(i, i+chunk_size) if mask is None else \
+                np.nonzero(mask[i:i+chunk_size])[0] + i
+            A = poly_basis(t[m] / scale_factor, tpts)
+            y = np.asarray(eta[m][:,cols], dtype=float)
+            if c is not None:
+                y = y - np.dot(A, c)
+            rhs = rhs + np.dot(A.T, y)
+        return rhs
+
+    c = solve(residual_product(None))
+    # one step of iterative refinement:
+    c += solve(residual_product(c))
+    return c, scale_factor, tpts
+
+
+def poly_fit(t, eta, degree=poly_degree, chunk_size=None):
+    """
+    Fit a polynomial of the specified degree to each column of eta, of shape
+    (len(t),) or (len(t), number of series), ignoring NaN values, and return
+    the fits (same shape as eta, defined at all times).
+
+    As in fit_tide_poly, the polynomial is in the Newton basis of degree+1
+    points equally spaced over the valid times of each series.  Series with
+    the same NaN values are solved together as one matrix product with the
+    same pseudo-inverse, which is cached for each time grid and degree.
+
+    If chunk_size is given, the basis matrix is never formed for all times:
+    eta (e.g. memory-mapped) is read chunk_size times at a time, and the fit
+    is found from the triangular factor of the basis matrix, also cached.
+    """
+    t = np.asarray(t, dtype=float)
+    single = np.ndim(eta) == 1
+    if single:
+        eta = np.asarray(eta, dtype=float)[:,None]
+    ncols = eta.shape[1]
+
+    # Group the series by their NaN values:
+    if chunk_size is None:
+        eta = np.asarray(eta, dtype=float)
+        valid = ~np.isnan(eta)
+    else:
+        valid = np.empty((len(t), ncols), dtype=bool)
+        for i in range(0, len(t), chunk_size):
+            valid[i:i+chunk_size] = ~np.isnan(eta[i:i+chunk_size])
+
+    eta_fit = np.empty((len(t), ncols))
+    for mask, cols in nan_groups(valid):
+        if not mask.any():
+            eta_fit[:,cols] = np.nan
+            continue
+        if mask.all():
+            mask = None
+        if chunk_size is None:
+            pinv, scale_factor, tpts = poly_pinv(t, degree, mask)
+            y = eta[:,cols] if mask is None else eta[mask][:,cols]
+            c = np.dot(pinv, y)
+        else:
+            c, scale_factor, tpts = _poly_fit_streaming(t, eta, cols, mask,
+                                                        degree, chunk_size)
+        step = len(t) if chunk_size is None else chunk_size
+        for i in range(0, len(t), step):
+            A = poly_basis(t[i:i+step] / scale_factor, tpts)
+            eta_fit[i:i+step, cols] = np.dot(A, c)
+
+    if single:
+        return eta_fit[:,0]
+    return eta_fit
+
+
+def fit_tide_poly(t, eta, degree):
+    """
+    Fit a polynomial of the specified degree to data
+    Returns the polynomial fit eta_fit.
+    As in TG_DART_tools.py, for one series; see poly_fit for many.
+    """
+    eta = np.asarray(eta, dtype=float)
+    num_nan = np.isnan(eta).sum()
+    if num_nan:
+        print("Ignoring %i NaN values" % num_nan)
+    return poly_fit(t, eta, degree)
+
+
+def harmonic_matrix(t, periods):
+    """
+    Return the matrix with columns 1, sin(2*pi*t/P), cos(2*pi*t/P) for the
+    period P of each constituent in the list periods.
+    """
+    t = np.asarray(t, dtype=float)
+    theta = 2*np.pi * t[:,None] / np.asarray(periods, dtype=float)[None,:]
+    A = np.empty((len(t), 2*len(periods)+1))
+    A[:,0] = 1.
+    A[:,1::2] = np.sin(theta)
+    A[:,2::2] = np.cos(theta)
+    return A
+
+
+def _cached(key, compute):
+    """
+    Return _cache[key], computing it with compute() if needed, and keep
+    only the max_cached most recently used entries.
+    """
+    try:
+        value = _cache.pop(key)
+    except KeyError:
+        value = compute()
+    _cache[key] = value
+    while len(_cache) > max_cached:
+        _cache.popitem(last=False)
+    return value
+
+
+def _array_key(*arrays):
+    """
+    Return a hash of the values of the arrays, for keys of _cache.
+    """
+    sha = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        sha.update(repr((a.dtype.str, a.shape)).encode())
+        sha.update(a.tobytes())
+    return sha.hexdigest()
+
+
+def harmonic_pinv(t, periods, svd_tol, mask=None):
+    """
+    Return the truncated SVD pseudo-inverse of harmonic_matrix(t[mask],
+    periods), throwing away singular values below svd_tol relative to the
+    largest, and the number of singular values kept.  Cached for each time
+    grid, mask, constituent set and tolerance.
+    """
+    t = np.asarray(t, dtype=float)
+    if mask is None:
+        mask = np.ones(len(t), dtype=bool)
+
+    def compute():
+        A = harmonic_matrix(t[mask], periods)
+        U, S, V = np.linalg.svd(A, full_matrices=False)
+        keep = S/S[0] > svd_tol
+        pinv = np.dot(V[keep,:].T / S[keep], U[:,keep].T)
+        return pinv, int(keep.sum())
+
+    key = ('harmonic_pinv', _array_key(t, mask, np.asarray(periods, float)),
+           svd_tol)
+    return _cached(key, compute)
+
+
+def harmonic_fit(t, eta, periods=None, svd_tol=0.01, verbose=False):
+    """
+    Fit the harmonic constituents with the given periods (dictionary, in
+    hours; default all constituents of get_periods) to each column of eta,
+    of shape (len(t),) or (len(t), number of series), ignoring NaN values.
+    Returns eta_fit (same shape as eta, defined at all times) and the
+    coefficients c of shape (2*len(periods)+1,) or (2*len(periods)+1,
+    number of series) of the columns of harmonic_matrix, in the order of
+    sorted(periods.keys()).
+
+    Series with the same NaN values are solved together as one matrix
+    product with the same pseudo-inverse.
+    """
+    if periods is None:
+        periods = get_periods()
+    names = sorted(periods.keys())
+    P = [periods[name] for name in names]
+
+    t = np.asarray(t, dtype=float)
+    eta = np.asarray(eta, dtype=float)
+    single = eta.ndim == 1
+    eta = eta.reshape(len(t), -1)
+
+    # Group the series by their NaN values:
+    valid = ~np.isnan(eta)
+
+    c = np.zeros((2*len(P)+1, eta.shape[1]))
+    for mask, cols in nan_groups(valid):
+        if not mask.any():
+            c[:,cols] = np.nan
+            continue
+        pinv, num_sv = harmonic_pinv(t, P, svd_tol, None if mask.all() else mask)
+        c[:,cols] = np.dot(pinv, eta[mask][:,cols])
+        if verbose:
+            print("Inverting using %s singular values out of %s"
+                  % (num_sv, pinv.shape[0]))
+
+    A = _cached(('harmonic_matrix', _array_key(t, np.asarray(P, float))),
+                lambda: harmonic_matrix(t, P))
+    eta_fit = np.dot(A, c)
+    if single:
+        return eta_fit[:,0], c[:,0]
+    return eta_fit, c
+
+
+def harmonic_constants(c, periods, t0=0):
+    """
+    Return offset, amplitude, phase for the coefficients c of harmonic_fit
+    of one series, so that the fit has the form
+        eta_fit = offset + sum_k amplitude[k] * cos(2*pi*(t - t0) + phase[k])
+    where the sum is over all harmonic constituents in periods.keys().
+    """
+    names = sorted(periods.keys())
+    c_sin = c[1::2]
+    c_cos = c[2::2]
+    c_cos = np.where(abs(c_cos) < 1e-10, 1e-10, c_cos)
+    phi = -np.arctan(c_sin / c_cos) * 180./np.pi
+    phi = np.where(c_cos < 0., phi+180, phi)
+
+    offset = c[0]  # constant term in fit
+    phase = {}
+    amplitude = {}
+    for i, name in enumerate(names):
+        amplitude[name] = np.sqrt(c_sin[i]**2 + c_cos[i]**2)
+        phase[name] = phi[i] + 360.*t0/periods[name]
+    return offset, amplitude, phase
+
+
+def fit_tide_harmonic(t, eta, periods, t0=0, svd_tol=0.01):
+    """
+    Fit the harmonic constituents with the given periods (dictionary, in
+    hours) to data, using an SVD based pseudo-inverse that throws away
+    singular values below svd_tol relative to the largest.
+    Returns eta_fit, amplitude, phase, offset so that
+        eta_fit = offset + sum_k amplitude[k] * cos(2*pi*(t - t0) + phase[k])
+    As in TG_DART_tools.py, for one series; see harmonic_fit for many.
+    """
+    eta_fit, c = harmonic_fit(t, eta, periods, svd_tol, verbose=True)
+    offset, amplitude, phase = harmonic_constants(c, periods, t0)
+    return eta_fit, amplitude, phase, offset
+
+
+def get_periods():
+    """
+    Returns dictionary of tidal harmonic constituent periods (in hours).
+    """
+
+    periods = { \
+        'K1': 23.9344697,
+        'O1': 25.8193417,
+        'M2': 12.4206012,
+        'S2': 12.0000000,
+        'M3': 08.2804008,
+        'M4': 06.2103006,
+        '2MK5': 04.9308802,
+        'M6': 04.1402004,
+        '3MK7': 03.10515030,
+        'M8': 03.1051503,
+        'N2': 12.6583482,
+        'Q1': 26.8683567,
+        'MK3': 08.1771399,
+        'S4': 06.0000000,
+        'MN4': 06.2691739,
+        'NU2': 12.6260044,
+        'S6': 04.0000000,
+        'MU2': 12.8717576,
+        '2N2': 12.9053745,
+        'OO1': 22.3060742,
+        'LAM2': 12.2217742,
+        'S1': 24.0000000,
+        'M1': 24.8332484,
+        'J1': 23.0984768,
+        'MM': 661.3092049,
+        'SSA': 4382.9052087,
+        'SA': 8765.8210896,
+        'MSF': 354.3670522,
+        'MF': 327.8589689,
+        'RHO': 26.7230533,
+        'T2': 12.0164492,
+        'R2': 11.9835958,
+        '2Q1': 28.0062225,
+        'P1': 24.0658902,
+        '2SM2': 11.6069516,
+        'L2': 12.1916202,
+        '2MK3': 08.3863030,
+        'K2': 11.9672348,
+        'MS4': 06.1033393,
+        }
+    return periods
+
+
+def periods_hawaii():
+    """
+    Returns dictionary of the periods of constituents_hawaii.
+    """
+    periods = get_periods()
+    return dict((k, periods[k]) for k in constituents_hawaii)
@@ -0,0 +1,204 @@
+"""
+Build fgmax grids on the cell centers of an AMR level, without the land.
+
+GeoClaw updates the maxima at each fgmax point on every step of the finest
+level checked, interpolating from the grid cells when the points are not
+cell centers.  A grid made here covers a bounding box or polygon with the
+cell centers of one AMR level (by default the finest level allowed there by
+the regions), from the domain and refinement_ratios_x/y of rundata, so the
+values are those of the cells themselves.  Points on land higher than
+land_max, where the tsunami cannot reach, are left out using the topo files
+in the topocache (see landlayers.topo_raster), as are the points outside
+the polygon.  The points are given to GeoClaw as a mask file
+(point_style = 4), written to the fgmax subdirectory of the topocache
+directory and named by a hash of the points.
+
+setrun.py appends the grid over Kahului harbor plotted by plot_fgmax.py if
+use_fgmax_grid = True (off by default, since it reads the topocache, which
+make topo creates, every time setrun() is called), or call e.g.
+    fg = make_fgmax_grid(rundata, polygon=[(203.52, 20.89), ...])
+    rundata.fgmax_data.fgmax_grids.append(fg)
+after the domain, AMR parameters and regions are set.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import hashlib
+
+import numpy as np
+
+import topocache
+import topotiles
+import landlayers
+from fgmaxreduce import kahului_bbox
+
+# Directory for the mask files:
+masks_dir = os.path.join(topocache.cache_dir, 'fgmax')
+
+# Points with topography above this (m) are not fgmax points:
+land_max = 10.
+
+
+def polygon_bbox(polygon):
+    """
+    Return the bounding box [x1, x2, y1, y2] of a list of vertices (x, y).
+    """
+    xv, yv = np.asarray(polygon, dtype=float).T
+    return [xv.min(), xv.max(), yv.min(), yv.max()]
+
+
+def inside_polygon(x, y, polygon):
+    """
+    Return a boolean array, True where the points x, y (arrays of the same
+    shape) are inside the polygon given by a list of vertices (x, y).
+    """
+    xv, yv = np.asarray(polygon, dtype=float).T
+    inside = np.zeros(np.shape(x), dtype=bool)
+    for k in range(len(xv)):
+        xa, ya = xv[k-1], yv[k-1]
+        xb, yb = xv[k], yv[k]
+        # Even-odd rule, counting crossings of a ray to the right:
+        crosses = (ya > y) != (yb > y)
+        if ya != yb:
+            xc = xa + (y - ya) * (xb - xa) / (yb - ya)
+            inside ^= crosses & (x < xc)
+    return inside
+
+
+def finest_level(rundata, bbox):
+    """
+    Return the finest AMR level allowed by the regions anywhere in
+    bbox = [x1, x2, y1, y2].
+    """
+    finest = 1
+    for level, box in enumerate(topotiles.level_boxes(rundata), start=1):
+        if box is not None and box[0] < bbox[1] and box[1] > bbox[0] \
+                and box[2] < bbox[3] and box[3] > bbox[2]:
+            finest = level
+    return finest
+
+
+def level_start_time(rundata, level, bbox):
+    """
+    Return the earliest time at which the regions allow level in bbox
+    (0 if no region does, as then any level is allowed at any time).
+    """
+    times = [r[2] for r in rundata.regiondata.regions
+             if r[1] >= level and r[4] < bbox[1] and r[5] > bbox[0]
+             and r[6] < bbox[3] and r[7] > bbox[2]]
+    return min(times) if times else 0.
+
+
+def cell_centers(rundata, level, bbox):
+    """
+    Return the 1-d arrays x, y of the centers of the cells on AMR level
+    whose centers are in bbox = [x1, x2, y1, y2].
+    """
+    clawdata = rundata.clawdata
+    dx, dy = topotiles.level_resolutions(rundata)
+    dx, dy = dx[level-1], dy[level-1]
+    x0, y0 = clawdata.lower[0], clawdata.lower[1]
+    i1 = int(np.ceil((bbox[0] - x0) / dx - 0.5))
+    i2 = int(np.floor((bbox[1] - x0) / dx - 0.5))
+    j1 = int(np.ceil((bbox[2] - y0) / dy - 0.5))
+    j2 = int(np.floor((bbox[3] - y0) / dy - 0.5))
+    x = x0 + (np.arange(i1, i2+1) + 0.5) * dx
+    y = y0 + (np.arange(j1, j2+1) + 0.5) * dy
+    return x, y
+
+
+def fgmax_points(rundata, bbox=None, polygon=None, level=None,
+                 land_max=land_max):
+    """
+    Return x, y (1-d arrays of cell centers on level) and the mask of shape
+    (len(y), len(x)) of the fgmax points in bbox, or in polygon if given,
+    that are not on land higher than land_max.  bbox is the Kahului harbor
+    box if both are None, and level the finest level allowed there if None.
+    """
+    if polygon is not None:
+        bbox = polygon_bbox(polygon)
+    elif bbox is None:
+        bbox = kahului_bbox
+    if level is None:
+        level = finest_level(rundata, bbox)
+    x, y = cell_centers(rundata, level, bbox)
+    if len(x) == 0 or len(y) == 0:
+        raise ValueError("*** No level %i cell centers in %s" % (level, bbox))
+
+    # Raster whose pixel centers are the cell centers:
+    dx = (x[-1] - x[0]) / max(len(x) - 1, 1)
+    dy = (y[-1] - y[0]) / max(len(y) - 1, 1)
+    raster = [x[0] - dx/2, x[-1] + dx/2, y[0] - dy/2, y[-1] + dy/2]
+    B = landlayers.topo_raster(raster, len(x), len(y))[2]
+    mask = ~(B > land_max)
+    if polygon is not None:
+        X, Y = np.meshgrid(x, y)
+        mask &= inside_polygon(X, Y, polygon)
+    return x, y, mask
+
+
+def write_mask(x, y, mask):
+    """
+    Write the mask as a topo_type 3 file of 1s and 0s in masks_dir, if it
+    does not already exist, and return its path.
+    """
+    dx = (x[-1] - x[0]) / max(len(x) - 1, 1)
+    dy = (y[-1] - y[0]) / max(len(y) - 1, 1)
+    key = hashlib.sha256(repr(['%.10f' % x[0], '%.10f' % y[0],
+                               '%.12e' % dx, '%.12e' % dy, len(x),
+                               len(y)]).encode() + mask.tobytes())
+    fname = os.path.join(masks_dir, 'fgmax_mask.%s.tt3'
+                         % key.hexdigest()[:16])
+    if os.path.isfile(fname):
+        return fname
+
+    from clawpack.geoclaw import topotools
+    if not os.path.isdir(masks_dir):
+        os.makedirs(masks_dir)
+    topo = topotools.Topography()
+    topo.set_xyZ(x, y, mask.astype(int))
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    topo.write(tmp_fname, topo_type=3, Z_format='%1i')
+    os.replace(tmp_fname, fname)
+    return fname
+
+
+def make_fgmax_grid(rundata, bbox=None, polygon=None, level=None,
+                    land_max=land_max, dt_check=0., arrival_tol=1e-2):
+    """
+    Return an fgmax_tools.FGmaxGrid with the points of fgmax_points, checked
+    on level from the time the regions first allow it there.
+    """
+    from clawpack.geoclaw import fgmax_tools
+    if polygon is not None:
+        box = polygon_bbox(polygon)
+    else:
+        box = kahului_bbox if bbox is None else bbox
+    if level is None:
+        level = finest_level(rundata, box)
+    x, y, mask = fgmax_points(rundata, bbox, polygon, level, land_max)
+
+    fg = fgmax_tools.FGmaxGrid()
+    fg.point_style = 4
+    fg.xy_fname = write_mask(x, y, mask)
+    fg.min_level_check = level
+    fg.tstart_max = level_start_time(rundata, level, box)
+    fg.tend_max = 1.e10
+    fg.dt_check = dt_check
+    fg.interp_method = 0     # the points are cell centers
+    fg.arrival_tol = arrival_tol
+    return fg
+
+
+def set_fgmax_grids(rundata, bbox=None, polygon=None, level=None):
+    """
+    Append the grid of make_fgmax_grid to rundata.fgmax_data.fgmax_grids
+    and return it.  Must be called after the domain, AMR parameters and
+    regions are set.
+    """
+    fgmax_grids = rundata.fgmax_data.fgmax_grids
+    fg = make_fgmax_grid(rundata, bbox, polygon, level)
+    fg.fgno = len(fgmax_grids) + 1
+    fgmax_grids.append(fg)
+    return fg
@@ -0,0 +1,233 @@
+"""
+Maxima and arrival times on a target grid, reduced from the frame output.
+
+This computes after the run what an fgmax grid computes in the solver, from
+the binary frames in outdir (see framereader.py), for a rectilinear grid of
+points such as the Kahului harbor box used by plot_fgmax.py.  At each point
+and frame the values are taken from the cell containing the point on the
+finest patch covering it, and the running values kept are:
+    h               maximum depth
+    s               maximum speed
+    hss             maximum momentum flux h*s**2
+    arrival_time    first frame time at which the point is wet and
+                    abs(eta - sea_level) > arrival_tol
+    B               topography, eta - h on the finest level seen
+Each frame is one job on a process pool that only reads the patches
+intersecting the target grid from the memory-mapped frame.  At most
+max_pending frames are in flight at a time and each is folded into the
+running values as soon as it is done, so the memory used does not grow with
+the number of frames.  The reductions do not depend on the order of the
+frames.
+
+The results are written to outdir/fgmax_frames.npz, which plot_fgmax.py
+reads when there is no solver fgmax output:
+    python fgmaxreduce.py _output
+    python fgmaxreduce.py _output --bbox 203.515 203.5443 20.885 20.91 --dx 1
+
+Note that the values are only sampled at the output times, so the maxima
+and arrival times are only as good as the frame spacing.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import framereader
+
+# Target grid over Kahului harbor, as plotted by plot_fgmax.py, and its
+# spacing in degrees (1/3 arcsecond, the finest level of the paper):
+kahului_bbox = [203.515, 203.5443, 20.885, 20.91]
+kahului_dx = 1./(3*3600)
+
+# As in geo_data in setrun.py:
+dry_tolerance = 0.001
+sea_level = 0.
+
+# A point has arrived when abs(eta - sea_level) first exceeds this (m):
+arrival_tol = 0.01
+
+results_file = 'fgmax_frames.npz'
+
+
+def target_grid(bbox=kahului_bbox, dx=kahului_dx, dy=None):
+    """
+    Return the 1-d arrays x, y of the target grid covering
+    bbox = [x1, x2, y1, y2] with spacing dx, dy (dy = dx if None).
+    """
+    if dy is None:
+        dy = dx
+    x1, x2, y1, y2 = bbox
+    x = x1 + dx * np.arange(int(np.floor((x2 - x1) / dx + 1e-9)) + 1)
+    y = y1 + dy * np.arange(int(np.floor((y2 - y1) / dy + 1e-9)) + 1)
+    return x, y
+
+
+def sample_frame(frameno, outdir, x, y):
+    """
+    Return t, level and q at the points of the grid x, y (1-d arrays) for
+    frame frameno, where level and q have shapes (len(y), len(x)) and
+    (meqn, len(y), len(x)), from the finest patch covering each point
+    (level 0 and nan where no patch does).
+    """
+    frame = framereader.read_frame(frameno, outdir)
+    bbox = [x[0], x[-1], y[0], y[-1]]
+    level = np.zeros((len(y), len(x)), dtype=int)
+    q = np.full((frame.meqn, len(y), len(x)), np.nan)
+    # select returns the patches ordered by level, so finer patches
+    # overwrite coarser ones:
+    for patch, qp in frame.patches(bbox=bbox):
+        xhi = patch['xlow'] + patch['mx'] * patch['dx']
+        yhi = patch['ylow'] + patch['my'] * patch['dy']
+        i1, i2 = np.searchsorted(x, [patch['xlow'], xhi])
+        j1, j2 = np.searchsorted(y, [patch['ylow'], yhi])
+        if i1 == i2 or j1 == j2:
+            continue
+        i = ((x[i1:i2] - patch['xlow']) / patch['dx']).astype(int)
+        j = ((y[j1:j2] - patch['ylow']) / patch['dy']).astype(int)
+        i = np.minimum(i, patch['mx'] - 1)
+        j = np.minimum(j, patch['my'] - 1)
+        q[:, j1:j2, i1:i2] = qp[:, i[:, None], j[None, :]].transpose(0, 2, 1)
+        level[j1:j2, i1:i2] = patch['level']
+    return frame.t, level, q
+
+
+def reduce_frame(frameno, outdir, x, y, dry_tolerance=dry_tolerance,
+                 sea_level=sea_level, arrival_tol=arrival_tol):
+    """
+    Return a dictionary with the values of frame frameno at the points of the
+    grid x, y that are folded into the running values by fold.
+    """
+    t, level, q = sample_frame(frameno, outdir, x, y)
+    h, hu, hv, eta = q[0], q[1], q[2], q[3]
+    wet = h > dry_tolerance
+    h_safe = np.where(wet, h, 1.)
+    s = np.where(wet, np.hypot(hu, hv) / h_safe, 0.)
+    s = np.where(np.isnan(h), np.nan, s)
+    arrived = wet & (np.abs(eta - sea_level) > arrival_tol)
+    return {'h': h, 's': s, 'hss': h * s**2,
+            'arrival_time': np.where(arrived, t, np.inf),
+            'level': level, 'B': eta - h, 't': t}
+
+
+def fold(result, values):
+    """
+    Fold the values of one frame (from reduce_frame) into result in place.
+    """
+    for name in ['h', 's', 'hss']:
+        np.fmax(result[name], values[name], out=result[name])
+    np.minimum(result['arrival_time'], values['arrival_time'],
+               out=result['arrival_time'])
+    # Keep B from the finest level, and from the latest frame on that level:
+    finer = (values['level'] > result['level']) | \
+            ((values['level'] == result['level']) & (values['t'] >= result['t']))
+    finer &= values['level'] > 0
+    result['B'][finer] = values['B'][finer]
+    result['t'][finer] = values['t']
+    result['level'][finer] = values['level'][finer]
+
+
+def reduce_frames(outdir='_output', x=None, y=None, framenos=None,
+                  nproc=None, max_pending=None, **kwargs):
+    """
+    Return a dictionary with x, y and the running values (see the module
+    docstring) over the frames framenos (all if None) in outdir on the grid
+    x, y (the Kahului grid if None), with frames reduced on nproc processes
+    and at most max_pending (default 2 per process) in flight.  kwargs are
+    passed to reduce_frame.
+    """
+    if x is None or y is None:
+        x, y = target_grid()
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if framenos is None:
+        framenos = framereader.frame_numbers(outdir)
+    if nproc is None:
+        nproc = os.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * nproc
+
+    shape = (len(y), len(x))
+    result = {'h': np.full(shape, np.nan), 's': np.full(shape, np.nan),
+              'hss': np.full(shape, np.nan),
+              'arrival_time': np.full(shape, np.inf),
+              'level': np.zeros(shape, dtype=int),
+              'B': np.full(shape, np.nan), 't': np.full(shape, -np.inf)}
+
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        pending = set()
+        todo = iter(framenos)
+        while True:
+            for frameno in todo:
+                pending.add(pool.submit(reduce_frame, frameno, outdir, x, y,
+                                        **kwargs))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                fold(result, future.result())
+
+    result['arrival_time'][np.isinf(result['arrival_time'])] = np.nan
+    del result['t']
+    result['x'] = x
+    result['y'] = y
+    result['framenos'] = np.asarray(framenos, dtype=int)
+    return result
+
+
+def write_results(result, outdir='_output'):
+    """
+    Write the result of reduce_frames to outdir/fgmax_frames.npz.
+    """
+    fname = os.path.join(outdir, results_file)
+    tmp_fname = fname + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp_fname, **result)
+    os.replace(tmp_fname, fname)
+
+
+class FGmaxResults(object):
+    """
+    The results in outdir/fgmax_frames.npz, with the attributes X, Y, B, h,
+    s, hss and arrival_time of shape (len(y), len(x)) used by plot_fgmax.py,
+    as for a clawpack.geoclaw.fgmax_tools.FGmaxGrid.
+    """
+
+    def __init__(self, outdir='_output'):
+        fname = os.path.join(outdir, results_file)
+        if not os.path.isfile(fname):
+            raise IOError("*** Missing %s, run: python fgmaxreduce.py %s"
+                          % (fname, outdir))
+        with np.load(fname) as f:
+            for name in f.files:
+                setattr(self, name, f[name])
+        self.X, self.Y = np.meshgrid(self.x, self.y)
+
+
+def read_results(outdir='_output'):
+    """
+    Return the FGmaxResults written to outdir by write_results.
+    """
+    return FGmaxResults(outdir)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Reduce the frames to maxima on a target grid.')
+    parser.add_argument('outdir', nargs='?', default='_output')
+    parser.add_argument('--bbox', type=float, nargs=4, default=kahului_bbox,
+                        metavar=('X1', 'X2', 'Y1', 'Y2'))
+    parser.add_argument('--dx', type=float, default=kahului_dx*3600,
+                        help='spacing of the target grid in arcseconds')
+    parser.add_argument('--nproc', type=int, default=None)
+    args = parser.parse_args()
+    x, y = target_grid(args.bbox, args.dx / 3600.)
+    result = reduce_frames(args.outdir, x, y, nproc=args.nproc)
+    write_results(result, args.outdir)
+    print("Reduced %i frames onto %i x %i points, wrote %s"
+          % (len(result['framenos']), len(x), len(y),
+             os.path.join(args.outdir, results_file)))
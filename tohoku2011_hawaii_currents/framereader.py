@@ -0,0 +1,244 @@
+"""
+Lazy reader for GeoClaw frames written with clawdata.output_format = 'binary'.
+
+For binary output GeoClaw writes the patch headers to fort.qNNNN, the time
+and sizes to fort.tNNNN and the q values of all patches to fort.bNNNN.
+read_frame only parses the headers.  The q values are memory-mapped, and the
+values of a patch are only read from disk when they are used, so selecting
+the patches on some levels or in a bounding box costs nothing for the
+patches that are not selected.
+
+Example:
+    frame = read_frame(10, '_output')
+    for patch, q in frame.patches(levels=[5,6], bbox=[203.48,203.57,20.88,20.94]):
+        h = q[0,:,:]    # shape (mx, my), a view into the memory map
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+# Fields of the patch table of a frame:
+patch_dtype = np.dtype([('gridno', int), ('level', int), ('mx', int),
+                        ('my', int), ('xlow', float), ('ylow', float),
+                        ('dx', float), ('dy', float), ('offset', np.int64)])
+
+header_keys = ['grid_number', 'AMR_level', 'mx', 'my', 'xlow', 'ylow',
+               'dx', 'dy']
+
+
+def read_time_file(fname):
+    """
+    Return the values in a fort.tNNNN file as a dictionary.
+    """
+    tdata = {}
+    with open(fname) as f:
+        for line in f:
+            tokens = line.split()
+            if len(tokens) >= 2:
+                tdata[tokens[1]] = tokens[0]
+    return tdata
+
+
+def read_patch_headers(fname):
+    """
+    Return the patch table (with offset not yet set) from the headers in a
+    fort.qNNNN file written with binary output.
+    """
+    with open(fname) as f:
+        tokens = f.read().split()
+    values = np.array(tokens[0::2])
+    keys = tokens[1::2]
+    npatches = len(keys) // len(header_keys)
+    if keys != header_keys * npatches:
+        raise IOError("*** %s does not contain only patch headers, "
+                      "was output_format = 'binary'?" % fname)
+    values = values.reshape(npatches, len(header_keys))
+
+    patches = np.zeros(npatches, dtype=patch_dtype)
+    patches['gridno'] = values[:,0].astype(int)
+    patches['level'] = values[:,1].astype(int)
+    patches['mx'] = values[:,2].astype(int)
+    patches['my'] = values[:,3].astype(int)
+    for k, name in enumerate(['xlow', 'ylow', 'dx', 'dy']):
+        patches[name] = np.char.replace(values[:,4+k], 'D', 'E').astype(float)
+    return patches
+
+
+class Frame(object):
+    """
+    One frame of binary output, with attributes
+        t: time of the frame
+        meqn: number of components of q (including eta if it was written)
+        patch_table: structured array with one entry per patch and fields
+            gridno, level, mx, my, xlow, ylow, dx, dy, offset
+            sorted by level and xlow
+    If use_index==True the patch table is read from the patch index file
+    written by write_index (see patchindex.py) if there is one.
+    """
+
+    def __init__(self, frameno, outdir='_output', use_index=True):
+        self.frameno = frameno
+        self.outdir = outdir
+        self._data = None
+        if use_index and self.read_index():
+            return
+
+        tdata = read_time_file(self.fname('t'))
+        self.t = float(tdata['time'].replace('D', 'E'))
+        self.meqn = int(tdata['meqn'])
+        nghost = int(tdata.get('nghost', 2))
+
+        self.patch_table = read_patch_headers(self.fname('q'))
+        if not os.path.isfile(self.fname('b')):
+            raise IOError("*** Missing %s, was output_format = 'binary'?"
+                          % self.fname('b'))
+
+        # Depending on the version, GeoClaw writes the patches with or
+        # without ghost cells, and with eta appended to q or not, so check
+        # which from the size of the file:
+        mx = self.patch_table['mx']
+        my = self.patch_table['my']
+        nvalues = os.path.getsize(self.fname('b')) // 8
+        for meqn, g in [(self.meqn, nghost), (self.meqn+1, nghost),
+                        (self.meqn, 0), (self.meqn+1, 0)]:
+            if nvalues == meqn * np.sum((mx + 2*g) * (my + 2*g)):
+                break
+        else:
+            raise IOError("*** Size of %s does not match the patch headers"
+                          % self.fname('b'))
+        self.meqn = meqn
+        self.nghost = g
+        sizes = self.meqn * (mx + 2*self.nghost) * (my + 2*self.nghost)
+        self.patch_table['offset'][1:] = np.cumsum(sizes)[:-1]
+
+        # Sort by level and then xlow, so select can find the patches on a
+        # level in a contiguous range and cut off those with xlow > x2:
+        order = np.lexsort((self.patch_table['xlow'], self.patch_table['level']))
+        self.patch_table = self.patch_table[order]
+
+    def index_fname(self):
+        """
+        Return the path of the patch index file of this frame.
+        """
+        return os.path.join(self.outdir, 'patchindex%s.npz'
+                            % str(self.frameno).zfill(4))
+
+    def write_index(self):
+        """
+        Save the patch table, time and sizes to the patch index file, so the
+        headers do not need to be parsed again.
+        """
+        tmp_fname = self.index_fname() + '.tmp%i.npz' % os.getpid()
+        np.savez(tmp_fname, patch_table=self.patch_table, t=self.t,
+                 meqn=self.meqn, nghost=self.nghost)
+        os.replace(tmp_fname, self.index_fname())
+
+    def read_index(self):
+        """
+        Read the patch index file if it is newer than the frame.
+        Returns True if it was read.
+        """
+        fname = self.index_fname()
+        try:
+            if os.path.getmtime(fname) < os.path.getmtime(self.fname('b')):
+                return False
+        except OSError:
+            return False
+        with np.load(fname) as index:
+            self.patch_table = index['patch_table']
+            self.t = float(index['t'])
+            self.meqn = int(index['meqn'])
+            self.nghost = int(index['nghost'])
+        return True
+
+    def fname(self, kind):
+        """
+        Return the path of the fort.qNNNN, fort.tNNNN or fort.bNNNN file.
+        """
+        return os.path.join(self.outdir, 'fort.%s%s'
+                            % (kind, str(self.frameno).zfill(4)))
+
+    @property
+    def data(self):
+        """
+        Memory map of all values in the fort.bNNNN file.
+        """
+        if self._data is None:
+            self._data = np.memmap(self.fname('b'), dtype='<f8', mode='r')
+        return self._data
+
+    def select(self, levels=None, bbox=None):
+        """
+        Return the indices in patch_table of the patches on the given levels
+        (all if None) that intersect bbox = [x1, x2, y1, y2] (all if None).
+        """
+        p = self.patch_table
+        if levels is None:
+            levels = np.unique(p['level'])
+        selected = []
+        for level in levels:
+            i1 = np.searchsorted(p['level'], level, side='left')
+            i2 = np.searchsorted(p['level'], level, side='right')
+            if bbox is None:
+                selected.append(np.arange(i1, i2))
+                continue
+            x1, x2, y1, y2 = bbox
+            i2 = i1 + np.searchsorted(p['xlow'][i1:i2], x2)
+            pl = p[i1:i2]
+            keep = (pl['xlow'] + pl['mx']*pl['dx'] > x1) \
+                 & (pl['ylow'] < y2) & (pl['ylow'] + pl['my']*pl['dy'] > y1)
+            selected.append(i1 + np.nonzero(keep)[0])
+        if not selected:
+            return np.zeros(0, dtype=int)
+        return np.concatenate(selected)
+
+    def q(self, i):
+        """
+        Return q for patch i as an array of shape (meqn, mx, my) that is a
+        view into the memory map, without ghost cells.
+        """
+        p = self.patch_table[i]
+        g = self.nghost
+        mx, my = p['mx'], p['my']
+        size = self.meqn * (mx + 2*g) * (my + 2*g)
+        q = self.data[p['offset']:p['offset']+size]
+        q = q.reshape((self.meqn, mx + 2*g, my + 2*g), order='F')
+        return q[:, g:g+mx, g:g+my]
+
+    def patches(self, levels=None, bbox=None):
+        """
+        Iterate over (patch, q) for the patches selected as in select,
+        where patch is the entry of patch_table.
+        """
+        for i in self.select(levels, bbox):
+            yield self.patch_table[i], self.q(i)
+
+    def cell_centers(self, i):
+        """
+        Return arrays x, y of cell centers of patch i, of shape (mx, my).
+        """
+        p = self.patch_table[i]
+        x = p['xlow'] + (np.arange(p['mx']) + 0.5) * p['dx']
+        y = p['ylow'] + (np.arange(p['my']) + 0.5) * p['dy']
+        return np.meshgrid(x, y, indexing='ij')
+
+
+def read_frame(frameno, outdir='_output', use_index=True):
+    """
+    Return the Frame object for frame frameno in outdir.
+    """
+    return Frame(frameno, outdir, use_index)
+
+
+def frame_numbers(outdir='_output'):
+    """
+    Return the sorted list of frame numbers in outdir.
+    """
+    framenos = []
+    for fname in os.listdir(outdir):
+        if fname.startswith('fort.t') and fname[6:].isdigit():
+            framenos.append(int(fname[6:]))
+    return sorted(framenos)
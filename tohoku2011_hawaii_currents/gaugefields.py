@@ -0,0 +1,78 @@
+"""
+Derived quantities of gauge time series, computed once per gauge.
+
+The velocity plots in setplot.py and the comparisons with observations all
+need the same depth-masked velocities, so they are computed together, with
+whole-array operations, the first time any of them is requested for a gauge,
+and remembered for as long as the gauge's q array exists.  Fields are
+requested by name:
+    h, hu, hv, eta      components of q
+    dry                 True where h <= h_min
+    u, v                velocities (m/s), 0 where dry
+    speed               sqrt(u**2 + v**2)
+    direction           direction the flow is going towards, in degrees
+                        clockwise from north (as in the ADCP data files)
+    topo                eta - h
+
+Example, in a setplot plot_var function:
+    def uvel(current_data):
+        return 100. * gaugefields.get(current_data, 'u')   # cm/s
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import weakref
+
+import numpy as np
+
+# Depth below which the velocities are set to 0, as in the original setplot:
+h_min = 0.01
+
+# Fields that are components of q:
+components = ['h', 'hu', 'hv', 'eta']
+
+# Derived fields, by id of the q array:
+_cache = {}
+
+
+def compute_fields(q):
+    """
+    Return a dictionary of the fields derived from q = [h, hu, hv, eta, ...]
+    of shape (num_components, num_times).
+    """
+    h = q[0,:]
+    hu = q[1,:]
+    hv = q[2,:]
+    eta = q[3,:]
+    dry = h <= h_min
+    h_safe = np.where(dry, 1., h)
+    u = np.where(dry, 0., hu / h_safe)
+    v = np.where(dry, 0., hv / h_safe)
+    speed = np.hypot(u, v)
+    direction = np.mod(90. - np.degrees(np.arctan2(v, u)), 360.)
+    # No views of q are kept, so the cached fields do not keep q alive:
+    return {'dry': dry, 'u': u, 'v': v, 'speed': speed,
+            'direction': direction, 'topo': eta - h}
+
+
+def fields(gauge):
+    """
+    Return the dictionary of derived fields for gauge, which may be a q
+    array or an object with attribute q (e.g. the current_data passed to
+    setplot functions, or a visclaw GaugeSolution).
+    """
+    q = getattr(gauge, 'q', gauge)
+    key = id(q)
+    if key not in _cache:
+        _cache[key] = compute_fields(q)
+        weakref.finalize(q, _cache.pop, key, None)
+    return _cache[key]
+
+
+def get(gauge, name):
+    """
+    Return the field name for gauge, see fields.
+    """
+    if name in components:
+        return getattr(gauge, 'q', gauge)[components.index(name),:]
+    return fields(gauge)[name]
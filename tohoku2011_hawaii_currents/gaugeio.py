@@ -0,0 +1,229 @@
+"""
+Read GeoClaw gauge output as memory-mapped structured arrays.
+
+GeoClaw writes gauge NNNNN to outdir/gaugeNNNNN.txt, either as text or, if
+binary_gauges = True in setrun.py (GeoClaw 5.9 and later), as a header in
+gaugeNNNNN.txt and the data in gaugeNNNNN.bin, one float64 record per time
+with columns level, t, q(1:num_var).  Text gauges are converted once into
+gaugeNNNNN.npy in outdir, so either way the data is memory-mapped as a
+structured array with fields level, t, h, hu, hv, eta (and v5, v6, ... if
+there are more columns), and only the part that is used is read.
+
+Each gauge also gets a small time index gaugeNNNNN.tidx.npz, holding t at
+every index_stride-th record, so a time window such as 7.25 to 13 hours is
+found by searching the index and then one block of the file.
+
+Example:
+    from gaugeio import read_gauge
+    g = read_gauge(1123, '_output', t1=7.25*3600, t2=13*3600)
+    t, h, hu = g['t'], g['h'], g['hu']
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Names of the first fields of a gauge record:
+gauge_fields = ['level', 't', 'h', 'hu', 'hv', 'eta']
+
+# Number of records between entries of the time index:
+index_stride = 4096
+
+
+def gauge_fname(gaugeno, outdir='_output', ext='txt'):
+    """
+    Return the name of the file of gauge gaugeno with extension ext.
+    """
+    return os.path.join(outdir, 'gauge%s.%s' % (str(gaugeno).zfill(5), ext))
+
+
+def gauge_numbers(outdir='_output'):
+    """
+    Return the sorted list of gauge numbers in outdir.
+    """
+    return sorted(int(f[5:-4]) for f in os.listdir(outdir)
+                  if f.startswith('gauge') and f.endswith('.txt')
+                  and f[5:-4].isdigit())
+
+
+def read_header(fname):
+    """
+    Return a dictionary with gauge_id, num_var, file_format and the number
+    of header lines of the gauge file fname.
+    """
+    header = {'file_format': 'ascii', 'num_var': None, 'lines': 0}
+    with open(fname) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            header['lines'] += 1
+            m = re.search(r'gauge_id=\s*(\d+)', line)
+            if m:
+                header['gauge_id'] = int(m.group(1))
+            m = re.search(r'num_(?:eqn|var)=\s*(\d+)', line)
+            if m:
+                header['num_var'] = int(m.group(1))
+            m = re.search(r'file format\s+(\w+)', line)
+            if m:
+                header['file_format'] = m.group(1)
+    if header['num_var'] is None:
+        raise IOError("*** No num_eqn or num_var in header of %s" % fname)
+    return header
+
+
+def gauge_dtype(num_var):
+    """
+    Return the structured dtype of a gauge record with num_var values.
+    """
+    names = gauge_fields[:num_var+2] + ['v%i' % k for k in range(5, num_var+1)]
+    return np.dtype([(name, '<f8') for name in names])
+
+
+def file_stamp(fname):
+    """
+    Return a string identifying the size and modification time of fname.
+    """
+    st = os.stat(fname)
+    return '%i %i' % (st.st_size, st.st_mtime_ns)
+
+
+def read_text(fname, header):
+    """
+    Return the records of the text gauge file fname as an array of shape
+    (number of times, num_var+2).
+    """
+    ncols = header['num_var'] + 2
+    return np.loadtxt(fname, comments='#', ndmin=2, usecols=range(ncols))
+
+
+def convert_gauge(gaugeno, outdir='_output'):
+    """
+    Convert the text gauge file of gaugeno to gaugeNNNNN.npy in outdir.
+    """
+    fname = gauge_fname(gaugeno, outdir)
+    header = read_header(fname)
+    values = read_text(fname, header)
+    data = np.ascontiguousarray(values).view(gauge_dtype(header['num_var']))
+    npy_fname = gauge_fname(gaugeno, outdir, 'npy')
+    tmp_fname = npy_fname + '.tmp%i.npy' % os.getpid()
+    np.save(tmp_fname, data.reshape(-1))
+    os.replace(tmp_fname, npy_fname)
+
+
+def write_index(gaugeno, outdir, data, stamp):
+    """
+    Write the time index of gaugeno for the records data.
+    """
+    t = data['t']
+    index_fname = gauge_fname(gaugeno, outdir, 'tidx.npz')
+    tmp_fname = index_fname + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp_fname, stamp=np.array(stamp), stride=index_stride,
+             t=np.array(t[::index_stride]),
+             sorted=bool(np.all(t[1:] >= t[:-1])))
+    os.replace(tmp_fname, index_fname)
+
+
+class Gauge(object):
+    """
+    Memory-mapped records of one gauge, in the attribute data.
+    """
+
+    def __init__(self, gaugeno, outdir='_output'):
+        self.gaugeno = gaugeno
+        self.outdir = outdir
+        fname = gauge_fname(gaugeno, outdir)
+        self.header = read_header(fname)
+        dtype = gauge_dtype(self.header['num_var'])
+
+        if self.header['file_format'] == 'ascii':
+            data_fname = gauge_fname(gaugeno, outdir, 'npy')
+            stamp = file_stamp(fname)
+            if not os.path.isfile(data_fname) or self._index_stamp() != stamp:
+                convert_gauge(gaugeno, outdir)
+            self.data = np.load(data_fname, mmap_mode='r')
+        elif self.header['file_format'] == 'binary64':
+            data_fname = gauge_fname(gaugeno, outdir, 'bin')
+            stamp = file_stamp(data_fname)
+            size = os.path.getsize(data_fname) // dtype.itemsize
+            self.data = np.memmap(data_fname, dtype=dtype, mode='r',
+                                  shape=(size,)) if size else np.zeros(0, dtype)
+        else:
+            raise IOError("*** Unsupported gauge file format %s in %s"
+                          % (self.header['file_format'], fname))
+
+        if self._index_stamp() != stamp:
+            write_index(gaugeno, outdir, self.data, stamp)
+        with np.load(gauge_fname(gaugeno, outdir, 'tidx.npz')) as index:
+            self.t_index = index['t']
+            self.stride = int(index['stride'])
+            self.sorted = bool(index['sorted'])
+
+    def _index_stamp(self):
+        index_fname = gauge_fname(self.gaugeno, self.outdir, 'tidx.npz')
+        try:
+            with np.load(index_fname) as index:
+                return str(index['stamp'])
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def search(self, t, side='left'):
+        """
+        Return the index of the first record with time >= t (side='left')
+        or > t (side='right'), reading only one block of the records.
+        """
+        block = max(np.searchsorted(self.t_index, t, side=side) - 1, 0)
+        i1 = block * self.stride
+        i2 = min(i1 + self.stride + 1, len(self.data))
+        return i1 + np.searchsorted(self.data['t'][i1:i2], t, side=side)
+
+    def window(self, t1=None, t2=None):
+        """
+        Return the records with t1 <= t <= t2 (seconds; all if None).
+        """
+        if not self.sorted:
+            t = self.data['t']
+            mask = np.ones(len(t), dtype=bool)
+            if t1 is not None:
+                mask &= t >= t1
+            if t2 is not None:
+                mask &= t <= t2
+            return self.data[mask]
+        i1 = 0 if t1 is None else self.search(t1, 'left')
+        i2 = len(self.data) if t2 is None else self.search(t2, 'right')
+        return self.data[i1:i2]
+
+
+def read_gauge(gaugeno, outdir='_output', t1=None, t2=None):
+    """
+    Return the memory-mapped records of gaugeno in outdir with
+    t1 <= t <= t2 (seconds).
+    """
+    return Gauge(gaugeno, outdir).window(t1, t2)
+
+
+def gauge_array(records, fields=gauge_fields):
+    """
+    Return an array with one column for each of fields of the records.
+    """
+    return np.column_stack([records[name] for name in fields]) if len(records) \
+        else np.zeros((0, len(fields)))
+
+
+def read_gauges(outdirs, gaugenos, t1=None, t2=None, max_workers=None):
+    """
+    Return a dictionary with the records of each gauge in gaugenos for each
+    output directory in outdirs, keyed by (outdir, gaugeno), read in threads.
+    Missing gauges are skipped.
+    """
+    jobs = [(outdir, gaugeno) for outdir in outdirs for gaugeno in gaugenos
+            if os.path.isfile(gauge_fname(gaugeno, outdir))]
+
+    def read(job):
+        return read_gauge(job[1], job[0], t1, t2)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(jobs, pool.map(read, jobs)))
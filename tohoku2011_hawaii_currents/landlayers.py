@@ -0,0 +1,176 @@
+"""
+Static land and topography contour layers for the setplot frame figures.
+
+The topography does not change after the dtopo motion (t > 1 second), so
+rather than recomputing the land imshow and topo contours from the patches
+of every frame, they are computed once per figure from the topo files (via
+the memory-mapped cache in topocache.py) on a raster matching the axes
+extent and size in pixels:
+    - the land image is an RGBA array of the topography above sea level
+      colored by cmap between cmin and cmax,
+    - the contours are the line segments of the topography contours.
+Both are cached in the layers subdirectory of the topocache directory,
+keyed by the topo files, extent, size, colormap and limits or contour
+levels, and drawn under the water in each frame.
+
+The land shown is all topography above sea level, rather than the dry cells
+of each frame, so land that is inundated shows through where the water is
+masked out, and sea floor exposed by the drawdown is not shown.  setplot.py
+therefore only uses these layers if use_land_layers = True there and the
+topo files are found (see have_topo), and otherwise plots the land of the
+dry cells and the contours from each frame as before.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import pickle
+import hashlib
+
+import numpy as np
+
+import topocache
+
+# Directory for the cached layers:
+layers_dir = os.path.join(topocache.cache_dir, 'layers')
+
+
+def have_topo():
+    """
+    Return True if the topo files of topocache.py exist, so the layers can
+    be made, else print why not and return False.
+    """
+    missing = [path for topo_type, path in topocache.topofiles
+               if not os.path.isfile(path)]
+    if missing:
+        print("*** Missing %s, plotting the land from each frame instead of "
+              "the land layers (see landlayers.py)" % ', '.join(missing))
+    return not missing
+
+
+def raster_key(bbox, nx, ny, *args):
+    """
+    Return a hash of the topo files, raster extent and size, and args.
+    """
+    key = [os.path.basename(topocache.cache_name(path))
+           for topo_type, path in topocache.topofiles]
+    key += ['%.8f' % v for v in bbox] + [nx, ny] + list(args)
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:16]
+
+
+def topo_raster(bbox, nx, ny):
+    """
+    Return pixel centers xp, yp and the topography B of shape (ny, nx) on
+    an nx by ny raster over bbox = [x1, x2, y1, y2], sampled from the nearest
+    topo point of the finest topo file covering each pixel (nan if none).
+    """
+    x1, x2, y1, y2 = bbox
+    xp = x1 + (np.arange(nx) + 0.5) * (x2 - x1) / nx
+    yp = y1 + (np.arange(ny) + 0.5) * (y2 - y1) / ny
+    B = np.full((ny, nx), np.nan)
+
+    grids = [topocache.read_topo(path, topo_type)
+             for topo_type, path in topocache.topofiles]
+    grids.sort(key=lambda grid: -(grid[0][-1] - grid[0][0]) / len(grid[0]))
+
+    for x, y, Z in grids:   # coarsest first, so finer files overwrite
+        dx = (x[-1] - x[0]) / (len(x) - 1)
+        dy = (y[-1] - y[0]) / (len(y) - 1)
+        i = np.round((xp - x[0]) / dx).astype(int)
+        j = np.round((yp - y[0]) / dy).astype(int)
+        ii = np.nonzero((i >= 0) & (i < len(x)))[0]
+        jj = np.nonzero((j >= 0) & (j < len(y)))[0]
+        if len(ii) and len(jj):
+            B[jj[0]:jj[-1]+1, ii[0]:ii[-1]+1] = Z[j[jj][:,None], i[ii][None,:]]
+    return xp, yp, B
+
+
+def land_image(bbox, nx, ny, cmap, cmin, cmax):
+    """
+    Return the RGBA image (uint8, shape (ny, nx, 4), first row at y1) of the
+    topography above sea level over bbox, creating and caching it if needed.
+    """
+    from matplotlib import colors
+
+    key = raster_key(bbox, nx, ny, 'land', cmap.name, cmin, cmax)
+    fname = os.path.join(layers_dir, 'land_%s.npy' % key)
+    if os.path.isfile(fname):
+        return np.load(fname)
+
+    xp, yp, B = topo_raster(bbox, nx, ny)
+    norm = colors.Normalize(vmin=cmin, vmax=cmax)
+    image = cmap(norm(B), bytes=True)
+    image[..., 3] = np.where(B > 0., image[..., 3], 0)   # transparent water
+
+    if not os.path.isdir(layers_dir):
+        os.makedirs(layers_dir)
+    tmp_fname = fname + '.tmp%i.npy' % os.getpid()
+    np.save(tmp_fname, image)
+    os.replace(tmp_fname, fname)
+    return image
+
+
+def topo_contours(bbox, nx, ny, levels):
+    """
+    Return the list (one entry per contour level) of lists of line segments
+    of the topography contours over bbox, creating and caching them if needed.
+    """
+    from matplotlib.figure import Figure
+
+    levels = [float(level) for level in levels]
+    key = raster_key(bbox, nx, ny, 'contour', levels)
+    fname = os.path.join(layers_dir, 'contour_%s.pkl' % key)
+    if os.path.isfile(fname):
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+
+    xp, yp, B = topo_raster(bbox, nx, ny)
+    contours = Figure().add_subplot(111).contour(xp, yp, B, levels)
+    allsegs = [[np.array(seg) for seg in segs] for segs in contours.allsegs]
+
+    if not os.path.isdir(layers_dir):
+        os.makedirs(layers_dir)
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'wb') as f:
+        pickle.dump(allsegs, f)
+    os.replace(tmp_fname, fname)
+    return allsegs
+
+
+def axes_raster(ax):
+    """
+    Return the extent [x1, x2, y1, y2] of axes ax and its size in pixels.
+    """
+    x1, x2 = ax.get_xlim()
+    y1, y2 = ax.get_ylim()
+    extent = ax.get_window_extent()
+    nx = max(1, int(round(extent.width)))
+    ny = max(1, int(round(extent.height)))
+    # round the extent so tiny differences between frames share the cache:
+    bbox = [round(v, 8) for v in (x1, x2, y1, y2)]
+    return bbox, nx, ny
+
+
+def draw_land(cmap, cmin, cmax, contour_levels=None, contour_kwargs={}):
+    """
+    Draw the land layer, and the topo contours at contour_levels if given,
+    below everything else in the current axes.  Call from afteraxes.
+    """
+    from matplotlib import pyplot as plt
+    from matplotlib.collections import LineCollection
+
+    ax = plt.gca()
+    bbox, nx, ny = axes_raster(ax)
+    image = land_image(bbox, nx, ny, cmap, cmin, cmax)
+    ax.imshow(image, extent=bbox, origin='lower', interpolation='nearest',
+              aspect=ax.get_aspect(), zorder=-1)
+
+    if contour_levels is not None:
+        kwargs = {'colors': 'y'}
+        kwargs.update(contour_kwargs)
+        for segs in topo_contours(bbox, nx, ny, contour_levels):
+            ax.add_collection(LineCollection(segs, zorder=-0.5, **kwargs))
+
+    # imshow may have changed the limits:
+    ax.set_xlim(bbox[:2])
+    ax.set_ylim(bbox[2:])
@@ -1,18 +1,33 @@
 """
-Create topo and dtopo files needed for this example:
-    etopo10min120W60W60S0S.asc        download from GeoClaw topo repository
-    dtopo_usgs100227.tt3              create using Okada model 
-Prior to Clawpack 5.2.1, the fault parameters we specified in a .cfg file,
-but now they are explicit below.
-    
-Call functions with makeplots==True to create plots of topo, slip, and dtopo.
+Retrieve topo and dtopo files needed for this example:
+    etopo1min130E210E0N60N.asc        download from GeoClaw topo repository
+    kahului_1s.txt                    download from GeoClaw topo repository
+    fujii.txydz                       download from GeoClaw dtopo repository
+
+The files are fetched concurrently into the scratch directory and checked
+against the SHA-256 hashes in the manifest file topo_manifest.sha256.  A file
+without a hash in the manifest is fetched unverified, with a warning, and its
+hash is recorded in the manifest, which should then be checked against a
+trusted copy and committed.  A file already in the scratch directory whose hash matches is not fetched
+again.  Set the environment variable TOPO_MIRROR to a local directory or to
+a URL (e.g. file:///shared/topo/ or http://mirror/topo/) holding files with
+the same names to fetch from a mirror instead of the GeoClaw repository.
+
+Call functions with makeplots==True to create plots of topo.
 """
 
 from __future__ import absolute_import
 from __future__ import print_function
 import os
+import hashlib
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import clawpack.clawutil.data
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
 
 try:
     CLAW = os.environ['CLAW']
@@ -22,36 +37,207 @@ except:
 # Scratch directory for storing topo and dtopo files:
 scratch_dir = os.path.join(CLAW, 'geoclaw', 'scratch')
 
-def get_topo(makeplots=False):
+# Remote directory for each file needed:
+remote_dirs = {
+    'etopo1min130E210E0N60N.asc':
+        'http://depts.washington.edu/clawpack/geoclaw/topo/etopo/',
+    # this topo file isn't really needed for modeling around Kahului
+    #'hawaii_6s.txt':
+    #    'http://depts.washington.edu/clawpack/geoclaw/topo/hawaii/',
+    'kahului_1s.txt':
+        'http://depts.washington.edu/clawpack/geoclaw/topo/hawaii/',
+    'fujii.txydz':
+        'http://depts.washington.edu/clawpack/geoclaw/dtopo/tohoku/',
+    }
+
+# Expected SHA-256 hashes, in the format written by sha256sum.  Recorded
+# hashes should be committed or shared with all nodes that build run
+# directories.
+manifest_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'topo_manifest.sha256')
+
+manifest_header = """\
+# SHA-256 hashes of the topo and dtopo files fetched by maketopo.py and of
+# the observation archive fetched by obsstore.py, in the format written by
+# sha256sum.  The hash of a file not listed here is recorded the first time
+# it is fetched; check it against a trusted copy.
+"""
+
+
+def sha256sum(path, blocksize=2**20, memoize=True):
     """
-    Retrieve the topo file from the GeoClaw repository.
+    Return the SHA-256 hex digest of the file at path.
+
+    If memoize==True the digest is remembered in path + '.sha256' together
+    with the size and modification time of the file, so hashing a file that
+    has not changed since the last call only requires a stat.
     """
-    from clawpack.geoclaw import topotools
-
-    topo_fname = 'etopo1min130E210E0N60N.asc'
-    url = 'http://depts.washington.edu/clawpack/geoclaw/topo/etopo/' + topo_fname
-    clawpack.clawutil.data.get_remote_file(url, output_dir=scratch_dir, 
-            file_name=topo_fname, verbose=True)
-
-    if 0:
-        # this topo file isn't really needed for modeling around Kahului
-        topo_fname = 'hawaii_6s.txt'
-        url = 'http://depts.washington.edu/clawpack/geoclaw/topo/hawaii/' + topo_fname
-        clawpack.clawutil.data.get_remote_file(url, output_dir=scratch_dir, 
-                file_name=topo_fname, verbose=True)
-
-    topo_fname = 'kahului_1s.txt'
-    url = 'http://depts.washington.edu/clawpack/geoclaw/topo/hawaii/' + topo_fname
-    clawpack.clawutil.data.get_remote_file(url, output_dir=scratch_dir, 
-            file_name=topo_fname, verbose=True)
-
-    topo_fname = 'fujii.txydz'
-    url = 'http://depts.washington.edu/clawpack/geoclaw/dtopo/tohoku/' + topo_fname
-    clawpack.clawutil.data.get_remote_file(url, output_dir=scratch_dir, 
-            file_name=topo_fname, verbose=True)
+    st = os.stat(path)
+    stamp = '%i %i' % (st.st_size, st.st_mtime_ns)
+    memo_file = path + '.sha256'
+    if memoize:
+        try:
+            with open(memo_file) as f:
+                digest, memo_stamp = f.read().split(None, 1)
+            if memo_stamp.strip() == stamp:
+                return digest
+        except (IOError, OSError, ValueError):
+            pass
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    if not memoize:
+        return digest
+
+    try:
+        tmp_fname = memo_file + '.tmp%i' % os.getpid()
+        with open(tmp_fname, 'w') as f:
+            f.write('%s %s\n' % (digest, stamp))
+        os.replace(tmp_fname, memo_file)
+    except (IOError, OSError):
+        pass  # read-only scratch directory, just don't memoize
+    return digest
+
+
+def read_manifest(fname=manifest_file):
+    """
+    Return dictionary mapping file names to expected SHA-256 hashes.
+    """
+    manifest = {}
+    if os.path.isfile(fname):
+        with open(fname) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    digest, name = line.split(None, 1)
+                    manifest[name.lstrip('*')] = digest
+    return manifest
+
+
+def write_manifest(manifest, fname=manifest_file):
+    """
+    Write the dictionary manifest in the format read by read_manifest.
+    """
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        f.write(manifest_header)
+        for name in sorted(manifest.keys()):
+            f.write('%s  %s\n' % (manifest[name], name))
+    os.replace(tmp_fname, fname)
+
+
+def record_hashes(new_entries, fname=manifest_file):
+    """
+    Add the dictionary new_entries of file names and hashes to the manifest.
+    """
+    if not new_entries:
+        return
+    manifest = read_manifest(fname)
+    manifest.update(new_entries)
+    write_manifest(manifest, fname)
+    print("Recorded hashes of %s in %s"
+          % (', '.join(sorted(new_entries.keys())), fname))
+
+
+def fetch_file(fname, source, output_dir=scratch_dir, sha256=None,
+               verbose=True):
+    """
+    Fetch fname from source into output_dir unless a copy with the
+    expected sha256 hash is already there.
+
+    source may be a URL (http://, https://, ftp://, file://) or a local
+    directory containing fname.  The file is written to a temporary file
+    in output_dir and only moved into place once its hash has been checked,
+    so an interrupted or concurrent fetch never leaves a partial file
+    behind.  Returns the hash of the file.
+    """
+    path = os.path.join(output_dir, fname)
+    if os.path.isfile(path):
+        digest = sha256sum(path)
+        if sha256 is None or digest == sha256:
+            if verbose:
+                print("Skipping %s, already in %s" % (fname, output_dir))
+            return digest
+        print("*** Hash mismatch for cached %s, fetching again" % fname)
+
+    if verbose:
+        print("Fetching %s from %s" % (fname, source))
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + fname + '.',
+                                    dir=output_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if os.path.isdir(source):
+                with open(os.path.join(source, fname), 'rb') as src:
+                    shutil.copyfileobj(src, f, 2**20)
+            else:
+                src = urlopen(source.rstrip('/') + '/' + fname)
+                try:
+                    shutil.copyfileobj(src, f, 2**20)
+                finally:
+                    src.close()
+        os.chmod(tmp_path, 0o644)
+        digest = sha256sum(tmp_path)
+        if sha256 is not None and digest != sha256:
+            raise IOError("*** SHA-256 of %s from %s is %s, expected %s"
+                          % (fname, source, digest, sha256))
+        os.replace(tmp_path, path)
+        if os.path.exists(tmp_path + '.sha256'):
+            os.replace(tmp_path + '.sha256', path + '.sha256')
+    finally:
+        for p in [tmp_path, tmp_path + '.sha256']:
+            if os.path.exists(p):
+                os.remove(p)
+
+    if verbose:
+        print("Fetched %s" % fname)
+    return digest
+
+
+def get_topo(makeplots=False, mirror=None, max_workers=None):
+    """
+    Retrieve the topo and dtopo files from the GeoClaw repository, or from
+    mirror (or $TOPO_MIRROR) if set.  Files without a hash in the manifest
+    are fetched unverified and their hashes added to it.
+
+    All files are fetched at the same time, so a cold fetch takes about as
+    long as the largest file.
+    """
+    if mirror is None:
+        mirror = os.environ.get('TOPO_MIRROR', None)
+
+    if not os.path.isdir(scratch_dir):
+        os.makedirs(scratch_dir)
+
+    manifest = read_manifest()
+    fnames = sorted(remote_dirs.keys())
+    unverified = [fname for fname in fnames if fname not in manifest]
+    if unverified:
+        print("*** Warning: no SHA-256 hash of %s in %s, these files are not "
+              "verified.  Their hashes will be recorded; check them against "
+              "a trusted copy and commit the manifest."
+              % (', '.join(unverified), manifest_file))
+
+    def fetch(fname):
+        source = mirror if mirror else remote_dirs[fname]
+        return fetch_file(fname, source, output_dir=scratch_dir,
+                          sha256=manifest.get(fname, None))
+
+    if max_workers is None:
+        max_workers = len(fnames)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        digests = list(pool.map(fetch, fnames))
+
+    record_hashes(dict([(fname, digest) for fname, digest
+                        in zip(fnames, digests) if fname not in manifest]))
 
     if makeplots:
         from matplotlib import pyplot as plt
+        from clawpack.geoclaw import topotools
+        topo_fname = 'fujii.txydz'
         topo = topotools.Topography(os.path.join(scratch_dir,topo_fname), topo_type=2)
         topo.plot()
         fname = os.path.splitext(topo_fname)[0] + '.png'
@@ -0,0 +1,182 @@
+"""
+Read the ADCP current meter observations from the archive of the paper.
+
+Each station directory Observations/HAI* holds one file depth_*m.txt per
+depth bin with columns DATE TIME Speed Dir, at the same times for every
+depth.  read_adcp_station reads all the depth files of a station in
+parallel threads with the pandas C parser, and converts times, speed and
+direction to (u,v) and the depth average with whole-array operations.
+The result for a station is a dictionary of arrays:
+    time                 times (numpy datetime64, UTC)
+    hours_since_quake    hours since the earthquake
+    depths               depth of each bin (m)
+    u_depths, v_depths   velocities in each bin, shape (len(depths), len(time))
+    u, v                 depth averaged velocities
+Velocities are in the units of the data files (cm/s).
+
+read_tide_gauge similarly reads a tide gauge file TideGauges/*.csv into
+arrays time, hours_since_quake and one array per data column (1MIN, 6MIN,
+ALTERNATE, RESIDUAL, PREDICTED), with missing values set to nan.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Time of the earthquake (UTC):
+tquake = np.datetime64('2011-03-11T05:46:24', 'ns')
+
+# Time zone of the ADCP data:
+adcp_tz = 'Pacific/Honolulu'
+
+# Corrections to hours_since_quake for each station.
+# From detide.py in the archive:
+#    if gaugeno==1123:
+#        t2 = t2 - 1.   # correct error in NGDC data for this gauge
+time_corrections = {'HAI1123_Kahului_harbor': -1.}
+
+# Tide gauge files in the archive, by gauge number:
+tide_gauge_files = {'1615680': '1615680__2011-03-11_to_2011-03-13.csv',
+                    '1617760': '1617760__2011-03-11_to_2011-03-13.csv'}
+
+# Data columns of the tide gauge files:
+tide_gauge_columns = ['1MIN', '6MIN', 'ALTERNATE', 'RESIDUAL', 'PREDICTED']
+
+
+def hours_since_quake(time):
+    """
+    Convert numpy datetime64 times (UTC) to hours since the earthquake.
+    """
+    return (time - tquake) / np.timedelta64(1, 'h')
+
+
+def read_depth_file(fname, parse_times=True):
+    """
+    Return time (or None if parse_times==False), speed and direction from
+    one depth_*m.txt file.
+    """
+    import pandas
+    df = pandas.read_csv(fname, sep=r'\s+', comment='#',
+                         names=['DATE', 'TIME', 'Speed', 'Dir'],
+                         dtype={'DATE': str, 'TIME': str,
+                                'Speed': float, 'Dir': float})
+    time = None
+    if parse_times:
+        time = pandas.to_datetime(df['DATE'] + ' ' + df['TIME'])
+        time = time.dt.tz_localize(adcp_tz).dt.tz_convert('UTC')
+        time = time.dt.tz_localize(None).values.astype('datetime64[ns]')
+    return time, df['Speed'].values, df['Dir'].values
+
+
+def depth_of(fname):
+    """
+    Return the depth in the name of a depth_*m.txt file.
+    """
+    return float(os.path.basename(fname)[len('depth_'):-len('m.txt')])
+
+
+def read_adcp_station(station_dir, max_workers=None):
+    """
+    Read all depth files in station_dir and return the dictionary of
+    arrays described above.
+    """
+    fnames = sorted(glob.glob(os.path.join(station_dir, 'depth_*m.txt')),
+                    key=depth_of)
+    if not fnames:
+        raise IOError("*** No depth files in %s" % station_dir)
+
+    # Times are only parsed from the first file, since all depths use the
+    # same times:
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(read_depth_file, fnames,
+                                [True] + [False]*(len(fnames)-1)))
+
+    time = results[0][0]
+    if any(len(speed) != len(time) for t, speed, direction in results):
+        raise ValueError("*** Depth files in %s have different lengths"
+                         % station_dir)
+    speed = np.vstack([r[1] for r in results])
+    theta = np.radians(90. - np.vstack([r[2] for r in results]))
+    u_depths = speed * np.cos(theta)
+    v_depths = speed * np.sin(theta)
+
+    station = os.path.basename(os.path.normpath(station_dir))
+    hours = hours_since_quake(time) + time_corrections.get(station, 0.)
+
+    return {'time': time, 'hours_since_quake': hours,
+            'depths': np.array([depth_of(f) for f in fnames]),
+            'u_depths': u_depths, 'v_depths': v_depths,
+            'u': u_depths.mean(axis=0), 'v': v_depths.mean(axis=0)}
+
+
+def adcp_station_dirs(obs_dir):
+    """
+    Return the list of station directories in obs_dir/Observations.
+    """
+    path = os.path.join(obs_dir, 'Observations')
+    return sorted(os.path.join(path, d) for d in os.listdir(path)
+                  if os.path.isdir(os.path.join(path, d)))
+
+
+def read_adcp_stations(obs_dir, max_workers=None):
+    """
+    Return a dictionary with the arrays of every station in obs_dir, with
+    the station directory names as keys.
+    """
+    stations = {}
+    for station_dir in adcp_station_dirs(obs_dir):
+        station = os.path.basename(station_dir)
+        stations[station] = read_adcp_station(station_dir, max_workers)
+    return stations
+
+
+def read_tide_gauge(csv_file):
+    """
+    Return a dictionary of arrays time, hours_since_quake and the columns
+    in tide_gauge_columns of the tide gauge file csv_file (times in UTC).
+    """
+    import pandas
+    df = pandas.read_csv(csv_file, na_values='-',
+                         dtype=dict([('DATE', str), ('TIME', str)] +
+                                    [(c, float) for c in tide_gauge_columns]))
+    time = pandas.to_datetime(df['DATE'] + ' ' + df['TIME'])
+    time = time.values.astype('datetime64[ns]')
+    data = {'time': time, 'hours_since_quake': hours_since_quake(time)}
+    for c in tide_gauge_columns:
+        data[c] = df[c].values
+    return data
+
+
+def read_tide_gauges(obs_dir):
+    """
+    Return a dictionary with the arrays of every tide gauge in
+    tide_gauge_files, with the gauge numbers as keys.
+    """
+    return dict((gaugeno, read_tide_gauge(os.path.join(obs_dir, 'TideGauges',
+                                                       fname)))
+                for gaugeno, fname in tide_gauge_files.items())
+
+
+def station_dataframe(data):
+    """
+    Return a pandas DataFrame with columns date_time (Pacific/Honolulu),
+    time_since_quake, hours_since_quake and the other arrays of a station or
+    tide gauge that have one value per time (e.g. u, v or 1MIN, ...).
+    """
+    import pandas
+    time = data['time']
+    date_time = pandas.DatetimeIndex(time).tz_localize('UTC') \
+                      .tz_convert(adcp_tz)
+    df = pandas.DataFrame({'date_time': date_time})
+    df['time_since_quake'] = pandas.to_timedelta(time - tquake)
+    df['hours_since_quake'] = data['hours_since_quake']
+    for name in sorted(data.keys()):
+        value = data[name]
+        if name not in df and name != 'time' and np.ndim(value) == 1 \
+                and len(value) == len(time):
+            df[name] = value
+    return df
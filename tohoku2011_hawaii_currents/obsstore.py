@@ -0,0 +1,315 @@
+"""
+Indexed store of the observations from the archive of the paper.
+
+The archive tohoku2011-paper2-submitted_sept2014.zip (from
+http://doi.org/10.5281/zenodo.12185) is imported once, with
+    python obsstore.py [source]
+where source is the extracted archive directory, the zip file, or a
+directory or URL holding the zip file (default: the archive directory in
+this example if it exists, else the Zenodo record).  The zip file is checked
+against its SHA-256 hash in topo_manifest.sha256 (see maketopo.py), which is
+recorded with a warning if missing.  This reads the ADCP
+and tide gauge text files (see observations.py), detides them (see
+detide.py) and writes one directory per station to the store directory
+($OBS_STORE, or $CLAW/geoclaw/scratch/obsstore by default):
+    index.json                  stations, fields, number and range of times
+    HAI1123_Kahului_harbor/     time.npy, hours_since_quake.npy, u.npy,
+                                v.npy, u_detided.npy, v_detided.npy, ...
+    1615680/                    time.npy, hours_since_quake.npy, 1MIN.npy,
+                                ..., eta.npy, eta_detided.npy
+Each field is a .npy file that is memory-mapped when read, and the times of
+each station are sorted, so reading a time window only touches the part of
+the files in the window.  The store does not need network access or the
+text files once created, e.g. on compute nodes:
+
+    from obsstore import open_store
+    store = open_store()
+    t, u = store.get('HAI1123_Kahului_harbor', ['hours_since_quake',
+                                                'u_detided'], 7.25, 13.)
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import json
+import shutil
+import zipfile
+import tempfile
+
+import numpy as np
+
+import observations
+import detide
+from maketopo import scratch_dir, fetch_file, sha256sum, read_manifest, \
+    record_hashes, manifest_file
+
+# Directory for the store:
+store_dir = os.environ.get('OBS_STORE', os.path.join(scratch_dir, 'obsstore'))
+
+index_file = 'index.json'
+
+# Archive of the paper, as extracted in this directory by compare_results.ipynb:
+archive_name = 'rjleveque-tohoku2011-paper2-096e44c'
+archive_zip = 'tohoku2011-paper2-submitted_sept2014.zip'
+archive_url = 'https://zenodo.org/record/12185/files/'
+
+# Column of the tide gauge files used as the surface elevation eta:
+eta_column = '1MIN'
+
+
+def archive_members(names):
+    """
+    Return the names of the files in the zip archive needed by the store:
+    the depth files in Observations/HAI* and the tide gauge files in
+    TideGauges.
+    """
+    members = []
+    for name in names:
+        parts = name.split('/')
+        if len(parts) < 3:
+            continue
+        if parts[-3] == 'Observations' and parts[-2].startswith('HAI') \
+                and parts[-1].startswith('depth_') \
+                and parts[-1].endswith('m.txt'):
+            members.append(name)
+        elif parts[-2] == 'TideGauges' and \
+                parts[-1] in observations.tide_gauge_files.values():
+            members.append(name)
+    return members
+
+
+def extract_archive(zip_fname, output_dir):
+    """
+    Extract the files needed from zip_fname into output_dir and return the
+    directory containing Observations.
+    """
+    with zipfile.ZipFile(zip_fname) as z:
+        members = archive_members(z.namelist())
+        tops = [name.split('/Observations/')[0] for name in members
+                if '/Observations/' in name]
+        if not tops:
+            raise IOError("*** No observations found in %s" % zip_fname)
+        z.extractall(output_dir, members)
+    return os.path.join(output_dir, tops[0])
+
+
+def check_archive(zip_fname, digest=None):
+    """
+    Check the SHA-256 hash (digest, computed if None) of the zip file
+    against the manifest of maketopo.py, recording it with a warning if the
+    manifest has none.  Returns zip_fname.
+    """
+    if digest is None:
+        digest = sha256sum(zip_fname)
+    expected = read_manifest().get(archive_zip)
+    if expected is None:
+        print("*** Warning: no SHA-256 hash of %s in %s, recording it; "
+              "check it against a trusted copy" % (archive_zip, manifest_file))
+        record_hashes({archive_zip: digest})
+    elif digest != expected:
+        raise IOError("*** SHA-256 of %s is %s, expected %s"
+                      % (zip_fname, digest, expected))
+    return zip_fname
+
+
+def archive_dir(source, tmp_dir):
+    """
+    Return the directory containing Observations for source, extracting or
+    fetching the zip file into tmp_dir if needed.  The zip file is checked
+    against its SHA-256 hash in the manifest of maketopo.py.
+    """
+    if os.path.isdir(os.path.join(source, 'Observations')):
+        return source
+    if os.path.isdir(os.path.join(source, archive_name, 'Observations')):
+        return os.path.join(source, archive_name)
+    if os.path.isfile(source):
+        return extract_archive(check_archive(source), tmp_dir)
+    if os.path.isfile(os.path.join(source, archive_zip)):
+        zip_fname = check_archive(os.path.join(source, archive_zip))
+        return extract_archive(zip_fname, tmp_dir)
+    digest = fetch_file(archive_zip, source, output_dir=tmp_dir,
+                        sha256=read_manifest().get(archive_zip))
+    zip_fname = check_archive(os.path.join(tmp_dir, archive_zip), digest)
+    return extract_archive(zip_fname, tmp_dir)
+
+
+def default_source():
+    """
+    Return the archive directory in this example if it exists, else the
+    Zenodo record.
+    """
+    example_dir = os.path.dirname(os.path.abspath(__file__))
+    if os.path.isdir(os.path.join(example_dir, archive_name)):
+        return os.path.join(example_dir, archive_name)
+    return archive_url
+
+
+def sort_by_time(data):
+    """
+    Sort the arrays of a station in place by time, if not already sorted.
+    """
+    t = data['hours_since_quake']
+    if np.all(t[1:] >= t[:-1]):
+        return data
+    order = np.argsort(t, kind='stable')
+    n = len(t)
+    for name, value in data.items():
+        if np.ndim(value) >= 1 and np.shape(value)[-1] == n:
+            data[name] = value[..., order]
+    return data
+
+
+def write_station(station_dir, data):
+    """
+    Write each array of data to station_dir/<name>.npy.
+    """
+    os.makedirs(station_dir)
+    for name, value in data.items():
+        np.save(os.path.join(station_dir, name + '.npy'),
+                np.ascontiguousarray(value))
+
+
+def import_archive(source=None, store=store_dir, verbose=True):
+    """
+    Create the store from the archive at source (see module docstring),
+    replacing any existing store.  Returns the Store.
+    """
+    if source is None:
+        source = default_source()
+    parent = os.path.dirname(os.path.abspath(store))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    tmp_dir = tempfile.mkdtemp(prefix='.obsstore.', dir=parent)
+    try:
+        obs_dir = archive_dir(source, tmp_dir)
+        if verbose:
+            print("Importing observations from %s" % obs_dir)
+
+        stations = {}
+        for name, data in observations.read_adcp_stations(obs_dir).items():
+            uv = np.column_stack([data['u'], data['v']])
+            uv_fit = detide.poly_fit(data['hours_since_quake'], uv)
+            data['u_detided'] = data['u'] - uv_fit[:,0]
+            data['v_detided'] = data['v'] - uv_fit[:,1]
+            stations[name] = ['adcp', data]
+        periods = detide.periods_hawaii()
+        for name, data in observations.read_tide_gauges(obs_dir).items():
+            data['eta'] = data[eta_column]
+            eta_fit = detide.harmonic_fit(data['hours_since_quake'],
+                                          data['eta'], periods,
+                                          detide.svd_tol_hawaii)[0]
+            data['eta_detided'] = data['eta'] - eta_fit
+            stations[name] = ['tide', data]
+
+        new_store = os.path.join(tmp_dir, 'store')
+        index = {'source': source, 'stations': {}}
+        for name, (kind, data) in sorted(stations.items()):
+            sort_by_time(data)
+            write_station(os.path.join(new_store, name), data)
+            t = data['hours_since_quake']
+            index['stations'][name] = {
+                'kind': kind, 'ntimes': len(t),
+                'hours': [float(t[0]), float(t[-1])] if len(t) else [],
+                'fields': sorted(data.keys())}
+        with open(os.path.join(new_store, index_file), 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+
+        if os.path.isdir(store):
+            old_store = os.path.join(tmp_dir, 'old')
+            os.rename(store, old_store)
+        os.rename(new_store, store)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if verbose:
+        print("Wrote %i stations to %s" % (len(stations), store))
+    return Store(store)
+
+
+class Store(object):
+    """
+    Read-only view of the store in store_dir.  Arrays are memory-mapped.
+    """
+
+    def __init__(self, store_dir=store_dir):
+        self.store_dir = store_dir
+        fname = os.path.join(store_dir, index_file)
+        if not os.path.isfile(fname):
+            raise IOError("*** No observation store in %s, run obsstore.py"
+                          % store_dir)
+        with open(fname) as f:
+            self.index = json.load(f)
+        self._arrays = {}
+
+    @property
+    def stations(self):
+        return sorted(self.index['stations'].keys())
+
+    def fields(self, station):
+        return self.index['stations'][station]['fields']
+
+    def array(self, station, field):
+        """
+        Return the memory-mapped array field of station.
+        """
+        key = (station, field)
+        if key not in self._arrays:
+            if field not in self.fields(station):
+                raise ValueError("*** No field %s for station %s"
+                                 % (field, station))
+            fname = os.path.join(self.store_dir, station, field + '.npy')
+            self._arrays[key] = np.load(fname, mmap_mode='r')
+        return self._arrays[key]
+
+    def window(self, station, t1=None, t2=None):
+        """
+        Return the slice of the times of station with t1 <= hours_since_quake
+        <= t2 (all times if None).
+        """
+        t = self.array(station, 'hours_since_quake')
+        i1 = 0 if t1 is None else np.searchsorted(t, t1, side='left')
+        i2 = len(t) if t2 is None else np.searchsorted(t, t2, side='right')
+        return slice(i1, i2)
+
+    def get(self, station, fields, t1=None, t2=None):
+        """
+        Return the array of field for times in [t1, t2] (hours since quake),
+        or a list of arrays if fields is a list.
+        """
+        s = self.window(station, t1, t2)
+        if isinstance(fields, str):
+            return self.array(station, fields)[..., s]
+        return [self.array(station, field)[..., s] for field in fields]
+
+    def data(self, station, t1=None, t2=None):
+        """
+        Return a dictionary of all fields of station for times in [t1, t2],
+        in the format of observations.read_adcp_station.
+        """
+        s = self.window(station, t1, t2)
+        data = {}
+        for field in self.fields(station):
+            value = self.array(station, field)
+            data[field] = value if field == 'depths' else value[..., s]
+        return data
+
+
+def open_store(store=store_dir, source=None):
+    """
+    Return the Store in store, first importing the archive from source if
+    source is given and there is no store yet.
+    """
+    if source is not None and \
+            not os.path.isfile(os.path.join(store, index_file)):
+        return import_archive(source, store)
+    return Store(store)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Import the observations.')
+    parser.add_argument('source', nargs='?', default=None)
+    parser.add_argument('--store', default=store_dir)
+    args = parser.parse_args()
+    import_archive(args.source, args.store)
@@ -0,0 +1,171 @@
+"""
+Read only the AMR patches that the setplot figures can show.
+
+Each frame gets a patch index (outdir/patchindexNNNN.npz, see
+framereader.Frame.write_index) holding the patch bounding boxes sorted by
+level and xlow.  When plotting, a patch is read only if it intersects the
+xlimits/ylimits of some frame figure, and only on levels fine enough to be
+seen at the resolution of that figure: the finest level needed is the first
+one whose cells are smaller than a pixel.  For the Domain figure this skips
+levels 4-6, and in the Maui and Kahului Harbor figures the patches outside
+the axes limits.
+
+Use by calling install(plotdata) at the end of setplot, or write the
+indices for all frames in advance with
+    python patchindex.py _output
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import framereader
+
+# Default width in pixels of the axes of a frame figure:
+npixels_default = 1000
+
+
+def write_indices(outdir='_output'):
+    """
+    Write the patch index of every frame in outdir.
+    """
+    for frameno in framereader.frame_numbers(outdir):
+        frame = framereader.read_frame(frameno, outdir, use_index=False)
+        frame.write_index()
+
+
+def read_frame(frameno, outdir='_output'):
+    """
+    Return the framereader.Frame for frameno, writing its patch index first
+    if there is none.
+    """
+    frame = framereader.read_frame(frameno, outdir)
+    if not os.path.isfile(frame.index_fname()):
+        try:
+            frame.write_index()
+        except (IOError, OSError):
+            pass  # read-only output directory
+    return frame
+
+
+def figure_views(plotdata, npixels=npixels_default):
+    """
+    Return a list of [bbox, npixels] for the axes of every frame figure in
+    plotdata, where bbox is [x1, x2, y1, y2] or None if the limits are 'auto'.
+    """
+    views = []
+    for figname in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[figname]
+        if plotfigure.type != 'each_frame' or not plotfigure.show:
+            continue
+        for axesname in plotfigure._axesnames:
+            plotaxes = plotfigure.plotaxes_dict[axesname]
+            xlimits = plotaxes.xlimits
+            ylimits = plotaxes.ylimits
+            if xlimits in [None, 'auto'] or ylimits in [None, 'auto']:
+                bbox = None
+            else:
+                bbox = [xlimits[0], xlimits[1], ylimits[0], ylimits[1]]
+            views.append([bbox, npixels])
+    return views
+
+
+def visible_levels(frame, bbox, npixels):
+    """
+    Return the levels of frame to read for a view of bbox (the whole frame
+    if None) npixels wide: all levels up to the first one with cells smaller
+    than a pixel.
+    """
+    p = frame.patch_table
+    levels = np.unique(p['level'])
+    if bbox is None:
+        x1 = p['xlow'].min()
+        x2 = (p['xlow'] + p['mx']*p['dx']).max()
+    else:
+        x1, x2 = bbox[:2]
+    pixel = (x2 - x1) / float(npixels)
+    visible = []
+    for level in levels:
+        visible.append(level)
+        dx = p['dx'][np.searchsorted(p['level'], level)]
+        if dx <= pixel:
+            break
+    return visible
+
+
+def select_patches(frame, views):
+    """
+    Return the sorted indices of the patches of frame needed for any of the
+    views [bbox, npixels].
+    """
+    if not views:
+        return np.arange(len(frame.patch_table))
+    selected = [frame.select(visible_levels(frame, bbox, npixels), bbox)
+                for bbox, npixels in views]
+    return np.unique(np.concatenate(selected))
+
+
+def make_solution(frame, indices):
+    """
+    Return a pyclaw Solution holding the patches of frame with the given
+    indices, with q memory-mapped.
+    """
+    from clawpack import pyclaw
+    from clawpack.pyclaw import geometry
+
+    solution = pyclaw.Solution()
+    patches = []
+    for i in indices:
+        p = frame.patch_table[i]
+        dimensions = [geometry.Dimension(p['xlow'], p['xlow'] + p['mx']*p['dx'],
+                                         int(p['mx']), name='x'),
+                      geometry.Dimension(p['ylow'], p['ylow'] + p['my']*p['dy'],
+                                         int(p['my']), name='y')]
+        patch = geometry.Patch(dimensions)
+        patch.level = int(p['level'])
+        patch.patch_index = int(p['gridno'])
+        state = pyclaw.State(patch, frame.meqn, 0)
+        state.t = frame.t
+        state.q = frame.q(i)
+        solution.states.append(state)
+        patches.append(patch)
+    solution.domain = geometry.Domain(patches)
+    return solution
+
+
+def install(plotdata, npixels=npixels_default):
+    """
+    Replace plotdata.getframe by a version that reads only the patches
+    needed by the frame figures, for binary output.  Other output formats
+    are read as before.
+    """
+    if plotdata.format != 'binary':
+        return plotdata
+
+    original_getframe = plotdata.getframe
+
+    def getframe(frameno, outdir=None, refresh=False):
+        if outdir is None:
+            outdir = plotdata.outdir
+        key = (frameno, os.path.abspath(outdir))
+        framesoln_dict = plotdata.framesoln_dict
+        if refresh or key not in framesoln_dict:
+            try:
+                frame = read_frame(frameno, outdir)
+            except (IOError, OSError):
+                return original_getframe(frameno, outdir, refresh)
+            views = figure_views(plotdata, npixels)
+            framesoln_dict[key] = make_solution(frame,
+                                                select_patches(frame, views))
+        return framesoln_dict[key]
+
+    plotdata.getframe = getframe
+    return plotdata
+
+
+if __name__ == '__main__':
+    import sys
+    outdir = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    write_indices(outdir)
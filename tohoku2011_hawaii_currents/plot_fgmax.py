@@ -1,6 +1,9 @@
 """
 Plot fgmax output from GeoClaw run.
 
+If the run has no fgmax grid (use_fgmax_grid = False in setrun.py, the
+default), this is reported and the maxima are read from
+_output/fgmax_frames.npz written by fgmaxreduce.py (make fgmax_frames).
 """
 try:
     matplotlib  # see if it's already been imported (interactive session)
@@ -28,10 +31,20 @@ def add_gauges(label=True):
     plot([xy[0]], [xy[1]], 'k+',markersize=8)
     if label: text(203.5293,20.8951,'TG',fontsize=15)
 
-fg = fgmax_tools.FGmaxGrid()
-# fg.read_input_data('fgmax1.txt')
-fg.read_fgmax_grids_data(1)
-fg.read_output(outdir='_output')
+if os.path.isfile(os.path.join('_output', 'fgmax0001.txt')):
+    fg = fgmax_tools.FGmaxGrid()
+    # fg.read_input_data('fgmax1.txt')
+    fg.read_fgmax_grids_data(1)
+    fg.read_output(outdir='_output')
+else:
+    # No fgmax grid in the run, use the maxima reduced from the frames
+    # by fgmaxreduce.py:
+    print("*** No output of fgmax grid 1 in _output, which is disabled "
+          "unless use_fgmax_grid = True in setrun.py.  Plotting the maxima "
+          "over the output frames in _output/fgmax_frames.npz (see "
+          "fgmaxreduce.py) instead.")
+    import fgmaxreduce
+    fg = fgmaxreduce.read_results('_output')
 
 figure(1, figsize=(10,7))
 
@@ -0,0 +1,267 @@
+"""
+Plan the refinement regions from the travel time of the tsunami.
+
+The time windows of the regions in setrun.py were chosen by hand, e.g. level
+4 around Maui from 6.5 hours and level 6 in the harbor from 7.25 hours.
+Here the arrival time T(x, y) of long waves from the source is computed by
+solving the eikonal equation |grad T| = 1/c with c = sqrt(g*h) on the etopo
+bathymetry (block averaged to coarse_minutes, from the topocache) with the
+fast marching method, starting from the cells where the dtopo file uplifts
+or subsides the sea floor by more than dz_min.  Land cells are not crossed.
+T is cached in the traveltime subdirectory of the topocache directory.
+
+Each region is then replaced as follows:
+    - a region that lasts until the end of the run (the global region and
+      the regions around Maui and the harbor) starts lead_time before the
+      wave first reaches its box,
+    - a region with a finite time window is cut into slices of slice_length
+      seconds, each covering only the part of its box where the wave has
+      arrived within lead_time after the end of the slice and arrived no
+      more than trail_time before its start, so the refinement follows the
+      wave front across the ocean.
+Slices where the wave is nowhere in the box are dropped, and regions whose
+box has no wet cells on the coarse grid (e.g. a small harbor) use the
+arrival time in the nearest wet cells around the box.
+
+Set use_planned_regions = True in setrun.py to use the planned regions, or
+see them with
+    python regionplanner.py
+which prints them as regions.append lines for setrun.py.  The arrival times
+are those of linear long waves, so check the gauges against a run with the
+hand-tuned regions before relying on a shorter lead_time.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import heapq
+import hashlib
+
+import numpy as np
+
+import topocache
+import topotiles
+from maketopo import scratch_dir, sha256sum
+
+# Directory for the cached travel times:
+traveltime_dir = os.path.join(topocache.cache_dir, 'traveltime')
+
+# Resolution (arcminutes) of the grid the travel time is computed on:
+coarse_minutes = 4
+
+# Cells where abs(dz) exceeds this (m) are the source:
+dz_min = 0.1
+
+# As in geo_data in setrun.py:
+gravity = 9.81
+earth_radius = 6367500.0
+
+# Refinement starts this long (s) before the computed arrival, slices of
+# regions with finite time windows are slice_length long, and refinement
+# is kept for trail_time after the arrival:
+lead_time = 15*60.
+slice_length = 30*60.
+trail_time = 3*3600.
+
+etopo_file = topocache.topofiles[0][1]
+dtopo_file = os.path.join(scratch_dir, 'fujii.txydz')
+
+
+def coarse_bathymetry(topo_path=etopo_file, minutes=coarse_minutes):
+    """
+    Return x, y, B with the topography of topo_path block averaged to
+    cells of the given size in arcminutes.
+    """
+    x, y, Z = topocache.read_topo(topo_path)
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    factor = max(1, int(round(minutes / (60. * dx))))
+    nx = (len(x) // factor) * factor
+    ny = (len(y) // factor) * factor
+    B = topotiles.block_average(Z[:ny, :nx], factor)
+    x = x[:nx].reshape(-1, factor).mean(axis=1)
+    y = y[:ny].reshape(-1, factor).mean(axis=1)
+    return x, y, B
+
+
+def read_source(dtopo_path=dtopo_file):
+    """
+    Return x, y, dz at the last time of a dtopo_type 1 file (columns t, x,
+    y, dz).
+    """
+    t, x, y, dz = np.loadtxt(dtopo_path, unpack=True)
+    last = t == t.max()
+    return x[last], y[last], dz[last]
+
+
+def source_cells(x, y, sx, sy, sdz, dz_min=dz_min):
+    """
+    Return a boolean array of shape (len(y), len(x)), True for the cells of
+    the grid x, y nearest to the source points with abs(sdz) > dz_min.
+    """
+    source = np.zeros((len(y), len(x)), dtype=bool)
+    moved = np.abs(sdz) > dz_min
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    dy = (y[-1] - y[0]) / (len(y) - 1)
+    i = np.round((sx[moved] - x[0]) / dx).astype(int)
+    j = np.round((sy[moved] - y[0]) / dy).astype(int)
+    inside = (i >= 0) & (i < len(x)) & (j >= 0) & (j < len(y))
+    source[j[inside], i[inside]] = True
+    return source
+
+
+def travel_time(x, y, B, source, gravity=gravity, radius=earth_radius):
+    """
+    Return the travel time T (s) of long waves from the source cells over
+    the grid x, y (degrees) with topography B, by fast marching with first
+    order upwind differences.  T is inf on land and where not reached.
+    """
+    ny, nx = B.shape
+    wet = B < 0.
+    slowness = np.where(wet, 1. / np.sqrt(gravity * np.maximum(-B, 1e-3)),
+                        np.inf)
+    hx = radius * np.radians(x[1] - x[0]) * np.cos(np.radians(y))
+    hy = radius * np.radians(y[1] - y[0])
+
+    T = np.full((ny, nx), np.inf)
+    done = np.zeros((ny, nx), dtype=bool)
+    heap = []
+    for j, i in zip(*np.nonzero(source & wet)):
+        T[j, i] = 0.
+        heap.append((0., j, i))
+    heapq.heapify(heap)
+
+    while heap:
+        t, j, i = heapq.heappop(heap)
+        if done[j, i]:
+            continue
+        done[j, i] = True
+        for jn, in_ in ((j, i-1), (j, i+1), (j-1, i), (j+1, i)):
+            if jn < 0 or jn >= ny or in_ < 0 or in_ >= nx:
+                continue
+            if done[jn, in_] or not wet[jn, in_]:
+                continue
+            a = min(T[jn, in_-1] if in_ > 0 else np.inf,
+                    T[jn, in_+1] if in_ < nx-1 else np.inf)
+            b = min(T[jn-1, in_] if jn > 0 else np.inf,
+                    T[jn+1, in_] if jn < ny-1 else np.inf)
+            f = slowness[jn, in_]
+            ha, hb = hx[jn], hy
+            tnew = min(a + f*ha, b + f*hb)
+            if a < np.inf and b < np.inf:
+                # Solve ((t-a)/ha)**2 + ((t-b)/hb)**2 = f**2:
+                wa, wb = 1. / ha**2, 1. / hb**2
+                p = wa + wb
+                q = wa*a + wb*b
+                disc = q**2 - p * (wa*a**2 + wb*b**2 - f**2)
+                if disc >= 0.:
+                    t2 = (q + np.sqrt(disc)) / p
+                    if t2 >= max(a, b):
+                        tnew = min(tnew, t2)
+            if tnew < T[jn, in_]:
+                T[jn, in_] = tnew
+                heapq.heappush(heap, (tnew, jn, in_))
+    return T
+
+
+def arrival_times(topo_path=etopo_file, dtopo_path=dtopo_file,
+                  minutes=coarse_minutes, verbose=True):
+    """
+    Return x, y, T for the source in dtopo_path, from the cache if the topo,
+    dtopo and parameters have not changed.
+    """
+    key = repr([os.path.basename(topocache.cache_name(topo_path)),
+                sha256sum(dtopo_path), minutes, dz_min, gravity,
+                earth_radius])
+    fname = os.path.join(traveltime_dir, 'traveltime.%s.npz'
+                         % hashlib.sha256(key.encode()).hexdigest()[:16])
+    if os.path.isfile(fname):
+        with np.load(fname) as f:
+            return f['x'], f['y'], f['T']
+
+    x, y, B = coarse_bathymetry(topo_path, minutes)
+    source = source_cells(x, y, *read_source(dtopo_path))
+    if verbose:
+        print("Computing travel times on %i x %i grid" % (len(x), len(y)))
+    T = travel_time(x, y, B, source)
+
+    if not os.path.isdir(traveltime_dir):
+        os.makedirs(traveltime_dir)
+    tmp_fname = fname + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp_fname, x=x, y=y, T=T)
+    os.replace(tmp_fname, fname)
+    return x, y, T
+
+
+def box_times(x, y, T, box):
+    """
+    Return the finite arrival times in box = [x1, x2, y1, y2], or in the
+    smallest enlargement of box by whole cells that has any.
+    """
+    dx = x[1] - x[0]
+    dy = y[1] - y[0]
+    for k in range(max(len(x), len(y))):
+        ix = (x >= box[0] - k*dx) & (x <= box[1] + k*dx)
+        iy = (y >= box[2] - k*dy) & (y <= box[3] + k*dy)
+        Tb = T[np.ix_(iy, ix)]
+        if np.isfinite(Tb).any():
+            return Tb, x[ix], y[iy]
+    return np.zeros((0, 0)), x[:0], y[:0]
+
+
+def plan_regions(regions, x, y, T, lead=lead_time, slice_dt=slice_length,
+                 trail=trail_time):
+    """
+    Return the list of regions planned from regions (lists [minlevel,
+    maxlevel, t1, t2, x1, x2, y1, y2]) and the arrival times T on the grid
+    x, y, see the module docstring.
+    """
+    planned = []
+    for region in regions:
+        minlevel, maxlevel, t1, t2, x1, x2, y1, y2 = region
+        Tb, xb, yb = box_times(x, y, T, [x1, x2, y1, y2])
+        if not np.isfinite(Tb).any() or t2 - t1 <= slice_dt:
+            planned.append(list(region))
+            continue
+
+        tmin = np.min(Tb[np.isfinite(Tb)])
+        if t2 >= 1e9:
+            planned.append([minlevel, maxlevel, max(tmin - lead, 0.),
+                            t2, x1, x2, y1, y2])
+            continue
+
+        dx = x[1] - x[0]
+        dy = y[1] - y[0]
+        ts = t1
+        while ts < t2:
+            te = min(ts + slice_dt, t2)
+            present = (Tb <= te + lead) & (Tb >= ts - trail)
+            if present.any():
+                jj, ii = np.nonzero(present)
+                planned.append([minlevel, maxlevel, ts, te,
+                                max(x1, xb[ii.min()] - dx),
+                                min(x2, xb[ii.max()] + dx),
+                                max(y1, yb[jj.min()] - dy),
+                                min(y2, yb[jj.max()] + dy)])
+            ts = te
+    return planned
+
+
+def set_planned_regions(rundata, verbose=True):
+    """
+    Replace rundata.regiondata.regions by the planned regions for the topo
+    and dtopo files of rundata.
+    """
+    dtopo_path = rundata.dtopo_data.dtopofiles[0][-1]
+    x, y, T = arrival_times(dtopo_path=dtopo_path, verbose=verbose)
+    regions = rundata.regiondata.regions
+    regions[:] = plan_regions(regions, x, y, T)
+    return rundata
+
+
+if __name__ == '__main__':
+    import setrun
+    rundata = setrun.setrun()
+    x, y, T = arrival_times(dtopo_path=rundata.dtopo_data.dtopofiles[0][-1])
+    for region in plan_regions(rundata.regiondata.regions, x, y, T):
+        print('    regions.append([%i, %i, %.1f, %.4g, %.4f, %.4f, %.4f, %.4f])'
+              % tuple(region))
@@ -0,0 +1,400 @@
+"""
+Render the setplot figures on a process pool, regenerating only the images
+whose inputs have changed.
+
+Each (figure, frame) and (figure, gauge) image is a separate job.  Its key
+is a hash of
+    - the frame files fort.tNNNN, fort.qNNNN, fort.bNNNN, or the gauge file,
+    - the fingerprint of the run (see runcache.py), if recorded,
+    - the settings of the plotfigure from setplot(), including its axes and
+      items and the code and closure values of functions such as plot_var
+      and afteraxes, and the source of the modules of this example they
+      refer to (e.g. gaugefields.py, landlayers.py, plot_fgmax.py).
+The keys of the images in plotdir are recorded in plotdir/_render_keys.json,
+and a job is only run if its image is missing or its key has changed.  The
+other figures of setplot() (the timing plots, which also write timing.json)
+are made when the fingerprint of the run changed, or always if it has none.
+The html index is rebuilt only if some image was made.  A job that fails
+does not stop the others; the failures are reported at the end, and their
+images are made again by the next run.
+
+Use:
+    python renderplots.py [outdir [plotdir]] [--nproc N]
+or
+    make plots_cached
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import json
+import types
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import framereader
+from maketopo import sha256sum
+from runcache import read_fingerprint
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+
+keys_file = '_render_keys.json'
+
+# Plot data for the worker processes, set by init_worker:
+_plotdata = None
+
+
+def load_plotdata(outdir='_output', plotdir='_plots', setplot_file='setplot.py'):
+    """
+    Return ClawPlotData set up by the setplot function in setplot_file.
+    """
+    import importlib
+    from clawpack.visclaw.data import ClawPlotData
+    plotdata = ClawPlotData()
+    plotdata.outdir = outdir
+    plotdata.plotdir = plotdir
+    plotdata.setplot = setplot_file
+    setplot_dir, setplot_module = os.path.split(os.path.abspath(setplot_file))
+    if setplot_dir not in sys.path:
+        sys.path.insert(0, setplot_dir)
+    setplot = importlib.import_module(os.path.splitext(setplot_module)[0])
+    return setplot.setplot(plotdata)
+
+
+def code_repr(code):
+    """
+    Return a string describing a code object for hashing: its bytecode,
+    names and constants, with nested code objects (of inner functions and
+    lambdas) described the same way, since their repr contains an address.
+    """
+    consts = []
+    for c in code.co_consts:
+        if isinstance(c, types.CodeType):
+            consts.append(code_repr(c))
+        elif isinstance(c, frozenset):
+            consts.append('frozenset(%s)' % sorted(repr(v) for v in c))
+        else:
+            consts.append(repr(c))
+    return 'code(%s,[%s],%r)' % (code.co_code.hex(), ','.join(consts),
+                                 code.co_names)
+
+
+def local_module_file(module):
+    """
+    Return the source file of module if it is a module of this example
+    (e.g. gaugefields.py), else None.
+    """
+    fname = getattr(module, '__file__', None)
+    if fname and os.path.dirname(os.path.abspath(fname)) == example_dir:
+        return fname
+    return None
+
+
+def global_modules(code, namespace):
+    """
+    Return the modules of this example that code, or the code of its inner
+    functions, refers to through the global names in namespace: modules
+    such as gaugefields, and the modules of functions and classes imported
+    from them.
+    """
+    modules = {}
+    codes = [code]
+    while codes:
+        c = codes.pop()
+        codes.extend(k for k in c.co_consts if isinstance(k, types.CodeType))
+        for name in c.co_names:
+            value = namespace.get(name)
+            if not isinstance(value, types.ModuleType):
+                value = sys.modules.get(getattr(value, '__module__', None))
+            if value is not None and local_module_file(value):
+                modules[value.__name__] = value
+    return [modules[name] for name in sorted(modules)]
+
+
+def config_repr(value, seen=None):
+    """
+    Return a string describing value for hashing: the attributes of objects
+    (except private ones), and the code, constants, defaults and closure
+    values of functions, recursively.  Modules and classes are described by
+    their names only, so that the description is the same in every process,
+    and the modules of this example also by the hash of their source file.
+    These are included for the modules a function refers to through its
+    globals, so editing a helper called by setplot changes the description.
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(value, types.ModuleType):
+        if local_module_file(value):
+            return 'module(%s,%s)' % (value.__name__, sha256sum(
+                local_module_file(value), memoize=False))
+        return 'module(%s)' % value.__name__
+    if isinstance(value, type):
+        return 'class(%s.%s)' % (value.__module__, value.__qualname__)
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        func = getattr(value, '__func__', value)
+        parts = [code_repr(func.__code__),
+                 config_repr(func.__defaults__, seen)]
+        parts += [config_repr(module, seen) for module in
+                  global_modules(func.__code__, func.__globals__)]
+        for cell in func.__closure__ or []:
+            try:
+                parts.append(config_repr(cell.cell_contents, seen))
+            except ValueError:
+                pass  # empty cell
+        return 'function(%s)' % ','.join(parts)
+    if isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+        return 'builtin(%s)' % value.__name__
+    if isinstance(value, np.ndarray):
+        return 'array(%s)' % value.tolist()
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(config_repr(v, seen) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return 'set(%s)' % ','.join(sorted(config_repr(v, seen) for v in value))
+    if isinstance(value, dict):
+        return '{%s}' % ','.join('%r:%s' % (k, config_repr(value[k], seen))
+                                 for k in sorted(value.keys(), key=repr))
+    if hasattr(value, '__dict__'):
+        if id(value) in seen or type(value).__name__ == 'ClawPlotData':
+            return type(value).__name__
+        seen.add(id(value))
+        attrs = dict((k, v) for k, v in value.__dict__.items()
+                     if not k.startswith('_'))
+        return '%s%s' % (type(value).__name__, config_repr(attrs, seen))
+    if hasattr(value, 'name') and not isinstance(value, str):
+        return '%s(%s)' % (type(value).__name__, value.name)   # colormaps
+    return repr(value)
+
+
+def figure_hash(plotdata, plotfigure):
+    """
+    Return a hash of the settings of plotfigure.
+    """
+    config = [plotdata.format, plotdata.print_format, config_repr(plotfigure)]
+    return hashlib.sha256(repr(config).encode()).hexdigest()
+
+
+def make_jobs(plotdata, outdir):
+    """
+    Return a list of jobs [kind, figno, n, fname, key] for every figure in
+    print_fignos and every frame or gauge, where kind is 'frame' or 'gauge'
+    and n the frame or gauge number.
+    """
+    framenos = framereader.frame_numbers(outdir)
+    if plotdata.print_framenos != 'all':
+        framenos = [n for n in framenos if n in plotdata.print_framenos]
+    gaugenos = sorted(int(f[5:-4]) for f in os.listdir(outdir)
+                      if f.startswith('gauge') and f.endswith('.txt')
+                      and f[5:-4].isdigit())
+    if plotdata.print_gaugenos != 'all':
+        gaugenos = [n for n in gaugenos if n in plotdata.print_gaugenos]
+
+    run_fp = read_fingerprint(outdir) or ''
+    fmt = plotdata.print_format
+    jobs = []
+    for name in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[name]
+        figno = plotfigure.figno
+        if not plotfigure.show or (plotdata.print_fignos != 'all' and
+                                   figno not in plotdata.print_fignos):
+            continue
+        fig_hash = figure_hash(plotdata, plotfigure)
+        if plotfigure.type == 'each_frame':
+            for frameno in framenos:
+                files = [os.path.join(outdir, 'fort.%s%s' % (c, str(frameno).zfill(4)))
+                         for c in 'tqb']
+                key = [fig_hash, run_fp] + [sha256sum(f) for f in files
+                                            if os.path.isfile(f)]
+                fname = 'frame%sfig%s.%s' % (str(frameno).zfill(4), figno, fmt)
+                jobs.append(['frame', figno, frameno, fname, key])
+        elif plotfigure.type == 'each_gauge':
+            for gaugeno in gaugenos:
+                files = [os.path.join(outdir, 'gauge%s.%s' % (str(gaugeno).zfill(5), ext))
+                         for ext in ['txt', 'bin']]
+                key = [fig_hash, run_fp] + [sha256sum(f) for f in files
+                                            if os.path.isfile(f)]
+                fname = 'gauge%sfig%s.%s' % (str(gaugeno).zfill(4), figno, fmt)
+                jobs.append(['gauge', figno, gaugeno, fname, key])
+
+    for job in jobs:
+        job[4] = hashlib.sha256(repr(job[4]).encode()).hexdigest()
+    return jobs
+
+
+def init_worker(outdir, plotdir, setplot_file):
+    """
+    Set up the plot data in a worker process.
+    """
+    global _plotdata
+    import matplotlib
+    matplotlib.use('Agg')
+    _plotdata = load_plotdata(outdir, plotdir, setplot_file)
+
+
+def render(kind, figno, n, fname):
+    """
+    Render one figure for frame or gauge n to plotdir/fname, in a worker.
+    """
+    from matplotlib import pyplot as plt
+    from clawpack.visclaw import frametools, gaugetools
+
+    plotdata = _plotdata
+    shows = {}
+    for name in plotdata._fignames:
+        plotfigure = plotdata.plotfigure_dict[name]
+        shows[name] = plotfigure.show
+        plotfigure.show = plotfigure.show and plotfigure.figno == figno
+    try:
+        if kind == 'frame':
+            frametools.plotframe(n, plotdata, verbose=False)
+        else:
+            gaugetools.plotgauge(n, plotdata, verbose=False)
+        plt.figure(figno)
+        tmp_fname = os.path.join(plotdata.plotdir, '.tmp%i_%s' % (os.getpid(), fname))
+        plt.savefig(tmp_fname)
+        os.replace(tmp_fname, os.path.join(plotdata.plotdir, fname))
+    finally:
+        plt.close('all')
+        for name in plotdata._fignames:
+            plotdata.plotfigure_dict[name].show = shows[name]
+    return fname
+
+
+def make_html(plotdata, outdir, jobs):
+    """
+    Rebuild the html index of all images, as plotclaw does.
+    """
+    from clawpack.visclaw import plotpages
+
+    framenos = sorted(set(job[2] for job in jobs if job[0] == 'frame'))
+    gaugenos = sorted(set(job[2] for job in jobs if job[0] == 'gauge'))
+    frame_fignos = sorted(set(job[1] for job in jobs if job[0] == 'frame'))
+    gauge_fignos = sorted(set(job[1] for job in jobs if job[0] == 'gauge'))
+    fignames = dict((plotdata.plotfigure_dict[name].figno, name)
+                    for name in plotdata._fignames)
+
+    plotdata.timeframes_framenos = framenos
+    plotdata.timeframes_frametimes = dict(
+        (n, framereader.read_frame(n, outdir).t) for n in framenos)
+    plotdata.timeframes_fignos = frame_fignos
+    plotdata.timeframes_fignames = fignames
+    plotdata.gauges_gaugenos = gaugenos
+    plotdata.gauges_fignos = gauge_fignos
+    plotdata.gauges_fignames = fignames
+
+    cwd = os.getcwd()
+    os.chdir(plotdata.plotdir)
+    try:
+        plotpages.plotclaw2html(plotdata)
+    finally:
+        os.chdir(cwd)
+
+
+def make_other_figures(plotdata, outdir, old_keys):
+    """
+    Run the makefig functions of the other figures of plotdata (e.g. the
+    timing plots) in plotdir, as plotclaw does, if the run fingerprint or
+    the figure settings changed since they were last made, or the run has
+    no fingerprint.  Returns the keys of the figures made or kept.
+    """
+    run_fp = read_fingerprint(outdir)
+    keys = {}
+    for name in getattr(plotdata, '_otherfignames', []):
+        otherfigure = plotdata.otherfigure_dict[name]
+        if not otherfigure.makefig:
+            continue
+        key = hashlib.sha256(repr([run_fp, config_repr(otherfigure)])
+                             .encode()).hexdigest()
+        fname = otherfigure.fname
+        if run_fp is not None and old_keys.get(fname) == key and \
+                os.path.isfile(os.path.join(plotdata.plotdir, fname)):
+            keys[fname] = key
+            continue
+        print("Making %s" % name)
+        cwd = os.getcwd()
+        os.chdir(plotdata.plotdir)
+        try:
+            otherfigure.makefig(plotdata)
+        except Exception as e:
+            print("*** Error making %s: %s" % (name, e))
+            continue
+        finally:
+            os.chdir(cwd)
+        keys[fname] = key
+    return keys
+
+
+def render_plots(outdir='_output', plotdir='_plots', setplot_file='setplot.py',
+                 nproc=None):
+    """
+    Render the images whose keys have changed, and rebuild the html index
+    if any were made.  Returns the list of images made, or raises
+    RuntimeError listing the images that failed after making the others.
+    """
+    if not os.path.isdir(plotdir):
+        os.makedirs(plotdir)
+    outdir = os.path.abspath(outdir)
+    plotdir = os.path.abspath(plotdir)
+
+    plotdata = load_plotdata(outdir, plotdir, setplot_file)
+    jobs = make_jobs(plotdata, outdir)
+
+    keys_fname = os.path.join(plotdir, keys_file)
+    try:
+        with open(keys_fname) as f:
+            old_keys = json.load(f)
+    except (IOError, ValueError):
+        old_keys = {}
+
+    todo = [job for job in jobs if old_keys.get(job[3]) != job[4]
+            or not os.path.isfile(os.path.join(plotdir, job[3]))]
+    print("Rendering %i of %i images" % (len(todo), len(jobs)))
+
+    keys = dict((job[3], job[4]) for job in jobs
+                if old_keys.get(job[3]) == job[4])
+    failed = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=nproc, initializer=init_worker,
+                                 initargs=(outdir, plotdir, setplot_file)) as pool:
+            futures = [(job, pool.submit(render, *job[:4])) for job in todo]
+            for job, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print("*** Rendering %s failed: %s" % (job[3], e))
+                    failed.append((job[3], e))
+                    continue
+                keys[job[3]] = job[4]
+                # Save as we go, so an interrupted run keeps what it made:
+                tmp_fname = keys_fname + '.tmp%i' % os.getpid()
+                with open(tmp_fname, 'w') as f:
+                    json.dump(keys, f, indent=0, sort_keys=True)
+                os.replace(tmp_fname, keys_fname)
+
+    keys.update(make_other_figures(plotdata, outdir, old_keys))
+    tmp_fname = keys_fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        json.dump(keys, f, indent=0, sort_keys=True)
+    os.replace(tmp_fname, keys_fname)
+
+    if plotdata.html and (todo or not
+                          os.path.isfile(os.path.join(plotdir, '_PlotIndex.html'))):
+        make_html(plotdata, outdir, jobs)
+    if failed:
+        raise RuntimeError("*** %i of %i images failed: %s"
+                           % (len(failed), len(todo),
+                              ', '.join(fname for fname, e in failed)))
+    return [job[3] for job in todo]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Render plots incrementally.')
+    parser.add_argument('outdir', nargs='?', default='_output')
+    parser.add_argument('plotdir', nargs='?', default='_plots')
+    parser.add_argument('--setplot', default='setplot.py')
+    parser.add_argument('--nproc', type=int, default=None)
+    args = parser.parse_args()
+    render_plots(args.outdir, args.plotdir, args.setplot, args.nproc)
@@ -0,0 +1,191 @@
+"""
+Reuse GeoClaw output when the inputs of a run have not changed.
+
+The fingerprint of a run is a SHA-256 hash of
+    - the data files written by rundata.write() for the rundata from setrun(),
+    - the contents of every topofile and dtopofile listed in rundata,
+    - the executable, if given.
+It is recorded in the file fingerprint.txt in the output directory.
+Output whose fingerprint matches is reused instead of running the code again,
+either in place or from a shared cache of past outputs in the directory
+$RUN_CACHE (default runcache in the scratch directory).  Files are hard-linked
+between the output directory and the cache when they are on the same file
+system, so the cache takes no extra space, and copied otherwise.  Files in
+an output directory must therefore be replaced (as the run does after
+removing the old output, and os.replace does), never rewritten in place.
+
+Only make output_cached (and make all) use the cache; the standard targets
+make .output and make .plots of Clawpack run the code whenever the data
+files or the executable are newer than the output.
+
+Run the code only if needed with
+    make output_cached
+which calls
+    python runcache.py xgeoclaw _output
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+
+from maketopo import scratch_dir, sha256sum
+
+# Shared cache of past outputs, one subdirectory per fingerprint:
+cache_dir = os.environ.get('RUN_CACHE', os.path.join(scratch_dir, 'runcache'))
+
+fingerprint_file = 'fingerprint.txt'
+
+
+def input_files(rundata):
+    """
+    Return the list of topo and dtopo files used by rundata.
+    """
+    fnames = [f[-1] for f in rundata.topo_data.topofiles]
+    fnames += [f[-1] for f in rundata.dtopo_data.dtopofiles]
+    return fnames
+
+
+def rundata_fingerprint(rundata):
+    """
+    Return the SHA-256 hash of the data files written for rundata and of
+    the topo and dtopo files it uses.
+    """
+    sha = hashlib.sha256()
+    tmp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp_dir)
+        rundata.write()
+        for fname in sorted(os.listdir(tmp_dir)):
+            sha.update(fname.encode())
+            with open(fname, 'rb') as f:
+                sha.update(f.read())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+    for fname in input_files(rundata):
+        sha.update(fname.encode())
+        sha.update(sha256sum(fname).encode())
+    return sha.hexdigest()
+
+
+def fingerprint(rundata, xclawcmd=None):
+    """
+    Return the fingerprint of a run of xclawcmd with rundata.
+    """
+    sha = hashlib.sha256(rundata_fingerprint(rundata).encode())
+    if xclawcmd is not None:
+        sha.update(sha256sum(xclawcmd, memoize=False).encode())
+    return sha.hexdigest()
+
+
+def read_fingerprint(outdir):
+    """
+    Return the fingerprint recorded in outdir, or None.
+    """
+    try:
+        with open(os.path.join(outdir, fingerprint_file)) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def write_fingerprint(outdir, fp):
+    """
+    Record the fingerprint fp in outdir.
+    """
+    fname = os.path.join(outdir, fingerprint_file)
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        f.write('%s\n' % fp)
+    os.replace(tmp_fname, fname)
+
+
+def link_or_copy(src, dst):
+    """
+    Hard-link src to dst, or copy it if that is not possible (e.g. on
+    another file system).
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def fetch_output(fp, outdir, verbose=True):
+    """
+    Make outdir hold output with fingerprint fp if it already does or if
+    it is in the cache.  Returns True if so, False if the code must be run.
+    """
+    if read_fingerprint(outdir) == fp:
+        if verbose:
+            print("Output in %s is up to date" % outdir)
+        return True
+
+    cached = os.path.join(cache_dir, fp)
+    if read_fingerprint(cached) != fp:
+        return False
+
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)
+    shutil.copytree(cached, outdir, copy_function=link_or_copy)
+    if verbose:
+        print("Linked output from %s to %s" % (cached, outdir))
+    return True
+
+
+def store_output(fp, outdir, verbose=True):
+    """
+    Record fingerprint fp in outdir and link (or copy) the output into the
+    cache.
+    """
+    write_fingerprint(outdir, fp)
+    cached = os.path.join(cache_dir, fp)
+    if read_fingerprint(cached) == fp:
+        return
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Link to a temporary directory first so an incomplete copy is never
+    # mistaken for cached output:
+    tmp_dir = tempfile.mkdtemp(prefix='.' + fp[:16], dir=cache_dir)
+    os.rmdir(tmp_dir)
+    shutil.copytree(outdir, tmp_dir, copy_function=link_or_copy)
+    try:
+        os.rename(tmp_dir, cached)
+    except OSError:
+        shutil.rmtree(tmp_dir)   # stored by another process meanwhile
+    if verbose:
+        print("Stored output in %s" % cached)
+
+
+def run_cached(xclawcmd, outdir, rundata=None):
+    """
+    Run the code with output to outdir unless output with the same
+    fingerprint already exists in outdir or in the cache.
+    """
+    from clawpack.clawutil.runclaw import runclaw
+
+    if rundata is None:
+        import setrun
+        rundata = setrun.setrun()
+
+    fp = fingerprint(rundata, xclawcmd)
+    if fetch_output(fp, outdir):
+        return
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)   # may be linked to the cache
+    runclaw(xclawcmd=xclawcmd, outdir=outdir, rundir='.')
+    store_output(fp, outdir)
+
+
+if __name__ == '__main__':
+    xclawcmd = os.path.abspath(sys.argv[1])
+    outdir = sys.argv[2]
+    run_cached(xclawcmd, outdir)
@@ -0,0 +1,292 @@
+"""
+Thread scaling of xgeoclaw on this example, and the threads per member to
+use for a sweep.
+
+The Makefile leaves FFLAGS empty, so by default the code is built without
+OpenMP and OMP_NUM_THREADS has no effect.  For each build in builds (a name
+and FFLAGS, e.g. openmp = '-O2 -fopenmp') the executable is built in
+_scaling/build_<name> (rebuilt from scratch only when its FFLAGS changed),
+and a benchmark profile (see benchmark.py, smoke by default) is run from
+scratch with each number of threads, in _scaling/<build>/threads_NN.  Each
+run records
+    wall, cpu, peak_rss_mb      as in benchmark.py
+    level_wall                  wall time on each level, from timing.json
+                                (see timing.py)
+    grids                       per level, the mean and max number of grids
+                                over the output frames and the mean cells
+                                per grid, from the patch headers (see
+                                framereader.py)
+The parallel efficiency with p threads is T(p0) p0 / (p T(p)), relative to
+the smallest number of threads p0 run, in total and on each level.  GeoClaw
+distributes the grids of a level over the threads, so a level with fewer
+grids than threads cannot use them all, which the grid counts show.
+
+The recommended threads per member for a sweep (--cores-per-member of
+sweep.py) is the number of threads that maximizes the throughput of members
+on a node with ncores cores and the memory of this machine,
+    members at once = min(ncores // p, memory / peak_rss)
+    throughput = members at once / T(p)
+preferring fewer threads on ties.  Members running side by side share the
+memory bandwidth, so check the recommendation with a short sweep.  Also
+reported is the most threads with an efficiency of at least
+min_efficiency, for a single run.
+
+Example:
+    python scaling.py --threads 1,2,4,8,16 --builds openmp
+which writes _scaling/scaling.json and prints the report.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import json
+import shutil
+import subprocess
+
+import numpy as np
+
+import benchmark
+import sweep
+import timing
+import framereader
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Builds and their FFLAGS ('current' uses the xgeoclaw in this directory):
+builds = {'serial': '-O2', 'openmp': '-O2 -fopenmp'}
+
+# Efficiency below which more threads are not recommended for one run:
+min_efficiency = 0.5
+
+scaling_file = 'scaling.json'
+
+
+def build_exe(name, scaling_dir='_scaling', fflags=None):
+    """
+    Build xgeoclaw with the FFLAGS of build name in scaling_dir/build_<name>
+    and return its path.  The objects are kept there, so only changed
+    sources are recompiled unless FFLAGS changed.
+    """
+    if name == 'current':
+        xclawcmd = os.path.join(example_dir, 'xgeoclaw')
+        if not os.path.isfile(xclawcmd):
+            raise IOError("*** Missing %s, first do: make .exe" % xclawcmd)
+        return xclawcmd
+    if fflags is None:
+        fflags = builds[name]
+    build_dir = os.path.abspath(os.path.join(scaling_dir, 'build_%s' % name))
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+    shutil.copy(os.path.join(example_dir, 'Makefile'), build_dir)
+
+    flags_file = os.path.join(build_dir, 'fflags')
+    old_flags = None
+    if os.path.isfile(flags_file):
+        with open(flags_file) as f:
+            old_flags = f.read().strip()
+    target = '.exe' if old_flags == fflags else 'new'
+
+    env = dict(os.environ)
+    env['FFLAGS'] = fflags
+    print("Building %s with FFLAGS='%s'" % (name, fflags))
+    with open(os.path.join(build_dir, 'make.out'), 'w') as out:
+        status = subprocess.call(['make', target, 'FFLAGS=%s' % fflags],
+                                 cwd=build_dir, env=env, stdout=out,
+                                 stderr=subprocess.STDOUT)
+    if status != 0:
+        raise RuntimeError("*** Building %s failed, see %s"
+                           % (name, os.path.join(build_dir, 'make.out')))
+    with open(flags_file, 'w') as f:
+        f.write(fflags + '\n')
+    return os.path.join(build_dir, 'xgeoclaw')
+
+
+def grid_counts(outdir):
+    """
+    Return {level: {'mean_grids', 'max_grids', 'mean_cells'}} over the
+    output frames in outdir.
+    """
+    counts = {}
+    cells = {}
+    framenos = framereader.frame_numbers(outdir)
+    for frameno in framenos:
+        table = framereader.read_frame(frameno, outdir).patch_table
+        for level in np.unique(table['level']):
+            onlevel = table['level'] == level
+            counts.setdefault(int(level), []).append(np.sum(onlevel))
+            cells.setdefault(int(level), []).extend(
+                table['mx'][onlevel] * table['my'][onlevel])
+    grids = {}
+    for level in sorted(counts):
+        n = np.array(counts[level] + [0] * (len(framenos) - len(counts[level])))
+        grids[level] = {'mean_grids': float(n.mean()),
+                        'max_grids': int(n.max()),
+                        'mean_cells': float(np.mean(cells[level]))}
+    return grids
+
+
+def run_threads(profile, xclawcmd, outdir, threads):
+    """
+    Run profile with xclawcmd in outdir with threads OpenMP threads and
+    return its metrics.
+    """
+    if 'setup' in benchmark.profiles[profile]:
+        raise ValueError("*** Profile %s needs a checkpoint, use another "
+                         "profile for scaling" % profile)
+    rundata = sweep.make_rundata(benchmark.profiles[profile]['params'])
+    benchmark.write_data(rundata, outdir)
+    status, wall, rusage = benchmark.run_timed(xclawcmd, outdir, threads)
+    if status != 0:
+        raise RuntimeError("*** Run in %s failed with status %i, see "
+                           "xclaw.out" % (outdir, status))
+
+    metrics = {'threads': threads, 'wall': wall,
+               'cpu': rusage.ru_utime + rusage.ru_stime,
+               'peak_rss_mb': benchmark.peak_rss_mb(rusage),
+               'level_wall': {}, 'grids': {}}
+    try:
+        for entry in timing.export_timing(outdir)['levels']:
+            metrics['level_wall'][entry['level']] = entry['wall']
+    except IOError:
+        pass
+    metrics['grids'] = grid_counts(outdir)
+    return metrics
+
+
+def efficiency(runs, key=None):
+    """
+    Return the parallel efficiency of each of runs (sorted by threads),
+    relative to the first, of the total wall time or of the wall time on
+    level key.
+    """
+    def wall(run):
+        if key is None:
+            return run['wall']
+        return run['level_wall'].get(key, np.nan)
+    p0, T0 = runs[0]['threads'], wall(runs[0])
+    return [T0 * p0 / (run['threads'] * wall(run)) for run in runs]
+
+
+def memory_mb():
+    """
+    Return the physical memory of this machine in MB, or None if unknown.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2.**20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def recommend(runs, ncores=None, memory=None):
+    """
+    Return the threads per member with the largest throughput of members on
+    ncores cores (see the module docstring), the members run at once with
+    it, and the most threads with efficiency of at least min_efficiency.
+    """
+    if ncores is None:
+        ncores = os.cpu_count()
+    if memory is None:
+        memory = memory_mb()
+    best = None
+    for run in runs:
+        members = ncores // run['threads']
+        if memory:
+            members = min(members, int(memory // max(run['peak_rss_mb'], 1.)))
+        if members < 1:
+            continue
+        throughput = members / run['wall']
+        if best is None or throughput > best[2] * (1. + 1e-3):
+            best = (run['threads'], members, throughput)
+    single = max([run['threads'] for run, e in zip(runs, efficiency(runs))
+                  if e >= min_efficiency])
+    if best is None:
+        return None, 0, single
+    return best[0], best[1], single
+
+
+def run_scaling(threads_list, build_names=('openmp',), profile='smoke',
+                scaling_dir='_scaling'):
+    """
+    Build and run each build with each number of threads and write the
+    results to scaling_dir/scaling.json.  Returns {build: list of metrics}.
+    """
+    results = {}
+    for name in build_names:
+        xclawcmd = build_exe(name, scaling_dir)
+        runs = []
+        for threads in sorted(threads_list):
+            outdir = os.path.join(scaling_dir, name, 'threads_%02i' % threads)
+            run = run_threads(profile, xclawcmd, outdir, threads)
+            print("%s with %i threads: %.1f s wall" % (name, threads,
+                                                       run['wall']))
+            runs.append(run)
+        results[name] = runs
+
+    env = benchmark.environment(None)
+    env.pop('threads')
+    env['fflags'] = dict((name, builds.get(name, os.environ.get('FFLAGS', '')))
+                         for name in build_names)
+    env.update({'profile': profile, 'results': results})
+    benchmark.write_json(os.path.join(scaling_dir, scaling_file), env)
+    return results
+
+
+def print_report(results, ncores=None):
+    """
+    Print the wall time, efficiency and grid counts of each build and the
+    recommended threads per member.
+    """
+    for name, runs in sorted(results.items()):
+        levels = sorted(set().union(*[run['level_wall'] for run in runs]),
+                        key=int)
+        print('\n%s' % name)
+        print('threads   wall (s)  speedup  efficiency' +
+              ''.join('  eff L%s' % level for level in levels))
+        total = efficiency(runs)
+        per_level = [efficiency(runs, level) for level in levels]
+        for k, run in enumerate(runs):
+            print('%7i %10.1f %8.2f %11.2f' % (run['threads'], run['wall'],
+                                                runs[0]['wall'] / run['wall'],
+                                                total[k])
+                  + ''.join('%8.2f' % e[k] for e in per_level))
+
+        print('level  mean grids  max grids  cells/grid')
+        for level, g in sorted(runs[-1]['grids'].items(), key=lambda i: int(i[0])):
+            print('%5s %11.1f %10i %11.0f' % (level, g['mean_grids'],
+                                              g['max_grids'], g['mean_cells']))
+
+        threads, members, single = recommend(runs, ncores)
+        if threads is None:
+            print('Not enough memory to run a member on this machine')
+        else:
+            print('Recommended for a sweep: --cores-per-member %i '
+                  '(%i members at once)' % (threads, members))
+        print('Most threads with efficiency >= %g for one run: %i'
+              % (min_efficiency, single))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Thread scaling of xgeoclaw.')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='numbers of OpenMP threads, e.g. 1,2,4,8')
+    parser.add_argument('--builds', default='openmp',
+                        help='builds, of %s or current'
+                        % ', '.join(sorted(builds)))
+    parser.add_argument('--profile', default='smoke',
+                        help='profile of benchmark.py')
+    parser.add_argument('--ncores', type=int, default=None,
+                        help='cores per node for the recommendation')
+    parser.add_argument('--scaling-dir', default='_scaling')
+    parser.add_argument('--report', action='store_true',
+                        help='only print the report of the last scaling run')
+    args = parser.parse_args()
+
+    if args.report:
+        with open(os.path.join(args.scaling_dir, scaling_file)) as f:
+            results = json.load(f)['results']
+    else:
+        results = run_scaling([int(p) for p in args.threads.split(',')],
+                              args.builds.split(','), args.profile,
+                              args.scaling_dir)
+    print_report(results, args.ncores)
@@ -24,6 +24,7 @@ def setplot(plotdata):
     from numpy import linspace
 
     plotdata.clearfigures()  # clear any old figures,axes,items data
+    plotdata.format = 'binary'  # must match output_format in setrun.py
 
 
     # To plot gauge locations on pcolor or contour plot, use this as
@@ -43,6 +44,58 @@ def setplot(plotdata):
         #pylab.xticks(fontsize=15)
         #pylab.yticks(fontsize=15)
 
+    # The land and topo contours do not change after the dtopo motion, so
+    # with use_land_layers = True they are drawn from layers computed once
+    # from the topo files and cached, rather than from the patches of each
+    # frame (see landlayers.py).  The layers show all topography above sea
+    # level rather than the dry cells of each frame (e.g. not the sea floor
+    # exposed by the drawdown), and are only used if the topo files are
+    # found:
+    use_land_layers = False
+
+    # Set show_contours = True to add contour lines of bathy:
+    show_contours = False
+
+    def land_layer(cmin, cmax, contour_levels):
+        def afteraxes(current_data):
+            import landlayers
+            levels = contour_levels if show_contours else None
+            landlayers.draw_land(geoplot.land_colors, cmin, cmax, levels,
+                                 {'linestyles':'solid','linewidths':2})
+            fixup(current_data)
+        return afteraxes
+
+    def add_land(plotaxes, cmin, cmax, contour_levels, amr_contour_show):
+        # Land and contour lines of bathy, from the layers or from the
+        # patches of each frame:
+        if use_land_layers:
+            import landlayers
+            if landlayers.have_topo():
+                plotaxes.afteraxes = land_layer(cmin, cmax, contour_levels)
+                return
+        plotaxes.afteraxes = fixup
+
+        # Land
+        plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
+        plotitem.plot_var = geoplot.land
+        plotitem.imshow_cmap = geoplot.land_colors
+        plotitem.imshow_cmin = cmin
+        plotitem.imshow_cmax = cmax
+        plotitem.add_colorbar = False
+        plotitem.celledges_show = 0
+        plotitem.patchedges_show = 0
+
+        # add contour lines of bathy if desired:
+        plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
+        plotitem.show = show_contours
+        plotitem.plot_var = geoplot.topo
+        plotitem.contour_levels = contour_levels
+        plotitem.amr_contour_colors = ['y']  # color on each level
+        plotitem.kwargs = {'linestyles':'solid','linewidths':2}
+        plotitem.amr_contour_show = amr_contour_show
+        plotitem.celledges_show = 0
+        plotitem.patchedges_show = 0
+
 
     #-----------------------------------------
     # Figure for imshow plot
@@ -54,8 +107,6 @@ def setplot(plotdata):
     plotaxes.title = 'Surface'
     plotaxes.scaled = True
 
-    plotaxes.afteraxes = fixup
-
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
     # plotitem.plot_var = geoplot.surface
@@ -68,30 +119,11 @@ def setplot(plotdata):
     plotitem.patchedges_show = 0
     #plotitem.amr_patchedges_show = [1,1,1,0,0]  # only coarse levels
 
-    # Land
-    plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
-    plotitem.imshow_cmap = geoplot.land_colors
-    plotitem.imshow_cmin = 0.0
-    plotitem.imshow_cmax = 100.0
-    plotitem.add_colorbar = False
-    plotitem.amr_celledges_show = [0,0,0]
-    plotitem.patchedges_show = 0
-    #plotitem.amr_patchedges_show = [1,1,1,0,0]  # only coarse levels
+    add_land(plotaxes, 0.0, 100.0, linspace(-2000,0,5), [1,0,0])
+
     plotaxes.xlimits = 'auto'
     plotaxes.ylimits = 'auto'
 
-    # add contour lines of bathy if desired:
-    plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.show = False
-    plotitem.plot_var = geoplot.topo
-    plotitem.contour_levels = linspace(-2000,0,5)
-    plotitem.amr_contour_colors = ['y']  # color on each level
-    plotitem.kwargs = {'linestyles':'solid','linewidths':2}
-    plotitem.amr_contour_show = [1,0,0]
-    plotitem.celledges_show = 0
-    plotitem.patchedges_show = 0
-
 
     #-----------------------------------------
     # Figure for zoom plot
@@ -103,8 +135,6 @@ def setplot(plotdata):
     plotaxes.title = 'Surface'
     plotaxes.scaled = True
 
-    plotaxes.afteraxes = fixup
-
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
     # plotitem.plot_var = geoplot.surface
@@ -116,28 +146,11 @@ def setplot(plotdata):
     plotitem.amr_celledges_show = [0,0,0]
     plotitem.patchedges_show = 0
 
-    # Land
-    plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
-    plotitem.imshow_cmap = geoplot.land_colors
-    plotitem.imshow_cmin = 0.0
-    plotitem.imshow_cmax = 100.0
-    plotitem.add_colorbar = False
-    plotitem.amr_celledges_show = [0,0,0]
-    plotitem.patchedges_show = 0
+    add_land(plotaxes, 0.0, 100.0, linspace(-2000,0,5), [1,0,0])
+
     plotaxes.xlimits = [203.2, 204.1]
     plotaxes.ylimits = [20.4, 21.3]
-
-    # add contour lines of bathy if desired:
-    plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.show = False
-    plotitem.plot_var = geoplot.topo
-    plotitem.contour_levels = linspace(-2000,0,5)
-    plotitem.amr_contour_colors = ['y']  # color on each level
-    plotitem.kwargs = {'linestyles':'solid','linewidths':2}
-    plotitem.amr_contour_show = [1,0,0]
-    plotitem.celledges_show = 0
-    plotitem.patchedges_show = 0
+    plotaxes.skip_patches_outside_xylimits = True
 
 
     #-----------------------------------------
@@ -150,8 +163,6 @@ def setplot(plotdata):
     plotaxes.title = 'Surface'
     plotaxes.scaled = True
 
-    plotaxes.afteraxes = fixup
-
     # Water
     plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
     # plotitem.plot_var = geoplot.surface
@@ -163,34 +174,20 @@ def setplot(plotdata):
     plotitem.celledges_show = 0
     plotitem.patchedges_show = 0
 
-    # Land
-    plotitem = plotaxes.new_plotitem(plot_type='2d_imshow')
-    plotitem.plot_var = geoplot.land
-    plotitem.imshow_cmap = geoplot.land_colors
-    plotitem.imshow_cmin = 0.0
-    plotitem.imshow_cmax = 10.0
-    plotitem.add_colorbar = False
-    plotitem.celledges_show = 0
-    plotitem.patchedges_show = 0
+    add_land(plotaxes, 0.0, 10.0, linspace(0,8,9), [0,0,0,0,0,1])
+
     plotaxes.xlimits = [203.48, 203.57]
     plotaxes.ylimits = [20.88, 20.94]
-
-    # add contour lines of bathy if desired:
-    plotitem = plotaxes.new_plotitem(plot_type='2d_contour')
-    plotitem.show = False
-    plotitem.plot_var = geoplot.topo
-    #plotitem.contour_levels = linspace(-2000,0,5)
-    plotitem.contour_levels = linspace(0,8,9)
-    plotitem.amr_contour_colors = ['y']  # color on each level
-    plotitem.kwargs = {'linestyles':'solid','linewidths':2}
-    plotitem.amr_contour_show = [0,0,0,0,0,1]
-    plotitem.celledges_show = 0
-    plotitem.patchedges_show = 0
+    plotaxes.skip_patches_outside_xylimits = True
 
 
     #-----------------------------------------
     # Figures for gauges
     #-----------------------------------------
+    # Velocities, speed and topo at the gauges are computed once per gauge
+    # and shared by all plot items (see gaugefields.py):
+    import gaugefields
+
     plotfigure = plotdata.new_plotfigure(name='Surface', figno=300, \
                     type='each_gauge')
     plotfigure.clf_each_gauge = True
@@ -211,11 +208,7 @@ def setplot(plotdata):
     plotitem.show = False
 
     def gaugetopo(current_data):
-        q = current_data.q
-        h = q[0,:]
-        eta = q[3,:]
-        topo = eta - h
-        return topo
+        return gaugefields.get(current_data, 'topo')
 
     plotitem.plot_var = gaugetopo
     plotitem.plotstyle = 'g-'
@@ -253,34 +246,20 @@ def setplot(plotdata):
     plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
     plotitem.show = True
     def speed(current_data):
-        from numpy import where, sqrt
-        h = current_data.q[0,:]
-        h = where(h>0.01, h, 1.e6)
-        u = 100. * current_data.q[1,:] / h
-        v = 100. * current_data.q[2,:] / h
-        s = sqrt(u**2 + v**2)
-        return s
+        return 100. * gaugefields.get(current_data, 'speed')
     plotitem.plot_var = speed
     plotitem.plotstyle = 'k-'
 
     plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
     def uvel(current_data):
-        from numpy import where, sqrt
-        h = current_data.q[0,:]
-        h = where(h>0.01, h, 1.e6)
-        u = 100. * current_data.q[1,:] / h
-        return u
+        return 100. * gaugefields.get(current_data, 'u')
     plotitem.plot_var = uvel
     plotitem.plotstyle = 'r-'
     plotitem.kwargs = {'linewidth':2}
 
     plotitem = plotaxes.new_plotitem(plot_type='1d_plot')
     def vvel(current_data):
-        from numpy import where, sqrt
-        h = current_data.q[0,:]
-        h = where(h>0.01, h, 1.e6)
-        v = 100. * current_data.q[2,:] / h
-        return v
+        return 100. * gaugefields.get(current_data, 'v')
     plotitem.plot_var = vvel
     plotitem.plotstyle = 'g-'
     plotitem.kwargs = {'linewidth':2}
@@ -301,6 +280,13 @@ def setplot(plotdata):
     def make_timing_plots(plotdata):
         from clawpack.visclaw import plot_timing_stats
         import os,sys
+        import timing
+        # Also save the timing per level and output interval in
+        # timing.json, to compare runs with: python timing.py old new
+        try:
+            timing.export_timing(plotdata.outdir)
+        except (IOError, OSError, ValueError) as e:
+            print('*** Error exporting timing: %s' % e)
         try:
             timing_plotdir = plotdata.plotdir + '/_timing_figures'
             os.system('mkdir -p %s' % timing_plotdir)
@@ -311,8 +297,8 @@ def setplot(plotdata):
                                           make_pngs=True,
                                           plotdir=timing_plotdir, 
                                           units=units)
-        except:
-            print('*** Error making timing plots')
+        except Exception as e:
+            print('*** Error making timing plots: %s' % e)
 
     otherfigure = plotdata.new_otherfigure(name='timing plots',
                     fname='_timing_figures/timing.html')
@@ -338,4 +324,9 @@ def setplot(plotdata):
     plotdata.latex_makepdf = False           # also run pdflatex?
     plotdata.parallel = True
 
+    # Only read the patches that intersect the frame figures, on the levels
+    # visible at their resolution (see patchindex.py):
+    import patchindex
+    patchindex.install(plotdata)
+
     return plotdata
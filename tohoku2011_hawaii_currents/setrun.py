@@ -9,6 +9,8 @@ that will be read in by the Fortran code.
 import os
 import numpy as np
 
+from topocache import solver_topofile
+
 try:
     CLAW = os.environ['CLAW']
 except:
@@ -18,6 +20,25 @@ topodir = os.path.join(CLAW, 'geoclaw', 'scratch')
 if not os.path.isdir(topodir):
     raise Exception("*** Missing topo directory: %s" % topodir)
 
+# Set to True to replace the topofiles by tiles cropped to the domain and
+# coarsened to the finest level allowed in each region, see topotiles.py:
+use_topo_tiles = False
+
+# Set to True to write the gauge output in binary (requires GeoClaw 5.9 or
+# later), which is read much faster than text, see gaugeio.py:
+binary_gauges = False
+
+# Set to True to add fgmax grid 1 over Kahului harbor (plotted by
+# plot_fgmax.py) on the cell centers of the finest level allowed there,
+# without the points on high land, see fgmaxgrids.py.  This reads the
+# topocache (make topo) in every call of setrun(), e.g. for each member of
+# a sweep:
+use_fgmax_grid = False
+
+# Set to True to replace the time windows of the regions below by windows
+# planned from the travel time of the tsunami, see regionplanner.py:
+use_planned_regions = False
+
 
 #------------------------------
 def setrun(claw_pkg='geoclaw'):
@@ -141,7 +162,7 @@ def setrun(claw_pkg='geoclaw'):
         clawdata.output_t0 = False  # output at initial (or restart) time?
 
 
-    clawdata.output_format == 'binary'      # 'ascii', 'binary', 'netcdf'
+    clawdata.output_format = 'binary'      # 'ascii', 'binary', 'netcdf'
 
     clawdata.output_q_components = 'all'   # could be list such as [True,True]
     clawdata.output_aux_components = 'none'  # could be list
@@ -253,6 +274,9 @@ def setrun(claw_pkg='geoclaw'):
     # more accurate coordinates from Yong Wei at PMEL:
     gauges.append([5680, 203.530944, 20.895, 7.0*3600., 1.e9]) #TG Kahului
 
+    if binary_gauges:
+        rundata.gaugedata.file_format = 'binary'
+
 
     # --------------
     # Checkpointing:
@@ -363,6 +387,20 @@ def setrun(claw_pkg='geoclaw'):
     # Time interval :  (26100.0, inf)
     regions.append([6, 6,  7.25*3600., inf, 203.52,    203.537, 20.89,   20.905])
 
+    if use_planned_regions:
+        import regionplanner
+        regionplanner.set_planned_regions(rundata)
+
+    if use_topo_tiles:
+        # Must come after the domain, AMR parameters and regions are set:
+        import topotiles
+        topotiles.set_topo_tiles(rundata)
+
+    if use_fgmax_grid:
+        # Must come after the domain, AMR parameters and regions are set:
+        import fgmaxgrids
+        fgmaxgrids.set_fgmax_grids(rundata)
+
 
     #  ----- For developers -----
     # Toggle debugging print statements:
@@ -417,11 +455,13 @@ def setgeo(rundata):
     refinement_data.wave_tolerance = 0.02
 
     # == settopo.data values ==
+    # solver_topofile uses the NetCDF copy of a file made by topocache.py
+    # if there is one, and prints which file is used, see topocache.py.
     topofiles = rundata.topo_data.topofiles
-    topofiles.append([3, os.path.join(topodir,'etopo1min130E210E0N60N.asc')])
+    topofiles.append(solver_topofile(3, os.path.join(topodir,'etopo1min130E210E0N60N.asc')))
     # hawaii_6s topofile not needed, results very similar either way
-    #topofiles.append([3, os.path.join(topodir,'hawaii_6s.txt')])
-    topofiles.append([3, os.path.join(topodir,'kahului_1s.txt')])
+    #topofiles.append(solver_topofile(3, os.path.join(topodir,'hawaii_6s.txt')))
+    topofiles.append(solver_topofile(3, os.path.join(topodir,'kahului_1s.txt')))
 
 
     # == setdtopo.data values ==
@@ -446,6 +486,8 @@ def setgeo(rundata):
 
     # Now append to this list objects of class fgmax_tools.FGmaxGrid
     # specifying any fgmax grids.
+    # Grid 1 over Kahului harbor is appended at the end of setrun if
+    # use_fgmax_grid, once the AMR levels and regions are known.
 
 
 
@@ -457,7 +499,18 @@ if __name__ == '__main__':
     # Set up run-time parameters and write all data files.
     import sys
     from clawpack.geoclaw import kmltools
+    from runcache import rundata_fingerprint
     rundata = setrun(*sys.argv[1:])
     rundata.write()
 
-    kmltools.make_input_data_kmls(rundata)
+    # Only remake the kml files if the data or topo files have changed:
+    kml_fingerprint = rundata_fingerprint(rundata)
+    try:
+        with open('.kml_fingerprint') as f:
+            make_kmls = f.read().strip() != kml_fingerprint
+    except IOError:
+        make_kmls = True
+    if make_kmls:
+        kmltools.make_input_data_kmls(rundata)
+        with open('.kml_fingerprint', 'w') as f:
+            f.write('%s\n' % kml_fingerprint)
@@ -0,0 +1,263 @@
+"""
+Scores of GeoClaw gauge output against the observations.
+
+Each entry of comparisons compares one variable of a GeoClaw gauge with an
+observed series from the observation store (see obsstore.py):
+    gauge 1123, u and v (cm/s)  with the detided ADCP velocities at HAI1123
+    gauge 5680, eta (m)         with the detided tide gauge 1615680
+over the time window (hours since the earthquake) shown in
+compare_results.ipynb.  For each comparison and each run (e.g. each member
+of a sweep) the scores are:
+    tshift          time shift (s) of the model that best matches the
+                    observations, from the normalized cross-correlation
+                    computed with FFTs for all runs at once; positive if the
+                    model is early, as tshift = 10*60 in the notebook
+    correlation     correlation at tshift
+    rms, rms_default  RMS error at tshift and at default_tshift
+    peak_obs, peak_model, peak_error
+                    largest absolute value in the window (model at tshift)
+    arrival_obs, arrival_model, arrival_error
+                    first time (s) the absolute value reaches
+                    arrival_fraction of peak_obs (model not shifted)
+The scores are returned as a structured array with one row per run and
+comparison, which converts directly to a pandas DataFrame.
+
+Use:
+    python skill.py _output          # scores of one run
+    python skill.py _sweep           # scores of all members of a sweep
+which also write the table to skill.csv in the directory.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import gaugeio
+import gaugefields
+
+# [gaugeno, model variable, scale to observed units, station, observed field]:
+comparisons = [[1123, 'u', 100., 'HAI1123_Kahului_harbor', 'u_detided'],
+               [1123, 'v', 100., 'HAI1123_Kahului_harbor', 'v_detided'],
+               [5680, 'eta', 1., '1615680', 'eta_detided']]
+
+# Window compared, in hours since the earthquake:
+time_window = [7.25, 13.]
+
+# Time shift used in compare_results.ipynb, and largest shift searched (s):
+default_tshift = 10*60.
+max_tshift = 30*60.
+
+# Spacing (s) of the uniform grid used for the cross-correlation:
+shift_resolution = 10.
+
+# Arrival is when the absolute value first reaches this fraction of peak_obs:
+arrival_fraction = 0.25
+
+table_dtype = np.dtype([('member', 'i4'), ('gaugeno', 'i4'),
+                        ('variable', 'U8'), ('tshift', 'f8'),
+                        ('correlation', 'f8'), ('rms', 'f8'),
+                        ('rms_default', 'f8'), ('peak_obs', 'f8'),
+                        ('peak_model', 'f8'), ('peak_error', 'f8'),
+                        ('arrival_obs', 'f8'), ('arrival_model', 'f8'),
+                        ('arrival_error', 'f8')])
+
+
+def model_series(gauge, variable, scale=1.):
+    """
+    Return times and scale times variable ('h', 'u', 'v', 'eta', ...) of a
+    gauge array with columns level, t, h, hu, hv, eta.
+    """
+    gauge = np.asarray(gauge)
+    q = gauge[:, 2:].T
+    if variable in gaugefields.components:
+        values = gaugefields.get(q, variable)
+    else:
+        values = gaugefields.compute_fields(q)[variable]
+    return gauge[:, 1], scale * np.asarray(values, dtype=float)
+
+
+def observed_series(store, station, field, window=time_window):
+    """
+    Return times (s since the earthquake) and values of field at station
+    in the observation store, in window (hours).
+    """
+    t, values = store.get(station, ['hours_since_quake', field], *window)
+    return 3600. * np.asarray(t), np.asarray(values, dtype=float)
+
+
+def sample(t, values, tnew):
+    """
+    Linearly interpolate values at times t to times tnew, nan outside the
+    times or next to nan values.
+    """
+    if len(t) == 0:
+        return np.full(len(tnew), np.nan)
+    return np.interp(tnew, t, values, left=np.nan, right=np.nan)
+
+
+def best_shifts(t_obs, obs, models, dt=shift_resolution, max_shift=max_tshift):
+    """
+    Return the time shifts s (one per model) maximizing the correlation
+    between obs(t) and model(t - s) for |s| <= max_shift, and the
+    correlations, where models is a list of (t, values).  All correlations
+    of all models are computed with one batch of FFTs on a uniform grid
+    with spacing dt.
+    """
+    t1, t2 = t_obs[0], t_obs[-1]
+    N = int(np.floor((t2 - t1) / dt)) + 1
+    L = int(np.ceil(max_shift / dt))
+    tau = t1 + dt * np.arange(N)
+    tau_ext = t1 + dt * np.arange(-L, N + L)
+
+    O = sample(t_obs, obs, tau)
+    w = np.isfinite(O).astype(float)
+    if w.sum() == 0:
+        nan = np.full(len(models), np.nan)
+        return nan, nan
+    O = np.where(w > 0, O - np.nansum(O) / w.sum(), 0.)
+
+    M = np.array([sample(t, values, tau_ext) for t, values in models])
+    M = M.reshape(len(models), len(tau_ext))
+    M = np.where(np.isfinite(M), M, 0.)
+
+    nfft = 1 << int(np.ceil(np.log2(N + len(tau_ext))))
+    FO = np.conj(np.fft.rfft(O, nfft))
+    Fw = np.conj(np.fft.rfft(w, nfft))
+    FM = np.fft.rfft(M, nfft, axis=1)
+    FM2 = np.fft.rfft(M**2, nfft, axis=1)
+    # C[p] = sum_k O[k]*M[k+p], and the sums of M and M**2 under the mask:
+    C = np.fft.irfft(FO * FM, nfft, axis=1)[:, :2*L+1]
+    S1 = np.fft.irfft(Fw * FM, nfft, axis=1)[:, :2*L+1]
+    S2 = np.fft.irfft(Fw * FM2, nfft, axis=1)[:, :2*L+1]
+
+    var_model = np.maximum(S2 - S1**2 / w.sum(), 0.)
+    denom = np.sqrt(np.sum(O**2) * var_model)
+    corr = np.where(denom > 1e-12 * denom.max(initial=0.), C / np.where(
+                    denom > 0, denom, 1.), -np.inf)
+
+    p = np.argmax(corr, axis=1)
+    rows = np.arange(len(models))
+    best = corr[rows, p]
+    # refine with the parabola through the neighbouring values:
+    pm = np.clip(p - 1, 0, 2*L)
+    pp = np.clip(p + 1, 0, 2*L)
+    c0, cm, cp = best, corr[rows, pm], corr[rows, pp]
+    curvature = cm - 2*c0 + cp
+    ok = (p > 0) & (p < 2*L) & np.isfinite(curvature) & (curvature < 0)
+    delta = np.where(ok, 0.5 * (cm - cp) / np.where(ok, curvature, 1.), 0.)
+    shifts = np.where(np.isfinite(best), (L - (p + delta)) * dt, np.nan)
+    best = np.where(np.isfinite(best), best, np.nan)
+    return shifts, best
+
+
+def arrival_time(t, values, threshold):
+    """
+    Return the first time abs(values) >= threshold, nan if never.
+    """
+    i = np.nonzero(np.abs(values) >= threshold)[0]
+    return t[i[0]] if len(i) else np.nan
+
+
+def score(gauges, store=None, window=time_window):
+    """
+    Return the table of scores (see module docstring) for gauges, a
+    dictionary gauges[member][gaugeno] of gauge arrays (as returned by
+    sweep.load_results), against the observation store.
+    """
+    if store is None:
+        import obsstore
+        store = obsstore.Store()
+    members = sorted(gauges.keys())
+    rows = []
+    for gaugeno, variable, scale, station, field in comparisons:
+        t_obs, obs = observed_series(store, station, field, window)
+        runs = [m for m in members if gaugeno in gauges[m]]
+        if not runs or len(t_obs) < 2:
+            continue
+        models = [model_series(gauges[m][gaugeno], variable, scale)
+                  for m in runs]
+        shifts, corr = best_shifts(t_obs, obs, models)
+
+        valid = np.isfinite(obs)
+        peak_obs = np.max(np.abs(obs[valid])) if valid.any() else np.nan
+        threshold = arrival_fraction * peak_obs
+        arrival_obs = arrival_time(t_obs[valid], obs[valid], threshold)
+        t1, t2 = 3600. * window[0], 3600. * window[1]
+
+        for m, (t, values), tshift, c in zip(runs, models, shifts, corr):
+            row = dict(member=m, gaugeno=gaugeno, variable=variable,
+                       tshift=tshift, correlation=c, peak_obs=peak_obs,
+                       arrival_obs=arrival_obs)
+            for name, s in [('rms', tshift), ('rms_default', default_tshift)]:
+                diff = sample(t + s, values, t_obs) - obs
+                row[name] = np.sqrt(np.nanmean(diff**2)) \
+                    if np.isfinite(diff).any() else np.nan
+            shifted = sample(t + tshift, values, t_obs)
+            row['peak_model'] = np.nanmax(np.abs(shifted)) \
+                if np.isfinite(shifted).any() else np.nan
+            row['peak_error'] = row['peak_model'] - peak_obs
+            in_window = (t >= t1) & (t <= t2)
+            row['arrival_model'] = arrival_time(t[in_window],
+                                                values[in_window], threshold)
+            row['arrival_error'] = row['arrival_model'] - arrival_obs
+            rows.append(tuple(row[name] for name in table_dtype.names))
+
+    table = np.array(rows, dtype=table_dtype)
+    return np.sort(table, order=['member', 'gaugeno', 'variable'])
+
+
+def read_output(outdir='_output', member=0):
+    """
+    Return the gauges of the comparisons in outdir, in the format of the
+    gauges argument of score.
+    """
+    gaugenos = sorted(set(c[0] for c in comparisons))
+    records = gaugeio.read_gauges([outdir], gaugenos)
+    return {member: dict((gaugeno, gaugeio.gauge_array(g))
+                         for (d, gaugeno), g in records.items())}
+
+
+def score_member(member_dir, store=None):
+    """
+    Score the gauges of a finished sweep member (member_dir/gauges.npz) and
+    write member_dir/skill.csv.  Returns the table.
+    """
+    m = int(os.path.basename(os.path.normpath(member_dir)).split('_')[-1])
+    with np.load(os.path.join(member_dir, 'gauges.npz')) as f:
+        gauges = {m: dict((int(key[5:]), f[key]) for key in f.files)}
+    table = score(gauges, store)
+    write_csv(os.path.join(member_dir, 'skill.csv'), table)
+    return table
+
+
+def write_csv(fname, table):
+    """
+    Write the table of scores to fname with a header line.
+    """
+    tmp_fname = fname + '.tmp'
+    with open(tmp_fname, 'w') as f:
+        f.write(','.join(table.dtype.names) + '\n')
+        for row in table:
+            f.write(','.join(str(v) if isinstance(v, (str, np.str_))
+                             else '%.6g' % v for v in row) + '\n')
+    os.replace(tmp_fname, fname)
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    if os.path.isfile(os.path.join(path, 'results.npz')):
+        import sweep
+        members, params, gauges = sweep.load_results(path)
+    else:
+        gauges = read_output(path)
+    table = score(gauges)
+    write_csv(os.path.join(path, 'skill.csv'), table)
+    for row in table:
+        print('%4i %5i %-4s tshift %7.1f s  corr %5.2f  rms %8.3f  '
+              'peak error %8.3f  arrival error %7.1f s'
+              % (row['member'], row['gaugeno'], row['variable'], row['tshift'],
+                 row['correlation'], row['rms'], row['peak_error'],
+                 row['arrival_error']))
@@ -0,0 +1,388 @@
+"""
+Amplitude spectra and spectrograms of gauge and observed series.
+
+The harbor seiches at Kahului show up as peaks in the amplitude spectra of
+the currents at HAI1123 and of the surface at the tide gauge.  For each
+entry of skill.comparisons, the series of all runs (e.g. all members of a
+sweep) and the detided observations from the observation store (see
+obsstore.py) are sampled on one uniform grid with spacing dt over the time
+window, tapered with a Hann window, and transformed with one rfft call for
+the whole stack of series.  For each series the table returned by analyze
+gives
+    dominant periods    the periods (minutes) of the largest peaks of the
+                        amplitude spectrum between min_period and max_period
+    energy per band     the sum of the squared amplitudes with periods in
+                        each band of period_bands (minutes), e.g. E_10_20,
+                        corrected for the Hann window so that a sine of
+                        amplitude a in the band gives a**2
+    t_peak              the time (hours) of the spectrogram segment with
+                        the largest amplitude between min_period and
+                        max_period
+with member -1 for the observations.  The spectrograms are the spectra on
+overlapping segments of the series, again computed for all series at once.
+
+The spectra of a run only depend on its output, so they are cached (in
+$CLAW/geoclaw/scratch/spectra) by the fingerprint of the run recorded by
+runcache.py and the analysis parameters, see run_spectra.
+
+Use:
+    python spectra.py _output          # spectra of one run
+    python spectra.py _sweep           # spectra of all members of a sweep
+which also write the table to spectra.csv and the spectra and spectrograms
+to spectra.npz in the directory.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import hashlib
+
+import numpy as np
+
+import skill
+import runcache
+from maketopo import scratch_dir
+
+# Cache of the spectra of runs, by fingerprint:
+cache_dir = os.path.join(scratch_dir, 'spectra')
+
+# Spacing (s) of the uniform grid the series are sampled on:
+sample_dt = 60.
+
+# Period bands (minutes) for the energy, and range of the dominant periods:
+period_bands = [[4., 10.], [10., 20.], [20., 40.], [40., 80.], [80., 180.]]
+min_period = 4.
+max_period = 180.
+
+# Number of dominant periods reported, and smallest peak relative to the
+# largest amplitude of the spectrum (below is rounding noise):
+num_peaks = 3
+peak_tol = 1e-10
+
+# Length and overlap of the spectrogram segments (s):
+segment_length = 2*3600.
+segment_overlap = 0.75
+
+# Equivalent noise bandwidth (in frequency bins) of the Hann window:
+hann_enbw = 1.5
+
+
+def table_dtype(bands=period_bands, npeaks=num_peaks):
+    """
+    Return the structured dtype of the table returned by analyze.
+    """
+    fields = [('member', 'i4'), ('gaugeno', 'i4'), ('variable', 'U8'),
+              ('station', 'U32')]
+    fields += [('period%i' % (k+1), 'f8') for k in range(npeaks)]
+    fields += [('E_%g_%g' % tuple(band), 'f8') for band in bands]
+    fields += [('t_peak', 'f8')]
+    return np.dtype(fields)
+
+
+def resample(series, t1, t2, dt=sample_dt):
+    """
+    Return the times tau (s) of the uniform grid from t1 to t2 with spacing
+    dt and an array of shape (len(series), len(tau)) with each (t, values)
+    in series sampled on it, with its mean removed and 0 where it is not
+    defined.
+    """
+    tau = t1 + dt * np.arange(int(np.floor((t2 - t1) / dt)) + 1)
+    X = np.array([skill.sample(t, values, tau) for t, values in series])
+    X = X.reshape(len(series), len(tau))
+    valid = np.isfinite(X)
+    count = np.maximum(valid.sum(axis=1, keepdims=True), 1)
+    mean = np.where(valid, X, 0.).sum(axis=1, keepdims=True) / count
+    return tau, np.where(valid, X - mean, 0.)
+
+
+def amplitude_spectra(X, dt=sample_dt):
+    """
+    Return the frequencies (Hz) and the one-sided amplitude spectra of the
+    rows of X, tapered with a Hann window, so a sine of amplitude a at a
+    frequency of the grid has a peak of height a.
+    """
+    w = np.hanning(X.shape[-1])
+    F = np.fft.rfft(X * w, axis=-1)
+    amplitude = 2. * np.abs(F) / w.sum()
+    return np.fft.rfftfreq(X.shape[-1], dt), amplitude
+
+
+def spectrograms(X, dt=sample_dt, length=segment_length,
+                 overlap=segment_overlap):
+    """
+    Return the segment centers (s from the first sample), frequencies and
+    the amplitude spectra of shape (len(X), nsegments, nfreq) of segments of
+    the rows of X of duration length, overlapping by the fraction overlap.
+    """
+    n = min(int(round(length / dt)), X.shape[-1])
+    step = max(1, int(round(n * (1. - overlap))))
+    segments = np.lib.stride_tricks.sliding_window_view(X, n, axis=-1)
+    segments = segments[..., ::step, :]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    freq, amplitude = amplitude_spectra(segments, dt)
+    centers = dt * (np.arange(segments.shape[-2]) * step + (n - 1) / 2.)
+    return centers, freq, amplitude
+
+
+def dominant_periods(freq, amplitude, npeaks=num_peaks,
+                     period_range=(min_period, max_period)):
+    """
+    Return the periods (minutes) of the npeaks largest local maxima of each
+    row of amplitude within period_range, largest first (nan if fewer).
+    A local maximum is taken over the whole spectrum, so the end bins of
+    period_range are not maxima just because their neighbours are outside
+    it, and must be above rounding noise (peak_tol times the largest
+    amplitude of the row).
+    """
+    with np.errstate(divide='ignore'):
+        period = np.where(freq > 0, 1. / (60. * freq), np.inf)
+    inrange = (period >= period_range[0]) & (period <= period_range[1])
+    top = amplitude.max(axis=-1, keepdims=True)
+    peak = np.zeros(amplitude.shape, dtype=bool)
+    peak[..., 1:-1] = (amplitude[..., 1:-1] >= amplitude[..., :-2]) & \
+                      (amplitude[..., 1:-1] > amplitude[..., 2:]) & \
+                      (amplitude[..., 1:-1] > peak_tol * top)
+    peak &= inrange & (amplitude > 0)
+    A = np.where(peak, amplitude, -np.inf)
+    order = np.argsort(-A, axis=-1)[..., :npeaks]
+    periods = period[order]
+    return np.where(np.isfinite(np.take_along_axis(A, order, axis=-1)),
+                    periods, np.nan)
+
+
+def band_energy(freq, amplitude, bands=period_bands):
+    """
+    Return the sum of amplitude**2 over the frequencies with periods in each
+    band [p1, p2] (minutes), shape (len(amplitude), len(bands)), divided by
+    the equivalent noise bandwidth of the Hann window of amplitude_spectra
+    (which spreads a sine over 3 bins), so a sine of amplitude a gives a**2.
+    """
+    with np.errstate(divide='ignore'):
+        period = np.where(freq > 0, 1. / (60. * freq), np.inf)
+    inband = np.array([(period >= p1) & (period < p2) for p1, p2 in bands])
+    return np.dot(amplitude**2, inband.T.astype(float)) / hann_enbw
+
+
+def peak_times(t, freq, amplitude, period_range=(min_period, max_period)):
+    """
+    Return the time (hours) in t of the segment of each spectrogram in
+    amplitude (shape (nseries, nsegments, nfreq)) with the largest
+    amplitude at periods within period_range, nan if there is none.
+    """
+    with np.errstate(divide='ignore'):
+        period = np.where(freq > 0, 1. / (60. * freq), np.inf)
+    inrange = (period >= period_range[0]) & (period <= period_range[1])
+    if amplitude.shape[1] == 0 or not inrange.any():
+        return np.full(len(amplitude), np.nan)
+    peak = amplitude[..., inrange].max(axis=-1)
+    return np.where(peak.max(axis=-1) > 0,
+                    t[np.argmax(peak, axis=-1)] / 3600., np.nan)
+
+
+def comparison_series(gauges, store=None, window=skill.time_window):
+    """
+    Return a list of [member, gaugeno, variable, station, (t, values)] with
+    the series of each run in gauges (as for skill.score) and, if store is
+    given, the observed series (member -1) of each entry of
+    skill.comparisons.  Times are in seconds since the earthquake.
+    """
+    series = []
+    for gaugeno, variable, scale, station, field in skill.comparisons:
+        if store is not None and station in store.stations:
+            series.append([-1, gaugeno, variable, station,
+                           skill.observed_series(store, station, field,
+                                                 window)])
+        for m in sorted(gauges.keys()):
+            if gaugeno in gauges[m]:
+                series.append([m, gaugeno, variable, station,
+                               skill.model_series(gauges[m][gaugeno],
+                                                  variable, scale)])
+    return series
+
+
+def analyze(gauges, store=None, window=skill.time_window, dt=sample_dt,
+            bands=period_bands, npeaks=num_peaks):
+    """
+    Return table, freq, amplitude, spectrogram for the series of
+    comparison_series, where table has one row per series (see
+    table_dtype), amplitude[k] is the amplitude spectrum of row k of the
+    table and spectrogram is a dictionary with the segment centers t (s
+    since the earthquake), freq and amplitude, of shape (len(table),
+    len(t), len(freq)).
+    """
+    series = comparison_series(gauges, store, window)
+    t1, t2 = 3600. * window[0], 3600. * window[1]
+    tau, X = resample([s[4] for s in series], t1, t2, dt)
+    freq, amplitude = amplitude_spectra(X, dt)
+    periods = dominant_periods(freq, amplitude, npeaks)
+    energy = band_energy(freq, amplitude, bands)
+    centers, sfreq, samplitude = spectrograms(X, dt)
+    spectrogram = {'t': t1 + centers, 'freq': sfreq, 'amplitude': samplitude}
+
+    dtype = table_dtype(bands, npeaks)
+    table = np.zeros(len(series), dtype=dtype)
+    for name, k in [('member', 0), ('gaugeno', 1), ('variable', 2),
+                    ('station', 3)]:
+        table[name] = [s[k] for s in series]
+    for k in range(npeaks):
+        table['period%i' % (k+1)] = periods[:, k]
+    for k, band in enumerate(bands):
+        table['E_%g_%g' % tuple(band)] = energy[:, k]
+    table['t_peak'] = peak_times(spectrogram['t'], sfreq, samplitude)
+    return table, freq, amplitude, spectrogram
+
+
+def combine(results):
+    """
+    Concatenate the results of analyze or run_spectra for several runs
+    (with the same analysis parameters) into one.
+    """
+    table = np.concatenate([r[0] for r in results])
+    amplitude = np.concatenate([r[2] for r in results])
+    spectrogram = dict(results[0][3])
+    spectrogram['amplitude'] = np.concatenate([r[3]['amplitude']
+                                               for r in results])
+    return table, results[0][1], amplitude, spectrogram
+
+
+def cache_key(fp, window, dt, bands, npeaks):
+    """
+    Return the name of the cache file for the run with fingerprint fp and
+    the analysis parameters.
+    """
+    key = repr([fp, list(window), dt, [list(b) for b in bands], npeaks,
+                peak_tol, segment_length, segment_overlap, skill.comparisons])
+    return hashlib.sha256(key.encode()).hexdigest()[:24] + '.npz'
+
+
+def read_cached(fname, member):
+    """
+    Return table, freq, amplitude, spectrogram from the cache file fname,
+    with the member number set to member.
+    """
+    with np.load(fname) as f:
+        table = f['table']
+        table['member'] = member
+        spectrogram = {'t': f['spectrogram_t'], 'freq': f['spectrogram_freq'],
+                       'amplitude': f['spectrogram_amplitude']}
+        return table, f['freq'], f['amplitude'], spectrogram
+
+
+def write_cached(fname, result):
+    """
+    Save result = (table, freq, amplitude, spectrogram) to the cache file
+    fname.
+    """
+    table, freq, amplitude, spectrogram = result
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_fname = fname + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp_fname, table=table, freq=freq, amplitude=amplitude,
+             spectrogram_t=spectrogram['t'],
+             spectrogram_freq=spectrogram['freq'],
+             spectrogram_amplitude=spectrogram['amplitude'])
+    os.replace(tmp_fname, fname)
+
+
+def select(result, rows):
+    """
+    Return the part of result = (table, freq, amplitude, spectrogram) for
+    rows of the table (a boolean array or indices).
+    """
+    table, freq, amplitude, spectrogram = result
+    spectrogram = dict(spectrogram, amplitude=spectrogram['amplitude'][rows])
+    return table[rows], freq, amplitude[rows], spectrogram
+
+
+def batch_spectra(runs, store=None, window=skill.time_window, dt=sample_dt,
+                  bands=period_bands, npeaks=num_peaks):
+    """
+    Return the combined table, freq, amplitude, spectrogram of the runs, a
+    list of [member, outdir, gauges] where gauges (as for skill.score) are
+    read from outdir if None, and of the observations in store if given.
+    Runs with a fingerprint (see runcache.py) that has already been
+    analyzed are read from the cache; all others are analyzed together,
+    with one FFT call, and cached.
+    """
+    results = []
+    todo = {}
+    cache_files = {}
+    for member, outdir, gauges in runs:
+        fp = runcache.read_fingerprint(outdir) if outdir else None
+        if fp is not None:
+            fname = os.path.join(cache_dir, cache_key(fp, window, dt, bands,
+                                                      npeaks))
+            if os.path.isfile(fname):
+                results.append(read_cached(fname, member))
+                continue
+            cache_files[member] = fname
+        if gauges is None:
+            gauges = skill.read_output(outdir, member)
+        todo[member] = gauges[member]
+
+    if todo or store is not None:
+        batch = analyze(todo, store, window, dt, bands, npeaks)
+        results.append(batch)
+        for member, fname in cache_files.items():
+            write_cached(fname, select(batch, batch[0]['member'] == member))
+    result = combine(results)
+    return select(result, np.argsort(result[0]['member'], kind='stable'))
+
+
+def run_spectra(outdir='_output', member=0, window=skill.time_window,
+                dt=sample_dt, bands=period_bands, npeaks=num_peaks):
+    """
+    Return table, freq, amplitude, spectrogram of the model series of the
+    run in outdir (as analyze, without observations), from the cache if the
+    run has a fingerprint (see runcache.py) that has already been analyzed.
+    """
+    return batch_spectra([[member, outdir, None]], None, window, dt, bands,
+                         npeaks)
+
+
+def path_spectra(path, store=None):
+    """
+    Return the combined table, freq, amplitude, spectrogram of the run in
+    path or of all members of the sweep in path (see sweep.py), from their
+    output directories if they are there, and of the observations in store
+    if given, see batch_spectra.
+    """
+    if not os.path.isfile(os.path.join(path, 'results.npz')):
+        return batch_spectra([[0, path, None]], store)
+    import sweep
+    members, params, gauges = sweep.load_results(path)
+    runs = []
+    for m in members:
+        outdir = os.path.join(path, 'member_%03i' % m, '_output')
+        if os.path.isdir(outdir):
+            runs.append([m, outdir, None])
+        else:
+            runs.append([m, None, {m: gauges[m]}])
+    return batch_spectra(runs, store)
+
+
+if __name__ == '__main__':
+    import sys
+    import obsstore
+    path = sys.argv[1] if len(sys.argv) > 1 else '_output'
+    try:
+        store = obsstore.Store()
+    except IOError:
+        store = None
+    table, freq, amplitude, spectrogram = path_spectra(path, store)
+    skill.write_csv(os.path.join(path, 'spectra.csv'), table)
+    np.savez(os.path.join(path, 'spectra.npz'), table=table, freq=freq,
+             amplitude=amplitude, spectrogram_t=spectrogram['t'],
+             spectrogram_freq=spectrogram['freq'],
+             spectrogram_amplitude=spectrogram['amplitude'])
+    bands = [name for name in table.dtype.names if name.startswith('E_')]
+    print('member gauge var  ' + ''.join('%9s' % ('T%i (min)' % (k+1))
+                                         for k in range(num_peaks))
+          + ''.join('%11s' % b for b in bands) + '  t_peak (h)')
+    for row in table:
+        print('%6s %5i %-4s' % ('obs' if row['member'] < 0 else row['member'],
+                                row['gaugeno'], row['variable'])
+              + ''.join('%9.1f' % row['period%i' % (k+1)]
+                        for k in range(num_peaks))
+              + ''.join('%11.3g' % row[b] for b in bands)
+              + '%12.2f' % row['t_peak'])
@@ -0,0 +1,323 @@
+"""
+Run an ensemble of GeoClaw runs over a grid of parameter values.
+
+Each member of the sweep gets its own run directory sweep_dir/member_NNN
+containing the data files written by setrun() with the member's parameter
+values, and the output in sweep_dir/member_NNN/_output.  The executable
+is built once in this directory (make .exe) and members are run on a
+local process pool, each with cores_per_member OpenMP threads, so that
+ncores // cores_per_member members run at once.
+
+A member is marked as finished by the file member_NNN/done, so running the
+same sweep again only runs members that did not finish, e.g. after the job
+was killed.  The gauge output of each finished member is saved in
+member_NNN/gauges.npz and all of them are collected into sweep_dir/results.npz
+by collect_results.  Members whose output is in the run cache (see
+runcache.py), e.g. from an earlier sweep, are copied instead of run.
+If the observation store exists (see obsstore.py), each member is scored
+against the observations as soon as it finishes, in member_NNN/skill.csv,
+and all members in sweep_dir/skill.csv (see skill.py).
+
+Parameters are given by name, e.g. manning_coefficient, wave_tolerance,
+amr_levels_max or regrid_interval, and are looked up in the attributes of
+rundata.geo_data, refinement_data, amrdata and clawdata, or may be given
+with the data object, as in amrdata.regrid_interval.
+
+Example:
+    python sweep.py _sweep manning_coefficient=0.025,0.035 \\
+        amr_levels_max=5,6 --cores-per-member 4
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import itertools
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import runcache
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Gauges to collect from each member:
+gaugenos = [1123, 5680]
+
+# Data objects searched for a parameter name, in order:
+param_objects = ['geo_data', 'refinement_data', 'amrdata', 'clawdata']
+
+
+def set_param(rundata, name, value):
+    """
+    Set the parameter name to value in rundata.
+    """
+    if '.' in name:
+        objname, attr = name.split('.', 1)
+        setattr(getattr(rundata, objname), attr, value)
+        return
+    for objname in param_objects:
+        obj = getattr(rundata, objname)
+        if hasattr(obj, name):
+            setattr(obj, name, value)
+            return
+    raise AttributeError("*** Unknown parameter %s" % name)
+
+
+def make_members(params):
+    """
+    Return the list of dictionaries of parameter values for every
+    combination of the values in the dictionary params, in a fixed order.
+    """
+    names = sorted(params.keys())
+    return [dict(zip(names, values)) for values in
+            itertools.product(*[params[name] for name in names])]
+
+
+def make_rundata(member_params):
+    """
+    Return rundata from setrun() with the parameters of one member set.
+    """
+    if example_dir not in sys.path:
+        sys.path.insert(0, example_dir)
+    import setrun
+    rundata = setrun.setrun()
+    for name, value in member_params.items():
+        set_param(rundata, name, value)
+    return rundata
+
+
+def run_member(member_dir, member_params, xclawcmd, threads):
+    """
+    Write the data files for one member to member_dir/_output, run the code
+    there with threads OpenMP threads and save the gauge output.
+    Returns the exit status of the code.
+    """
+    outdir = os.path.join(member_dir, '_output')
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)   # left over from an unfinished run
+
+    rundata = make_rundata(member_params)
+    fp = runcache.fingerprint(rundata, xclawcmd)
+    if runcache.fetch_output(fp, outdir):
+        status = 0
+    else:
+        os.makedirs(outdir)
+        cwd = os.getcwd()
+        os.chdir(outdir)
+        try:
+            rundata.write()
+        finally:
+            os.chdir(cwd)
+
+        env = dict(os.environ)
+        env['OMP_NUM_THREADS'] = str(threads)
+        with open(os.path.join(member_dir, 'xclaw.out'), 'w') as out:
+            status = subprocess.call([xclawcmd], cwd=outdir, env=env,
+                                     stdout=out, stderr=subprocess.STDOUT)
+        if status != 0:
+            return status
+        runcache.store_output(fp, outdir)
+
+    gauges = {}
+    import gaugeio
+    records = gaugeio.read_gauges([outdir], gaugenos)
+    for (d, gaugeno), g in records.items():
+        gauges['gauge%s' % str(gaugeno).zfill(5)] = gaugeio.gauge_array(g)
+    np.savez(os.path.join(member_dir, 'gauges.npz'), **gauges)
+
+    with open(os.path.join(member_dir, 'done'), 'w') as f:
+        f.write('%s\n' % json.dumps(member_params, sort_keys=True))
+    return status
+
+
+def run_sweep(sweep_dir, params, ncores=None, cores_per_member=1,
+              xclawcmd=None, max_pending=None):
+    """
+    Run all members of the sweep over the dictionary params that have not
+    already finished.  At most max_pending members (default 2 per worker)
+    are submitted to the pool at a time, so members are set up only shortly
+    before they run.  Returns the list of the member directories that
+    failed, with a nonzero exit status or an exception (e.g. an unknown
+    parameter name), after the other members have run.
+    """
+    if ncores is None:
+        ncores = os.cpu_count()
+    if xclawcmd is None:
+        xclawcmd = os.path.join(example_dir, 'xgeoclaw')
+    if not os.path.isfile(xclawcmd):
+        raise IOError("*** Missing %s, first do: make .exe" % xclawcmd)
+    workers = max(1, ncores // cores_per_member)
+    if max_pending is None:
+        max_pending = 2 * workers
+
+    members = make_members(params)
+    sweep_file = os.path.join(sweep_dir, 'sweep.json')
+    if os.path.isfile(sweep_file):
+        with open(sweep_file) as f:
+            if json.load(f)['members'] != members:
+                raise ValueError("*** %s has a different sweep, use "
+                                 "another sweep_dir" % sweep_dir)
+    else:
+        if not os.path.isdir(sweep_dir):
+            os.makedirs(sweep_dir)
+        with open(sweep_file, 'w') as f:
+            json.dump({'params': params, 'members': members}, f, indent=1)
+
+    todo = []
+    for m, member_params in enumerate(members):
+        member_dir = os.path.join(sweep_dir, 'member_%03i' % m)
+        if os.path.isfile(os.path.join(member_dir, 'done')):
+            continue
+        if not os.path.isdir(member_dir):
+            os.makedirs(member_dir)
+        todo.append((member_dir, member_params))
+
+    print("Running %i of %i members, %i at a time with %i threads each"
+          % (len(todo), len(members), workers, cores_per_member))
+
+    store = open_obs_store()
+    if store is not None:
+        import skill
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        todo = iter(todo)
+        while True:
+            for member_dir, member_params in todo:
+                future = pool.submit(run_member, member_dir, member_params,
+                                     xclawcmd, cores_per_member)
+                pending[future] = member_dir
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            finished, not_finished = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                member_dir = pending.pop(future)
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = '%s: %s' % (type(e).__name__, e)
+                if status != 0:
+                    print("*** %s failed with status %s" % (member_dir, status))
+                    failed.append(member_dir)
+                    continue
+                print("Finished %s" % member_dir)
+                if store is not None:
+                    try:
+                        skill.score_member(member_dir, store)
+                    except Exception as e:
+                        print("*** Scoring %s failed: %s: %s"
+                              % (member_dir, type(e).__name__, e))
+
+    collect_results(sweep_dir)
+    return failed
+
+
+def open_obs_store():
+    """
+    Return the observation store used to score members (see skill.py),
+    or None if it has not been created.
+    """
+    import obsstore
+    try:
+        return obsstore.Store()
+    except IOError:
+        print("No observation store, members will not be scored "
+              "(run: make obsstore)")
+        return None
+
+
+def collect_results(sweep_dir):
+    """
+    Collect the gauge output of all finished members into
+    sweep_dir/results.npz, which contains
+        members: array with the member number of each entry
+        params: JSON string with the parameter values of all members
+        gaugeNNNNN_mMMM: gauge array (level, t, h, hu, hv, eta) for member MMM
+    """
+    with open(os.path.join(sweep_dir, 'sweep.json')) as f:
+        members = json.load(f)['members']
+
+    results = {}
+    finished = []
+    for m in range(len(members)):
+        member_dir = os.path.join(sweep_dir, 'member_%03i' % m)
+        if not os.path.isfile(os.path.join(member_dir, 'done')):
+            continue
+        finished.append(m)
+        with np.load(os.path.join(member_dir, 'gauges.npz')) as gauges:
+            for key in gauges.files:
+                results['%s_m%03i' % (key, m)] = gauges[key]
+
+    results['members'] = np.array(finished, dtype=int)
+    results['params'] = np.array(json.dumps(members))
+    np.savez(os.path.join(sweep_dir, 'results.npz'), **results)
+    print("Collected %i members in %s/results.npz" % (len(finished), sweep_dir))
+
+    import obsstore
+    import skill
+    try:
+        store = obsstore.Store()
+    except IOError:
+        return   # no observations to score the members against
+    gauges = load_results(sweep_dir)[2]
+    skill.write_csv(os.path.join(sweep_dir, 'skill.csv'),
+                    skill.score(gauges, store))
+
+
+def load_results(sweep_dir):
+    """
+    Return members, params, gauges from sweep_dir/results.npz, where params
+    is the list of parameter dictionaries of all members and gauges[m][gaugeno]
+    is the gauge array of member m.
+    """
+    with np.load(os.path.join(sweep_dir, 'results.npz')) as results:
+        members = list(results['members'])
+        params = json.loads(str(results['params']))
+        gauges = dict([(m, {}) for m in members])
+        for key in results.files:
+            if key.startswith('gauge'):
+                gauge, m = key.split('_m')
+                gauges[int(m)][int(gauge[5:])] = results[key]
+    return members, params, gauges
+
+
+def parse_value(value):
+    """
+    Convert a parameter value from the command line to int or float
+    if possible.
+    """
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a parameter sweep.')
+    parser.add_argument('sweep_dir')
+    parser.add_argument('params', nargs='+', help='name=value1,value2,...')
+    parser.add_argument('--ncores', type=int, default=None)
+    parser.add_argument('--cores-per-member', type=int, default=1)
+    parser.add_argument('--xclawcmd', default=None)
+    args = parser.parse_args()
+
+    params = {}
+    for param in args.params:
+        name, values = param.split('=')
+        params[name] = [parse_value(v) for v in values.split(',')]
+
+    failed = run_sweep(args.sweep_dir, params, ncores=args.ncores,
+                       cores_per_member=args.cores_per_member,
+                       xclawcmd=args.xclawcmd)
+    if failed:
+        sys.exit(1)
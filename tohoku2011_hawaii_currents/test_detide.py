@@ -0,0 +1,139 @@
+"""
+Tests of detide.py against the fits of the baseline compare_results.ipynb.
+Run with:
+    python -m pytest test_detide.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+
+import detide
+
+# Ten days of one-minute samples, in hours:
+t = np.arange(0., 240., 1./60.)
+
+
+def tide(t, amplitudes, phases):
+    """
+    Return a tide with the given amplitudes and phases (degrees) of the
+    constituents of detide.periods_hawaii(), plus an offset of 0.3.
+    """
+    periods = detide.periods_hawaii()
+    eta = 0.3 * np.ones(len(t))
+    for name in sorted(amplitudes):
+        eta += amplitudes[name] * np.cos(2*np.pi*t/periods[name]
+                                         + phases[name]*np.pi/180.)
+    return eta
+
+
+def baseline_harmonic_fit(t, eta, periods, svd_tol):
+    """
+    eta_fit of fit_tide_harmonic in the baseline notebook.
+    """
+    keep = ~np.isnan(eta)
+    A = np.ones(t.shape)
+    for k in periods.keys():
+        A = np.vstack([A, np.sin(2*np.pi*t/periods[k]),
+                       np.cos(2*np.pi*t/periods[k])])
+    A = A.T
+    U, S, V = np.linalg.svd(A[keep], full_matrices=False)
+    c = np.zeros(A.shape[1])
+    for k in range(A.shape[1]):
+        if S[k]/S[0] > svd_tol:
+            c = c + (np.dot(U[:,k], eta[keep]) / S[k]) * V[k,:]
+    return np.dot(A, c)
+
+
+def test_harmonic_fit_matches_baseline():
+    periods = detide.periods_hawaii()
+    rng = np.random.RandomState(0)
+    eta = tide(t, {'M2': 0.25, 'K1': 0.15}, {'M2': 40., 'K1': -70.}) \
+        + 0.01 * rng.randn(len(t))
+    eta[500:620] = np.nan
+    for svd_tol in [detide.svd_tol_hawaii, 0.01]:
+        eta_fit = detide.harmonic_fit(t, eta, periods, svd_tol)[0]
+        expected = baseline_harmonic_fit(t, eta, periods, svd_tol)
+        assert np.allclose(eta_fit, expected, rtol=0, atol=1e-10)
+
+
+def test_harmonic_fit_of_many_series():
+    periods = detide.periods_hawaii()
+    eta = np.column_stack([tide(t, {'M2': a}, {'M2': 10.})
+                           for a in [0.1, 0.2, 0.3]])
+    eta[100:200, 1] = np.nan
+    eta_fit = detide.harmonic_fit(t, eta, periods, detide.svd_tol_hawaii)[0]
+    for j in range(eta.shape[1]):
+        expected = detide.harmonic_fit(t, eta[:,j], periods,
+                                       detide.svd_tol_hawaii)[0]
+        assert np.allclose(eta_fit[:,j], expected, rtol=0, atol=1e-12)
+
+
+def test_fit_tide_harmonic_recovers_constituents():
+    periods = dict((k, detide.periods_hawaii()[k]) for k in ['K1', 'M2'])
+    eta = tide(t, {'M2': 0.25, 'K1': 0.15}, {'M2': 40., 'K1': -70.})
+    eta_fit, amplitude, phase, offset = detide.fit_tide_harmonic(
+        t, eta, periods, svd_tol=1e-5)
+    assert np.allclose(eta_fit, eta, atol=1e-10)
+    assert np.isclose(offset, 0.3)
+    assert np.isclose(amplitude['M2'], 0.25)
+    assert np.isclose(amplitude['K1'], 0.15)
+    assert np.isclose(phase['M2'], 40.)
+    assert np.isclose(phase['K1'] % 360., 290.)
+
+
+def baseline_poly_fit(t, eta, degree):
+    """
+    eta_fit of fit_tide_poly in the baseline notebook.
+    """
+    keep = ~np.isnan(eta)
+    scale_factor = abs(t[keep]).max()
+    t_nonan = t[keep] / scale_factor
+    t = t / scale_factor
+    tpts = np.linspace(t_nonan.min(), t_nonan.max(), degree+1)
+    A = np.ones((len(t_nonan), degree+1))
+    for j in range(1, degree+1):
+        A[:,j] = A[:,j-1] * (t_nonan - tpts[j])
+    c = np.linalg.lstsq(A, eta[keep], rcond=None)[0]
+    A = np.ones((len(t), degree+1))
+    for j in range(1, degree+1):
+        A[:,j] = A[:,j-1] * (t - tpts[j])
+    return np.dot(A, c)
+
+
+def adcp_series():
+    """
+    Return the times (hours since the quake) and u, v of a synthetic ADCP
+    record: a tide, a tsunami and noise, with a gap in v.
+    """
+    th = np.arange(-2., 40., 1./30.)
+    rng = np.random.RandomState(1)
+    u = 0.3*np.cos(2*np.pi*th/12.42) + 0.1*np.sin(2*np.pi*th/0.5) \
+        * np.exp(-((th - 10.)/3.)**2) + 0.02*rng.randn(len(th))
+    v = 0.2*np.sin(2*np.pi*th/12.42 + 1.) + 0.02*rng.randn(len(th))
+    v[300:400] = np.nan
+    return th, np.column_stack([u, v])
+
+
+def test_poly_fit_matches_baseline():
+    th, uv = adcp_series()
+    uv_fit = detide.poly_fit(th, uv, detide.poly_degree)
+    for j in range(uv.shape[1]):
+        expected = baseline_poly_fit(th, uv[:,j], detide.poly_degree)
+        assert np.allclose(uv_fit[:,j], expected, rtol=0, atol=1e-8)
+    assert np.allclose(detide.fit_tide_poly(th, uv[:,1], detide.poly_degree),
+                       uv_fit[:,1], rtol=0, atol=1e-12)
+
+
+def test_poly_fit_in_chunks():
+    th, uv = adcp_series()
+    uv_fit = detide.poly_fit(th, uv, detide.poly_degree)
+    uv_chunked = detide.poly_fit(th, uv, detide.poly_degree, chunk_size=97)
+    assert np.allclose(uv_chunked, uv_fit, rtol=0, atol=1e-8)
+
+
+def test_poly_fit_reproduces_polynomial():
+    th = np.linspace(-2., 40., 500)
+    eta = 0.1 + 0.02*th - 1e-3*th**2 + 1e-5*th**3
+    assert np.allclose(detide.poly_fit(th, eta, 5), eta, rtol=0, atol=1e-10)
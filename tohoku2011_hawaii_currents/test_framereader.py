@@ -0,0 +1,110 @@
+"""
+Tests of framereader.py on a synthetic frame written as GeoClaw does with
+output_format = 'binary'.  Run with:
+    python -m pytest test_framereader.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import framereader
+
+# Patches (gridno, level, xlow, ylow, dx, dy, mx, my), not sorted by level:
+patches = [(3, 2, 203.52, 20.89, 0.001, 0.001, 6, 5),
+           (1, 1, 203.40, 20.80, 0.01, 0.01, 20, 15),
+           (2, 2, 203.45, 20.82, 0.001, 0.001, 4, 3)]
+
+
+def patch_q(patch, meqn, t):
+    """
+    Return q of shape (meqn, mx, my) with values identifying the patch,
+    component and cell.
+    """
+    gridno, level, xlow, ylow, dx, dy, mx, my = patch
+    k, i, j = np.meshgrid(np.arange(meqn), np.arange(mx), np.arange(my),
+                          indexing='ij')
+    return t + 1000.*gridno + 100.*k + 10.*i + j
+
+
+def write_frame(outdir, frameno, t, meqn=4, nghost=2, extra_eta=False):
+    """
+    Write fort.t, fort.q and fort.b files of frame frameno to outdir, with
+    nghost ghost cells (set to nan) and eta appended to q if extra_eta.
+    """
+    nq = meqn + 1 if extra_eta else meqn
+    header = ''
+    data = []
+    for patch in patches:
+        gridno, level, xlow, ylow, dx, dy, mx, my = patch
+        header += ('%i grid_number\n%i AMR_level\n%i mx\n%i my\n'
+                   '%.8E xlow\n%.8E ylow\n%.8E dx\n%.8E dy\n\n'
+                   % (gridno, level, mx, my, xlow, ylow, dx, dy)
+                   ).replace('E', 'D')
+        q = np.full((nq, mx + 2*nghost, my + 2*nghost), np.nan)
+        q[:, nghost:nghost+mx, nghost:nghost+my] = patch_q(patch, nq, t)
+        data.append(q.ravel(order='F'))
+    name = os.path.join(str(outdir), 'fort.%s' + str(frameno).zfill(4))
+    with open(name % 'q', 'w') as f:
+        f.write(header)
+    with open(name % 't', 'w') as f:
+        f.write('%18.8e    time\n%5i                 meqn\n%5i                 '
+                'ngrids\n    1                 naux\n    2                 '
+                'ndim\n%5i                 nghost\n'
+                % (t, meqn, len(patches), nghost))
+    np.concatenate(data).astype('<f8').tofile(name % 'b')
+
+
+def check_frame(frame, nq, t):
+    assert frame.t == t
+    assert frame.meqn == nq
+    table = frame.patch_table
+    assert list(table['gridno']) == [1, 2, 3]     # sorted by level, xlow
+    for i, gridno in enumerate(table['gridno']):
+        patch = [p for p in patches if p[0] == gridno][0]
+        assert table['mx'][i] == patch[6] and table['my'][i] == patch[7]
+        assert np.isclose(table['xlow'][i], patch[2])
+        assert np.array_equal(frame.q(i), patch_q(patch, nq, t))
+
+
+def test_read_frame(tmp_path):
+    write_frame(tmp_path, 3, 120.)
+    write_frame(tmp_path, 1, 60., nghost=0, extra_eta=True)
+    assert framereader.frame_numbers(str(tmp_path)) == [1, 3]
+
+    frame = framereader.read_frame(3, str(tmp_path))
+    assert frame.nghost == 2
+    check_frame(frame, 4, 120.)
+
+    frame = framereader.read_frame(1, str(tmp_path))
+    assert frame.nghost == 0
+    check_frame(frame, 5, 60.)
+
+
+def test_select(tmp_path):
+    write_frame(tmp_path, 0, 0.)
+    frame = framereader.read_frame(0, str(tmp_path))
+    gridnos = lambda i: sorted(frame.patch_table['gridno'][i])
+    assert gridnos(frame.select()) == [1, 2, 3]
+    assert gridnos(frame.select(levels=[2])) == [2, 3]
+    # the bbox only meets patch 3 on level 2:
+    bbox = [203.521, 203.522, 20.891, 20.892]
+    assert gridnos(frame.select(bbox=bbox)) == [1, 3]
+    assert gridnos(frame.select(levels=[2], bbox=bbox)) == [3]
+    assert gridnos(frame.select(bbox=[0., 1., 0., 1.])) == []
+
+    x, y = frame.cell_centers(0)
+    assert x.shape == (20, 15)
+    assert np.isclose(x[0,0], 203.405) and np.isclose(y[0,-1], 20.945)
+
+
+def test_patch_index(tmp_path):
+    write_frame(tmp_path, 2, 30.)
+    frame = framereader.read_frame(2, str(tmp_path))
+    frame.write_index()
+    os.remove(frame.fname('q'))     # the index is used instead
+    indexed = framereader.read_frame(2, str(tmp_path))
+    assert np.array_equal(indexed.patch_table, frame.patch_table)
+    check_frame(indexed, 4, 30.)
@@ -0,0 +1,89 @@
+"""
+Tests of gaugeio.py on synthetic text and binary gauge files.  Run with:
+    python -m pytest test_gaugeio.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import gaugeio
+
+
+def gauge_records(n):
+    """
+    Return n records (level, t, h, hu, hv, eta) with times 0.5 s apart.
+    """
+    t = 0.5 * np.arange(n)
+    return np.column_stack([np.full(n, 3.), t, 2. + np.sin(t), 0.1*t,
+                            -0.2*t, np.cos(t)])
+
+
+def write_text_gauge(outdir, gaugeno, records):
+    with open(gaugeio.gauge_fname(gaugeno, str(outdir)), 'w') as f:
+        f.write('# gauge_id= %5i location=(   0.2035282500E+03   '
+                '0.2090213330E+02 ) num_eqn=  4\n' % gaugeno)
+        f.write('# Columns: level time q(1 ... num_eqn)\n')
+        for r in records:
+            f.write('%02i %16.8e %16.8e %16.8e %16.8e %16.8e\n' % tuple(r))
+
+
+def write_binary_gauge(outdir, gaugeno, records):
+    with open(gaugeio.gauge_fname(gaugeno, str(outdir)), 'w') as f:
+        f.write('# gauge_id= %5i location=( 203.5 20.9 ) num_var=  4\n'
+                '# Stationary gauge\n'
+                '# level, time, q[  1  2  3], eta, aux[]\n'
+                '# file format binary64, time series data in .bin file\n'
+                % gaugeno)
+    records.astype('<f8').tofile(gaugeio.gauge_fname(gaugeno, str(outdir),
+                                                     'bin'))
+
+
+def test_text_and_binary_gauges(tmp_path, monkeypatch):
+    monkeypatch.setattr(gaugeio, 'index_stride', 7)
+    records = gauge_records(200)
+    write_text_gauge(tmp_path, 1123, records)
+    write_binary_gauge(tmp_path, 5680, records)
+    assert gaugeio.gauge_numbers(str(tmp_path)) == [1123, 5680]
+
+    for gaugeno in [1123, 5680]:
+        g = gaugeio.Gauge(gaugeno, str(tmp_path))
+        assert g.data.dtype.names == tuple(gaugeio.gauge_fields)
+        assert np.allclose(gaugeio.gauge_array(g.data), records)
+        for t1, t2 in [(10., 20.), (10.25, 19.75), (-1., 3.), (99.5, 200.),
+                       (None, 5.), (30., None), (200., 300.)]:
+            t = records[:,1]
+            s = np.ones(len(t), dtype=bool)
+            if t1 is not None:
+                s &= t >= t1
+            if t2 is not None:
+                s &= t <= t2
+            window = gaugeio.read_gauge(gaugeno, str(tmp_path), t1, t2)
+            assert np.allclose(gaugeio.gauge_array(window), records[s])
+
+
+def test_text_gauge_is_converted_again_when_changed(tmp_path):
+    write_text_gauge(tmp_path, 1123, gauge_records(50))
+    assert len(gaugeio.read_gauge(1123, str(tmp_path))) == 50
+    assert os.path.isfile(gaugeio.gauge_fname(1123, str(tmp_path), 'npy'))
+    records = gauge_records(80)
+    records[:,2] += 1.
+    write_text_gauge(tmp_path, 1123, records)
+    g = gaugeio.read_gauge(1123, str(tmp_path))
+    assert np.allclose(gaugeio.gauge_array(g), records)
+
+
+def test_unsorted_times(tmp_path):
+    records = gauge_records(30)[::-1]
+    write_text_gauge(tmp_path, 1, records)
+    window = gaugeio.read_gauge(1, str(tmp_path), 2., 4.)
+    assert sorted(window['t']) == [2., 2.5, 3., 3.5, 4.]
+
+
+def test_read_gauges(tmp_path):
+    write_text_gauge(tmp_path, 1123, gauge_records(20))
+    gauges = gaugeio.read_gauges([str(tmp_path)], [1123, 5680], t1=1., t2=2.)
+    assert list(gauges) == [(str(tmp_path), 1123)]
+    assert list(gauges[(str(tmp_path), 1123)]['t']) == [1., 1.5, 2.]
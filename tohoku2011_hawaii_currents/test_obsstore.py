@@ -0,0 +1,108 @@
+"""
+Tests of obsstore.py on a small synthetic archive.  Run with:
+    python -m pytest test_obsstore.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import tempfile
+import datetime
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('CLAW', tempfile.gettempdir())   # needed by maketopo
+import obsstore
+import observations
+import detide
+
+station = 'HAI1123_Kahului_harbor'
+
+# The earthquake in Hawaii time (HST, UTC-10):
+tquake_hst = datetime.datetime(2011, 3, 10, 19, 46, 24)
+
+
+def write_archive(obs_dir):
+    """
+    Write an archive with one ADCP station with two depth bins sampled every
+    6 minutes from the time of the quake, and the tide gauges sampled every
+    minute, in reverse order, with a missing value.  Returns the hours
+    since the quake of the ADCP and tide gauge samples.
+    """
+    station_dir = os.path.join(obs_dir, 'Observations', station)
+    os.makedirs(station_dir)
+    hours = np.arange(0., 30., 0.1)
+    for depth in [5, 10]:
+        with open(os.path.join(station_dir, 'depth_%im.txt' % depth), 'w') as f:
+            f.write('# DATE TIME Speed Dir\n')
+            for k, h in enumerate(hours):
+                time = tquake_hst + datetime.timedelta(hours=h)
+                f.write('%s %.2f %.1f\n' % (time.strftime('%Y-%m-%d %H:%M:%S'),
+                                            depth + 0.01*k, 90.))
+
+    gauge_dir = os.path.join(obs_dir, 'TideGauges')
+    os.makedirs(gauge_dir)
+    gauge_hours = np.arange(0., 48., 1./60.)
+    tquake_utc = tquake_hst + datetime.timedelta(hours=10)
+    for gaugeno, fname in observations.tide_gauge_files.items():
+        with open(os.path.join(gauge_dir, fname), 'w') as f:
+            f.write('DATE,TIME,%s\n' % ','.join(observations.tide_gauge_columns))
+            for k in reversed(range(len(gauge_hours))):
+                time = tquake_utc + datetime.timedelta(minutes=k)
+                eta = '-' if k == 100 else \
+                    '%.4f' % (0.3*np.cos(2*np.pi*gauge_hours[k]/12.4206012))
+                f.write('%s,%s,%s,%s,-,0.1,0.2\n' % (
+                    time.strftime('%Y-%m-%d'), time.strftime('%H:%M:%S'),
+                    eta, eta))
+    return hours, gauge_hours
+
+
+def test_import_and_read(tmp_path):
+    obs_dir = str(tmp_path / 'archive')
+    hours, gauge_hours = write_archive(obs_dir)
+    store_dir = str(tmp_path / 'store')
+    with pytest.raises(IOError):
+        obsstore.Store(store_dir)
+    store = obsstore.open_store(store_dir, source=obs_dir)
+
+    assert store.stations == sorted([station] +
+                                    list(observations.tide_gauge_files))
+    # one hour time correction of HAI1123, speed along the x axis:
+    t, u, v = store.get(station, ['hours_since_quake', 'u', 'v'])
+    assert np.allclose(t, hours - 1.)
+    assert np.allclose(u, 7.5 + 0.01*np.arange(len(hours)))
+    assert np.allclose(v, 0., atol=1e-12)
+    u_detided = store.get(station, 'u_detided')
+    assert np.allclose(u_detided, u - detide.poly_fit(t, u))
+    assert store.array(station, 'depths').tolist() == [5., 10.]
+
+    # the tide gauges are sorted by time, with the missing value as nan:
+    data = obsstore.Store(store_dir).data('1615680')
+    assert np.allclose(data['hours_since_quake'], gauge_hours)
+    assert np.isnan(data['eta'][100])
+    assert np.array_equal(np.isnan(data['eta']), np.isnan(data['1MIN']))
+    eta_fit = detide.harmonic_fit(gauge_hours, data['eta'],
+                                  detide.periods_hawaii(),
+                                  detide.svd_tol_hawaii)[0]
+    assert np.allclose(data['eta_detided'], data['eta'] - eta_fit,
+                       equal_nan=True)
+
+
+def test_window(tmp_path):
+    obs_dir = str(tmp_path / 'archive')
+    write_archive(obs_dir)
+    store = obsstore.import_archive(obs_dir, str(tmp_path / 'store'),
+                                    verbose=False)
+    t = np.array(store.array(station, 'hours_since_quake'))
+    u = np.array(store.array(station, 'u'))
+    for t1, t2 in [(7.25, 13.), (6.9, 7.1), (-5., 0.), (40., 50.)]:
+        s = (t >= t1) & (t <= t2)
+        tw, uw = store.get(station, ['hours_since_quake', 'u'], t1, t2)
+        assert np.array_equal(tw, t[s]) and np.array_equal(uw, u[s])
+    # the end points of the window are included:
+    tw = store.get(station, 'hours_since_quake', t[10], t[20])
+    assert len(tw) == 11
+    data = store.data(station, t[10], t[20])
+    assert data['u_depths'].shape == (2, 11)
+    assert data['depths'].shape == (2,)
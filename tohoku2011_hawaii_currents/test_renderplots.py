@@ -0,0 +1,55 @@
+"""
+Tests of renderplots.py.  Run with:
+    python -m pytest test_renderplots.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import hashlib
+import tempfile
+import subprocess
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+
+# A figure setting like those of setplot.py, with a closure capturing a
+# module, a nested function, a set constant and a class instance:
+hash_script = """
+import numpy as np
+import gaugefields
+import renderplots
+
+class Item(object):
+    pass
+
+def make_plot_var(field):
+    def plot_var(current_data):
+        def unused(x):
+            return x in {'u', 'v', 'speed'}
+        return gaugefields.fields(current_data)[field] * np.ones(3)
+    return plot_var
+
+item = Item()
+item.plot_var = make_plot_var('speed')
+item.afteraxes = lambda current_data: None
+item.ylimits = [0., 2.]
+print(renderplots.config_repr(item))
+"""
+
+
+def figure_repr(hashseed):
+    env = dict(os.environ)
+    env['PYTHONHASHSEED'] = str(hashseed)
+    env.setdefault('CLAW', tempfile.gettempdir())   # needed by maketopo
+    return subprocess.check_output([sys.executable, '-c', hash_script],
+                                   cwd=example_dir, env=env).decode()
+
+
+def test_config_repr_is_stable_across_processes():
+    first = figure_repr(1)
+    with open(os.path.join(example_dir, 'gaugefields.py'), 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    assert 'module(gaugefields,%s)' % source_hash in first
+    assert ' at 0x' not in first
+    assert figure_repr(2) == first
@@ -0,0 +1,65 @@
+"""
+Tests of skill.py: recovery of known time shifts.  Run with:
+    python -m pytest test_skill.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import numpy as np
+
+import skill
+
+# Time shifts (s) of the members, positive if the model is early:
+shifts = [0., 437., -300., 600.]
+
+
+def wave(t):
+    """
+    A wave packet of period 20 minutes centered at 10 hours (t in s).
+    """
+    return np.sin(2*np.pi*t/1200.) * np.exp(-((t - 36000.)/3600.)**2)
+
+
+class SeriesStore(object):
+    """
+    Observation store holding the same series, sampled every minute, for
+    every station and field.
+    """
+
+    def __init__(self, values):
+        self.hours = np.arange(6., 14., 1./60.)
+        self.values = values(3600. * self.hours)
+
+    def get(self, station, fields, t1, t2):
+        s = (self.hours >= t1) & (self.hours <= t2)
+        return [self.hours[s], self.values[s]]
+
+
+def test_best_shifts():
+    t_obs = np.arange(7.25*3600, 13*3600, 60.)
+    t = np.arange(6*3600, 14*3600, 5.)
+    models = [(t, wave(t + s)) for s in shifts]
+    tshift, corr = skill.best_shifts(t_obs, wave(t_obs), models)
+    assert np.allclose(tshift, shifts, atol=2.)
+    assert np.all(corr > 0.999)
+
+
+def test_score():
+    t = np.arange(6*3600, 14*3600, 5.)
+    gauges = {}
+    for member, s in enumerate(shifts):
+        eta = wave(t + s)
+        h = 10. + eta
+        gauge = np.column_stack([np.full(len(t), 5.), t, h, 0.*t, 0.*t, eta])
+        gauges[member] = {5680: gauge}
+    table = skill.score(gauges, SeriesStore(wave))
+
+    assert list(table['member']) == [0, 1, 2, 3]
+    assert set(table['gaugeno']) == set([5680])
+    assert np.allclose(table['tshift'], shifts, atol=2.)
+    assert np.all(table['correlation'] > 0.999)
+    assert np.all(table['rms'] < 1e-2)
+    assert table['rms_default'][3] < 1e-2 and table['rms_default'][0] > 0.1
+    assert np.allclose(table['peak_error'], 0., atol=1e-2)
+    assert np.all(abs(table['arrival_error'] + shifts) <= 60.)
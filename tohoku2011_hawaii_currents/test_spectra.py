@@ -0,0 +1,55 @@
+"""
+Tests of spectra.py: amplitudes, band energies and dominant periods of
+sines.  Run with:
+    python -m pytest test_spectra.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import tempfile
+
+import numpy as np
+
+os.environ.setdefault('CLAW', tempfile.gettempdir())   # needed by maketopo
+import spectra
+
+# Six hours sampled every sample_dt, so a period of 15 minutes is on the
+# frequency grid:
+t = spectra.sample_dt * np.arange(360)
+
+
+def sine(amplitude, period):
+    return amplitude * np.sin(2*np.pi*t/(60.*period))
+
+
+def test_amplitude_and_band_energy():
+    X = np.array([sine(0.7, 15.), sine(2., 60.) + sine(0.5, 6.),
+                  np.zeros(len(t))])
+    freq, amplitude = spectra.amplitude_spectra(X)
+    # np.hanning is the symmetric window, so there is a little leakage:
+    assert np.isclose(amplitude[0].max(), 0.7, rtol=1e-3)
+    assert np.isclose(amplitude[1].max(), 2., rtol=1e-3)
+
+    energy = spectra.band_energy(freq, amplitude)
+    assert energy.shape == (3, len(spectra.period_bands))
+    # bands [4,10], [10,20], [20,40], [40,80], [80,180] minutes:
+    assert np.allclose(energy[0], [0., 0.49, 0., 0., 0.], rtol=1e-2, atol=1e-3)
+    assert np.allclose(energy[1], [0.25, 0., 0., 4., 0.], rtol=1e-2, atol=1e-3)
+    assert np.all(energy[2] == 0.)
+
+
+def test_band_energy_between_frequencies():
+    # a period off the frequency grid still gives about a**2:
+    freq, amplitude = spectra.amplitude_spectra(sine(0.7, 14.3)[None,:])
+    energy = spectra.band_energy(freq, amplitude)
+    assert np.isclose(energy[0,1], 0.49, rtol=0.1)
+
+
+def test_dominant_periods():
+    X = np.array([sine(0.7, 15.) + sine(0.3, 40.), np.zeros(len(t)),
+                  np.ones(len(t))])
+    freq, amplitude = spectra.amplitude_spectra(X)
+    periods = spectra.dominant_periods(freq, amplitude, npeaks=3)
+    assert np.allclose(periods[0,:2], [15., 40.])
+    assert np.all(np.isnan(periods[1:]))
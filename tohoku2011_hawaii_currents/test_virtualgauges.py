@@ -0,0 +1,76 @@
+"""
+Tests of virtualgauges.py on synthetic binary frames whose q is linear in
+x and y, so bilinear interpolation is exact.  Run with:
+    python -m pytest test_virtualgauges.py
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import virtualgauges
+
+# Patches (gridno, level, xlow, ylow, dx, dy, mx, my), a coarse patch with
+# a fine patch inside:
+patches = [(1, 1, 0., 0., 1., 1., 10, 8),
+           (2, 2, 2., 3., 0.25, 0.25, 12, 8)]
+
+
+def exact_q(level, x, y, t):
+    """
+    q on the patches of level at x, y and time t, shape (4,) + x.shape.
+    """
+    return np.array([t + 100.*level + 10.*k + 2.*x - 3.*y for k in range(4)])
+
+
+def write_frames(outdir, times, nghost=2):
+    for frameno, t in enumerate(times):
+        header = ''
+        data = []
+        for gridno, level, xlow, ylow, dx, dy, mx, my in patches:
+            header += ('%i grid_number\n%i AMR_level\n%i mx\n%i my\n'
+                       '%.8e xlow\n%.8e ylow\n%.8e dx\n%.8e dy\n\n'
+                       % (gridno, level, mx, my, xlow, ylow, dx, dy))
+            x = xlow + (np.arange(-nghost, mx + nghost) + 0.5) * dx
+            y = ylow + (np.arange(-nghost, my + nghost) + 0.5) * dy
+            X, Y = np.meshgrid(x, y, indexing='ij')
+            data.append(exact_q(level, X, Y, t).ravel(order='F'))
+        name = os.path.join(str(outdir), 'fort.%s' + str(frameno).zfill(4))
+        with open(name % 'q', 'w') as f:
+            f.write(header)
+        with open(name % 't', 'w') as f:
+            f.write('%18.8e    time\n    4    meqn\n%5i    ngrids\n'
+                    '    2    nghost\n' % (t, len(patches)))
+        np.concatenate(data).astype('<f8').tofile(name % 'b')
+
+
+def test_sample_frames(tmp_path):
+    times = [120., 0., 60.]
+    write_frames(tmp_path, times)
+    # on the fine patch, on the coarse patch only, and outside both:
+    x = np.array([3.1, 4.05, 7.3, 0.9, 12.])
+    y = np.array([4.2, 3.9, 6.6, 0.7, 1.])
+    result = virtualgauges.sample_frames(str(tmp_path), x, y, nproc=2,
+                                         dtype=np.float64)
+
+    assert np.array_equal(result['t'], [0., 60., 120.])
+    assert np.array_equal(result['framenos'], [1, 2, 0])
+    assert result['q'].shape == (4, 3, 5)
+    assert np.array_equal(result['level'], [[2, 2, 1, 1, 0]] * 3)
+    for k, t in enumerate(result['t']):
+        for p, level in enumerate([2, 2, 1, 1]):
+            assert np.allclose(result['q'][:, k, p],
+                               exact_q(level, x[p], y[p], t))
+        assert np.all(np.isnan(result['q'][:, k, 4]))
+
+    virtualgauges.write_results(result, str(tmp_path))
+    saved = virtualgauges.read_results(str(tmp_path))
+    assert np.array_equal(saved['q'], result['q'], equal_nan=True)
+
+
+def test_transect():
+    x, y = virtualgauges.transect(203.52, 20.89, 203.537, 20.905, 5)
+    assert np.allclose(x, np.linspace(203.52, 203.537, 5))
+    assert np.allclose(y, np.linspace(20.89, 20.905, 5))
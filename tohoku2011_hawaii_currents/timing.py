@@ -0,0 +1,287 @@
+"""
+Read the timing output of GeoClaw, export it and compare runs.
+
+At each output time GeoClaw (5.6 and later) appends a line to
+outdir/timing.csv with the simulation time, the total wall and CPU time so
+far and, for each AMR level, the wall time, CPU time and number of cell
+updates so far, as plotted by clawpack.visclaw.plot_timing_stats.  At the
+end of the run it writes a summary to outdir/timing.txt (or fort.amr in
+older versions) with the same totals per level and the time spent in
+stepgrid, ghost cells, regridding and output, and the number of threads.
+
+export_timing collects both into outdir/timing.json, together with the
+fingerprint of the run (see runcache.py):
+    levels          per level: wall, cpu, cells (cell updates) and
+                    cpu_per_update
+    intervals       per output interval and level: t1, t2, wall, cpu, cells
+    overhead        wall and cpu of stepgrid, bc, regrid, output and total
+    threads         number of OpenMP threads
+compare_timing compares two of them and flags each time that increased by
+more than threshold (relative), so a slowdown between Clawpack versions or
+configurations is noticed:
+    python timing.py _output                  # write and print timing.json
+    python timing.py old/_output _output      # compare, exit status 1 if
+                                              # anything is slower
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import re
+import json
+
+import numpy as np
+
+import runcache
+
+timing_csv = 'timing.csv'
+timing_json = 'timing.json'
+
+# Relative increase of a time that is reported as a slowdown:
+slowdown_threshold = 0.1
+
+# Times below this (s) are not compared, as they are mostly noise:
+min_compared_time = 1.
+
+# Labels of the overhead lines of timing.txt, and their keys:
+overhead_labels = [('stepgrid', 'stepgrid'), ('BC/ghost cells', 'bc'),
+                   ('Regridding', 'regrid'), ('Output (valout)', 'output'),
+                   ('Total time:', 'total')]
+
+number = r'([-+]?\d*\.?\d+(?:[EeDd][-+]?\d+)?)'
+
+
+def read_timing_csv(outdir='_output'):
+    """
+    Return a dictionary with the cumulative values in outdir/timing.csv:
+        t                   simulation time of each line, shape (ntimes,)
+        total_wall, total_cpu   shape (ntimes,)
+        wall, cpu, cells    shape (nlevels, ntimes)
+    """
+    fname = os.path.join(outdir, timing_csv)
+    if not os.path.isfile(fname):
+        raise IOError("*** Missing %s" % fname)
+    values = np.loadtxt(fname, skiprows=1, delimiter=',', ndmin=2)
+    nlevels = values.shape[1] // 3 - 1
+    return {'t': values[:,0], 'total_wall': values[:,1],
+            'total_cpu': values[:,2],
+            'wall': values[:, 3:3+3*nlevels:3].T,
+            'cpu': values[:, 4:4+3*nlevels:3].T,
+            'cells': values[:, 5:5+3*nlevels:3].T}
+
+
+def to_float(s):
+    """
+    Convert a number written by Fortran, possibly with a D exponent.
+    """
+    return float(s.replace('D', 'E').replace('d', 'e'))
+
+
+def read_timing_summary(outdir='_output'):
+    """
+    Return a dictionary with levels (list of [level, wall, cpu, cells]),
+    overhead ({key: [wall, cpu]}) and threads from the timing summary in
+    outdir/timing.txt or outdir/fort.amr, or None if there is none.
+    """
+    for name in ['timing.txt', 'fort.amr']:
+        fname = os.path.join(outdir, name)
+        if os.path.isfile(fname):
+            break
+    else:
+        return None
+    with open(fname) as f:
+        lines = f.read().splitlines()
+    for k, line in enumerate(lines):
+        if 'Timing Data' in line:
+            lines = lines[k:]
+            break
+    else:
+        return None
+
+    summary = {'levels': [], 'overhead': {}, 'threads': None}
+    level_line = re.compile(r'^\s*(\d+)\s+' + r'\s+'.join([number]*3) + r'\s*$')
+    for line in lines:
+        m = level_line.match(line)
+        if m:
+            summary['levels'].append([int(m.group(1))] +
+                                     [to_float(v) for v in m.groups()[1:]])
+            continue
+        for label, key in overhead_labels:
+            if line.strip().startswith(label):
+                values = re.findall(number, line[line.index(label)+len(label):])
+                if len(values) >= 2:
+                    summary['overhead'][key] = [to_float(values[0]),
+                                                to_float(values[1])]
+        m = re.search(r'Using\s+(\d+)\s+thread', line)
+        if m:
+            summary['threads'] = int(m.group(1))
+    return summary
+
+
+def interval_table(csv):
+    """
+    Return a list of [t1, t2, level, wall, cpu, cells] for each output
+    interval and level, from the cumulative values of read_timing_csv.
+    """
+    rows = []
+    t = csv['t']
+    nlevels = csv['wall'].shape[0]
+    for k in range(1, len(t)):
+        for level in range(nlevels):
+            rows.append([t[k-1], t[k], level+1] +
+                        [float(csv[name][level, k] - csv[name][level, k-1])
+                         for name in ['wall', 'cpu', 'cells']])
+    return rows
+
+
+def export_timing(outdir='_output'):
+    """
+    Collect the timing output in outdir into a dictionary (see the module
+    docstring), write it to outdir/timing.json and return it.
+    """
+    timing = {'outdir': os.path.abspath(outdir),
+              'fingerprint': runcache.read_fingerprint(outdir),
+              'levels': [], 'intervals': [], 'overhead': {}, 'threads': None}
+    try:
+        import clawpack
+        timing['clawpack_version'] = getattr(clawpack, '__version__', None)
+    except ImportError:
+        timing['clawpack_version'] = None
+
+    summary = read_timing_summary(outdir)
+    try:
+        csv = read_timing_csv(outdir)
+    except IOError:
+        csv = None
+    if summary is None and csv is None:
+        raise IOError("*** No timing output in %s" % outdir)
+
+    if summary is not None and summary['levels']:
+        levels = summary['levels']
+    else:
+        levels = [[level+1, float(csv['wall'][level, -1]),
+                   float(csv['cpu'][level, -1]), float(csv['cells'][level, -1])]
+                  for level in range(csv['wall'].shape[0])]
+    for level, wall, cpu, cells in levels:
+        timing['levels'].append({'level': level, 'wall': wall, 'cpu': cpu,
+                                 'cells': cells,
+                                 'cpu_per_update': cpu / cells if cells
+                                 else None})
+    if summary is not None:
+        timing['overhead'] = dict((key, {'wall': v[0], 'cpu': v[1]})
+                                  for key, v in summary['overhead'].items())
+        timing['threads'] = summary['threads']
+    if csv is not None:
+        timing['intervals'] = [dict(zip(['t1', 't2', 'level', 'wall', 'cpu',
+                                         'cells'], row))
+                               for row in interval_table(csv)]
+        if 'total' not in timing['overhead'] and len(csv['t']):
+            timing['overhead']['total'] = {'wall': float(csv['total_wall'][-1]),
+                                           'cpu': float(csv['total_cpu'][-1])}
+
+    fname = os.path.join(outdir, timing_json)
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    with open(tmp_fname, 'w') as f:
+        json.dump(timing, f, indent=1, sort_keys=True)
+    os.replace(tmp_fname, fname)
+    return timing
+
+
+def load_timing(path):
+    """
+    Return the timing of path, which is a timing.json file or an output
+    directory (exported first if it has no timing.json).
+    """
+    if os.path.isdir(path):
+        fname = os.path.join(path, timing_json)
+        if not os.path.isfile(fname):
+            return export_timing(path)
+        path = fname
+    with open(path) as f:
+        return json.load(f)
+
+
+def timing_items(timing):
+    """
+    Return a dictionary of the compared times of timing, keyed by names
+    such as 'level 3 cpu', 'level 3 cpu_per_update' or 'regrid wall'.
+    """
+    items = {}
+    for entry in timing['levels']:
+        for name in ['wall', 'cpu', 'cpu_per_update']:
+            if entry.get(name) is not None:
+                items['level %i %s' % (entry['level'], name)] = entry[name]
+    for key, values in timing['overhead'].items():
+        for name in ['wall', 'cpu']:
+            items['%s %s' % (key, name)] = values[name]
+    return items
+
+
+def compare_timing(old, new, threshold=slowdown_threshold):
+    """
+    Return a list of [name, old value, new value, relative change, slower]
+    for the times in both timings (dictionaries from load_timing), where
+    slower is True if the new time is larger by more than threshold.
+    Per update times are always compared, others only if at least
+    min_compared_time.
+    """
+    old_items = timing_items(old)
+    new_items = timing_items(new)
+    rows = []
+    for name in sorted(set(old_items) & set(new_items)):
+        a, b = old_items[name], new_items[name]
+        if not name.endswith('per_update') and max(a, b) < min_compared_time:
+            continue
+        change = (b - a) / a if a > 0 else np.inf if b > 0 else 0.
+        rows.append([name, a, b, change, bool(change > threshold)])
+    return rows
+
+
+def print_timing(timing):
+    """
+    Print the times per level and the overhead.
+    """
+    print('level     wall (s)      cpu (s)  cell updates  cpu/update (s)')
+    for entry in timing['levels']:
+        print('%5i %12.2f %12.2f %13.4g %15.3g'
+              % (entry['level'], entry['wall'], entry['cpu'], entry['cells'],
+                 entry['cpu_per_update'] or np.nan))
+    for key, values in sorted(timing['overhead'].items()):
+        print('%-8s %9.2f %12.2f' % (key, values['wall'], values['cpu']))
+    if timing['threads']:
+        print('threads %i' % timing['threads'])
+
+
+def print_comparison(rows, threshold=slowdown_threshold):
+    """
+    Print the rows of compare_timing, marking the slowdowns.
+    """
+    print('%-28s %12s %12s %8s' % ('', 'old', 'new', 'change'))
+    for name, a, b, change, slower in rows:
+        print('%-28s %12.4g %12.4g %+7.1f%% %s'
+              % (name, a, b, 100*change, '*** SLOWER' if slower else ''))
+    nslower = sum(row[4] for row in rows)
+    print('%i of %i times slower by more than %g%%'
+          % (nslower, len(rows), 100*threshold))
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Export the timing of a run or compare two runs.')
+    parser.add_argument('paths', nargs='+', metavar='OUTDIR',
+                        help='output directory or timing.json (old, new)')
+    parser.add_argument('--threshold', type=float, default=slowdown_threshold)
+    args = parser.parse_args()
+
+    if len(args.paths) == 1:
+        print_timing(export_timing(args.paths[0]))
+    else:
+        old, new = [load_timing(path) for path in args.paths[:2]]
+        for label, timing in [('old', old), ('new', new)]:
+            print('%s: %s (fingerprint %s)' % (label, timing['outdir'],
+                                               timing['fingerprint']))
+        rows = compare_timing(old, new, args.threshold)
+        print_comparison(rows, args.threshold)
+        sys.exit(1 if any(row[4] for row in rows) else 0)
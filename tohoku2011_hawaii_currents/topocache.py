@@ -0,0 +1,182 @@
+"""
+Binary cache of the ASCII topo files used in this example.
+
+Each topo file is converted once into a raw little-endian float32 array
+(.bin) plus a small text header (.hdr), stored in the topocache
+subdirectory of the scratch directory under a name that includes the
+SHA-256 hash of the source file, so an updated source file is converted
+again rather than silently reusing stale data.
+
+Python post-processing can then use
+    x, y, Z = topocache.read_topo(path)     # Z is an np.memmap
+or
+    topo = topocache.load_topo(path)         # topotools.Topography
+in place of topotools.Topography(path, topo_type=3), which parses the
+whole ASCII file each time.
+
+If a NetCDF copy is also created (python topocache.py --netcdf, which make
+topo runs when FFLAGS contains -DNETCDF), setgeo in setrun.py passes it to
+GeoClaw as topo_type 4 in place of the ASCII file, and prints which file
+it uses.  This requires GeoClaw to be compiled with NetCDF support.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+
+import numpy as np
+
+from maketopo import scratch_dir, sha256sum
+
+# Directory for the cached binary files:
+cache_dir = os.path.join(scratch_dir, 'topocache')
+
+# Topo files to cache, as listed in setgeo:
+topofiles = [[3, os.path.join(scratch_dir, 'etopo1min130E210E0N60N.asc')],
+             [3, os.path.join(scratch_dir, 'kahului_1s.txt')]]
+
+
+def cache_name(path):
+    """
+    Return the path of the cached files for the topo file at path,
+    without extension.
+    """
+    fname = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, '%s.%s' % (fname, sha256sum(path)[:16]))
+
+
+def write_header(fname, header):
+    """
+    Write the dictionary header as lines "key value" to fname.
+    """
+    with open(fname, 'w') as f:
+        for key in ['ncols', 'nrows', 'xlower', 'xupper', 'ylower',
+                    'yupper', 'dtype', 'sha256', 'source']:
+            f.write('%-12s %s\n' % (key, header[key]))
+
+
+def read_header(fname):
+    """
+    Read a header written by write_header and return it as a dictionary.
+    """
+    header = {}
+    with open(fname) as f:
+        for line in f:
+            key, value = line.split(None, 1)
+            header[key] = value.strip()
+    for key in ['ncols', 'nrows']:
+        header[key] = int(header[key])
+    for key in ['xlower', 'xupper', 'ylower', 'yupper']:
+        header[key] = float(header[key])
+    return header
+
+
+def convert_topo(path, topo_type=3, netcdf=False, verbose=True):
+    """
+    Create the binary cache of the topo file at path if it does not
+    already exist, and also a NetCDF copy if netcdf==True.
+    Returns the path of the cache without extension.
+    """
+    base = cache_name(path)
+    need_bin = not os.path.isfile(base + '.hdr')
+    need_nc = netcdf and not os.path.isfile(base + '.nc')
+    if not (need_bin or need_nc):
+        return base
+
+    from clawpack.geoclaw import topotools
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    if verbose:
+        print("Converting %s" % path)
+    topo = topotools.Topography(path, topo_type=topo_type)
+
+    if need_bin:
+        # Write data first and header last, so an existing header means
+        # the cache is complete:
+        Z = np.asarray(topo.Z, dtype='<f4')
+        tmp_fname = base + '.bin.tmp%i' % os.getpid()
+        Z.tofile(tmp_fname)
+        os.replace(tmp_fname, base + '.bin')
+
+        header = {'ncols': Z.shape[1], 'nrows': Z.shape[0],
+                  'xlower': repr(float(topo.x[0])),
+                  'xupper': repr(float(topo.x[-1])),
+                  'ylower': repr(float(topo.y[0])),
+                  'yupper': repr(float(topo.y[-1])),
+                  'dtype': Z.dtype.str, 'sha256': sha256sum(path),
+                  'source': os.path.abspath(path)}
+        tmp_fname = base + '.hdr.tmp%i' % os.getpid()
+        write_header(tmp_fname, header)
+        os.replace(tmp_fname, base + '.hdr')
+        if verbose:
+            print("Created %s.bin" % base)
+
+    if need_nc:
+        tmp_fname = base + '.tmp%i.nc' % os.getpid()
+        topo.write(tmp_fname, topo_type=4)
+        os.replace(tmp_fname, base + '.nc')
+        if verbose:
+            print("Created %s.nc" % base)
+
+    return base
+
+
+def read_topo(path, topo_type=3):
+    """
+    Return x, y, Z for the topo file at path, where Z is a read-only
+    np.memmap of shape (len(y), len(x)) into the binary cache.
+    The cache is created first if necessary.
+    """
+    return read_cache(convert_topo(path, topo_type))
+
+
+def read_cache(base):
+    """
+    Return x, y, Z from the binary cache with path base (without extension),
+    as returned by cache_name.
+    """
+    header = read_header(base + '.hdr')
+    x = np.linspace(header['xlower'], header['xupper'], header['ncols'])
+    y = np.linspace(header['ylower'], header['yupper'], header['nrows'])
+    Z = np.memmap(base + '.bin', dtype=header['dtype'], mode='r',
+                  shape=(header['nrows'], header['ncols']))
+    return x, y, Z
+
+
+def load_topo(path, topo_type=3):
+    """
+    Return a topotools.Topography object for the topo file at path whose
+    Z array is a memory-mapped view of the binary cache.
+    """
+    from clawpack.geoclaw import topotools
+    x, y, Z = read_topo(path, topo_type)
+    topo = topotools.Topography()
+    topo.set_xyZ(x, y, Z)
+    return topo
+
+
+def solver_topofile(topo_type, path, verbose=True):
+    """
+    Return the [topo_type, path] entry to use in topo_data.topofiles for
+    the topo file at path: the NetCDF copy in the cache if one has been
+    created for the current contents of the file, otherwise the file itself.
+    """
+    if os.path.isfile(path):
+        nc_fname = cache_name(path) + '.nc'
+        if os.path.isfile(nc_fname):
+            if verbose:
+                print("Topo file %s: using NetCDF copy %s" % (path, nc_fname))
+            return [4, nc_fname]
+    if verbose:
+        print("Topo file %s: using the ASCII file (no NetCDF copy, see "
+              "topocache.py)" % path)
+    return [topo_type, path]
+
+
+if __name__ == '__main__':
+    import sys
+    netcdf = '--netcdf' in sys.argv[1:]
+    for topo_type, path in topofiles:
+        convert_topo(path, topo_type, netcdf=netcdf)
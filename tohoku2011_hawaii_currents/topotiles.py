@@ -0,0 +1,224 @@
+"""
+Crop and coarsen the topo files to what the AMR levels in setrun.py need.
+
+The etopo file covers 130E-210E, 0N-60N at 1 arcminute, but the domain is
+only 132E-210E, 9N-53N, and 1 arcminute cells (level 4) are only allowed
+in the Maui region.  Similarly the 1 arcsecond Kahului file is only needed
+at full resolution where level 6 is allowed.  GeoClaw integrates the finest
+topo available over each cell, so each topo file can be replaced by a set of
+tiles: for each AMR level, the part of the file where that level is allowed
+(from regiondata.regions), block averaged to the resolution of that level.
+Tiles that are completely covered by a finer tile are not needed.
+
+The tiles are written as topo_type 3 files to the tiles subdirectory of
+the topocache directory, named by a hash of the source file and the tile
+parameters, so they are only created again when the topo or the domain,
+refinement ratios or regions change.
+
+Set use_topo_tiles = True in setrun.py to use the tiles, or call
+set_topo_tiles(rundata) on any rundata object.  Block averaging the topo
+changes the cell averages slightly where cell edges are not aligned with
+the blocks, so results will not be identical to runs using the full files.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import hashlib
+
+import numpy as np
+
+import topocache
+
+# Directory for the tiles:
+tiles_dir = os.path.join(topocache.cache_dir, 'tiles')
+
+
+def level_resolutions(rundata):
+    """
+    Return lists dx, dy with the grid resolution on each AMR level
+    1, ..., amr_levels_max (dx[0] is the level 1 resolution).
+    """
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+    dx = [(clawdata.upper[0] - clawdata.lower[0]) / clawdata.num_cells[0]]
+    dy = [(clawdata.upper[1] - clawdata.lower[1]) / clawdata.num_cells[1]]
+    for level in range(1, amrdata.amr_levels_max):
+        dx.append(dx[-1] / amrdata.refinement_ratios_x[level-1])
+        dy.append(dy[-1] / amrdata.refinement_ratios_y[level-1])
+    return dx, dy
+
+
+def level_boxes(rundata):
+    """
+    Return a list with the bounding box [x1, x2, y1, y2] of the part of the
+    domain where each AMR level 1, ..., amr_levels_max may be used, based on
+    the regions (None if the level is not allowed anywhere).
+
+    If no single region covers the whole domain, points outside all regions
+    may be refined to amr_levels_max, so every level may be used anywhere.
+    """
+    clawdata = rundata.clawdata
+    domain = [clawdata.lower[0], clawdata.upper[0],
+              clawdata.lower[1], clawdata.upper[1]]
+    levels_max = rundata.amrdata.amr_levels_max
+    regions = rundata.regiondata.regions
+
+    covered = any(r[4] <= domain[0] and r[5] >= domain[1] and
+                  r[6] <= domain[2] and r[7] >= domain[3] for r in regions)
+    if not covered:
+        return [list(domain) for level in range(levels_max)]
+
+    boxes = []
+    for level in range(1, levels_max+1):
+        box = None
+        for r in regions:
+            if r[1] < level:
+                continue
+            rbox = [max(r[4], domain[0]), min(r[5], domain[1]),
+                    max(r[6], domain[2]), min(r[7], domain[3])]
+            if rbox[0] >= rbox[1] or rbox[2] >= rbox[3]:
+                continue
+            if box is None:
+                box = rbox
+            else:
+                box = [min(box[0], rbox[0]), max(box[1], rbox[1]),
+                       min(box[2], rbox[2]), max(box[3], rbox[3])]
+        boxes.append(box)
+    return boxes
+
+
+def block_average(Z, factor):
+    """
+    Average Z over non-overlapping factor x factor blocks.  The shape of Z
+    must be a multiple of factor in each direction.
+    """
+    ny, nx = Z.shape
+    Z = np.asarray(Z, dtype=np.float64)
+    return Z.reshape(ny // factor, factor, nx // factor, factor).mean(axis=(1,3))
+
+
+def crop_indices(x, x1, x2, factor):
+    """
+    Return i1, i2 so that x[i1:i2] covers [x1, x2] if possible, and
+    i2 - i1 is a positive multiple of factor.
+    """
+    n = len(x)
+    i1 = max(0, np.searchsorted(x, x1, side='right') - 1)
+    i2 = min(n, np.searchsorted(x, x2, side='left') + 1)
+    nblocks = -(-(i2 - i1) // factor)   # round up
+    i2 = i1 + nblocks * factor
+    if i2 > n:
+        i1 = max(0, n - nblocks * factor)
+        i2 = i1 + min(nblocks, n // factor) * factor
+    return i1, i2
+
+
+def plan_tiles(rundata, x, y):
+    """
+    Return a list of tiles [factor, x1, x2, y1, y2, levels] for a topo grid
+    with nodes x, y, where factor is the block averaging factor to use over
+    the box [x1, x2, y1, y2] and levels the list of AMR levels it serves.
+    """
+    dx, dy = level_resolutions(rundata)
+    boxes = level_boxes(rundata)
+    dx_topo = (x[-1] - x[0]) / (len(x) - 1)
+
+    # Tiles by factor, extended by 2 cells on each level for ghost cells:
+    tiles = {}
+    for level, box in enumerate(boxes, start=1):
+        if box is None:
+            continue
+        factor = max(1, int(np.floor(dx[level-1] / dx_topo + 1e-6)))
+        box = [max(box[0] - 2*dx[level-1], x[0]),
+               min(box[1] + 2*dx[level-1], x[-1]),
+               max(box[2] - 2*dy[level-1], y[0]),
+               min(box[3] + 2*dy[level-1], y[-1])]
+        if box[0] >= box[1] or box[2] >= box[3]:
+            continue
+        if factor in tiles:
+            tbox = tiles[factor][1:5]
+            box = [min(box[0], tbox[0]), max(box[1], tbox[1]),
+                   min(box[2], tbox[2]), max(box[3], tbox[3])]
+            levels = tiles[factor][5] + [level]
+        else:
+            levels = [level]
+        tiles[factor] = [factor] + box + [levels]
+
+    # Drop tiles covered by a finer one:
+    tiles = sorted(tiles.values())
+    keep = []
+    for tile in tiles:
+        if not any(t[1] <= tile[1] and t[2] >= tile[2] and
+                   t[3] <= tile[3] and t[4] >= tile[4] for t in keep):
+            keep.append(tile)
+    return keep
+
+
+def write_tile(fname, x, y, Z):
+    """
+    Write a topo_type 3 file with nodes x, y and values Z.
+    """
+    from clawpack.geoclaw import topotools
+    topo = topotools.Topography()
+    topo.set_xyZ(x, y, Z)
+    tmp_fname = fname + '.tmp%i' % os.getpid()
+    topo.write(tmp_fname, topo_type=3)
+    os.replace(tmp_fname, fname)
+
+
+def make_tiles(rundata, topo_type, path, verbose=True):
+    """
+    Create (if necessary) the tiles for one entry [topo_type, path] of
+    topo_data.topofiles and return the list of new topofiles entries.
+    """
+    if topo_type == 4 and os.path.dirname(path) == topocache.cache_dir:
+        # NetCDF copy made by topocache.py, use its binary cache:
+        base = os.path.splitext(path)[0]
+    else:
+        base = topocache.convert_topo(path, topo_type, verbose=verbose)
+    x, y, Z = topocache.read_cache(base)
+    source = os.path.basename(base)
+
+    if not os.path.isdir(tiles_dir):
+        os.makedirs(tiles_dir)
+
+    entries = []
+    for factor, x1, x2, y1, y2, levels in plan_tiles(rundata, x, y):
+        i1, i2 = crop_indices(x, x1, x2, factor)
+        j1, j2 = crop_indices(y, y1, y2, factor)
+        if i2 <= i1 or j2 <= j1:
+            continue   # file smaller than one block, coarser tiles used
+        key = '%s %i %i %i %i %i' % (source, factor, i1, i2, j1, j2)
+        key = hashlib.sha256(key.encode()).hexdigest()[:16]
+        fname = os.path.join(tiles_dir, '%s_L%s.%s.tt3'
+                 % (source.split('.')[0], ''.join(map(str,levels)), key))
+
+        if not os.path.isfile(fname):
+            Zt = block_average(Z[j1:j2, i1:i2], factor)
+            xt = x[i1:i2].reshape(-1, factor).mean(axis=1)
+            yt = y[j1:j2].reshape(-1, factor).mean(axis=1)
+            write_tile(fname, xt, yt, Zt)
+            if verbose:
+                print("Created %s (%i x %i)" % (fname, len(xt), len(yt)))
+        entries.append([3, fname])
+    return entries
+
+
+def set_topo_tiles(rundata, verbose=True):
+    """
+    Replace each entry of rundata.topo_data.topofiles by its tiles.
+    Must be called after the domain, AMR parameters and regions are set.
+    """
+    topofiles = []
+    for topo_type, path in rundata.topo_data.topofiles:
+        topofiles += make_tiles(rundata, topo_type, path, verbose)
+    rundata.topo_data.topofiles = topofiles
+    return rundata
+
+
+if __name__ == '__main__':
+    # Create the tiles for the current setrun.py:
+    import setrun
+    setrun.use_topo_tiles = True
+    rundata = setrun.setrun()
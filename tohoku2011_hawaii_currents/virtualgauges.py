@@ -0,0 +1,203 @@
+"""
+Virtual gauges and transects sampled from the frame output after the run.
+
+Gauges in setrun.py are recorded by the solver at every time step, so adding
+one means running again.  Here any number of points (or points along
+transect lines across the harbor) are sampled from the binary frames in
+outdir (see framereader.py) at the output times:
+    - the finest patch containing each point is found for all points at
+      once, by testing the points against the bounding boxes of the patches
+      near them, ordered by level,
+    - h, hu, hv, eta are interpolated bilinearly between the centers of the
+      four cells around each point, gathered with one fancy-indexing
+      operation on the memory-mapped frame for all points (points within
+      half a cell of a patch edge use the nearest interior cells),
+    - each frame is one job on a process pool, so thousands of points cost
+      about the same as reading the patches around them once.
+The result is a dictionary with
+    x, y        the points
+    t           frame times, shape (nframes,)
+    q           shape (4, nframes, npoints), so q[:,:,p] is the time series
+                of point p in the layout used by gaugefields.py
+    level       AMR level used, shape (nframes, npoints), 0 if no patch
+which is saved to outdir/virtual_gauges.npz by the command line version:
+    python virtualgauges.py _output --transect 203.52 20.89 203.537 20.905 200
+    python virtualgauges.py _output --points points.txt   # lines "x y"
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import framereader
+
+results_file = 'virtual_gauges.npz'
+
+# Number of point-patch pairs tested at a time when locating the points:
+locate_chunk = 1 << 22
+
+
+def transect(x1, y1, x2, y2, npoints):
+    """
+    Return arrays x, y of npoints equally spaced points from (x1, y1) to
+    (x2, y2).
+    """
+    s = np.linspace(0., 1., npoints)
+    return x1 + s * (x2 - x1), y1 + s * (y2 - y1)
+
+
+def locate(frame, x, y):
+    """
+    Return the index in frame.patch_table of the finest patch containing
+    each point x, y, -1 for points outside all patches.
+    """
+    patch = np.full(len(x), -1)
+    if len(x) == 0:
+        return patch
+    selected = frame.select(bbox=[x.min(), x.max(), y.min(), y.max()])
+    if len(selected) == 0:
+        return patch
+    p = frame.patch_table[selected]   # sorted by level
+    x1, y1 = p['xlow'], p['ylow']
+    x2, y2 = x1 + p['mx'] * p['dx'], y1 + p['my'] * p['dy']
+    chunk = max(1, locate_chunk // len(selected))
+    for k in range(0, len(x), chunk):
+        xs = x[k:k+chunk, None]
+        ys = y[k:k+chunk, None]
+        inside = (xs >= x1) & (xs < x2) & (ys >= y1) & (ys < y2)
+        # The last patch containing a point is on the finest level:
+        last = inside.shape[1] - 1 - np.argmax(inside[:, ::-1], axis=1)
+        patch[k:k+chunk] = np.where(inside.any(axis=1), selected[last], -1)
+    return patch
+
+
+def interpolate(frame, patch, x, y):
+    """
+    Return the bilinear interpolation of q at the points x, y from the cells
+    of the patches found by locate, as an array of shape (meqn, npoints),
+    nan for points outside all patches.
+    """
+    q = np.full((frame.meqn, len(x)), np.nan)
+    ok = np.nonzero(patch >= 0)[0]
+    if len(ok) == 0:
+        return q
+    p = frame.patch_table[patch[ok]]
+    g = frame.nghost
+    mx, my = p['mx'], p['my']
+
+    # Cell indices to the left and below each point, clamped to the interior:
+    fi = (x[ok] - p['xlow']) / p['dx'] - 0.5
+    fj = (y[ok] - p['ylow']) / p['dy'] - 0.5
+    i0 = np.clip(np.floor(fi).astype(int), 0, np.maximum(mx - 2, 0))
+    j0 = np.clip(np.floor(fj).astype(int), 0, np.maximum(my - 2, 0))
+    i1 = np.minimum(i0 + 1, mx - 1)
+    j1 = np.minimum(j0 + 1, my - 1)
+    wx = np.clip(fi - i0, 0., 1.)
+    wy = np.clip(fj - j0, 0., 1.)
+
+    # Position of q(1,i,j) in the memory map, as in Frame.q:
+    def index(i, j):
+        return p['offset'] + frame.meqn * ((i + g) + (mx + 2*g) * (j + g))
+
+    corners = [(index(i0, j0), (1 - wx) * (1 - wy)),
+               (index(i1, j0), wx * (1 - wy)),
+               (index(i0, j1), (1 - wx) * wy),
+               (index(i1, j1), wx * wy)]
+    values = np.zeros((frame.meqn, len(ok)))
+    for base, w in corners:
+        values += w * frame.data[base[None, :] + np.arange(frame.meqn)[:, None]]
+    q[:, ok] = values
+    return q
+
+
+def sample_frame(frameno, outdir, x, y, components=4):
+    """
+    Return t, the first components of q at the points x, y, shape
+    (components, npoints), and the levels used for frame frameno.
+    """
+    frame = framereader.read_frame(frameno, outdir)
+    patch = locate(frame, x, y)
+    level = np.where(patch >= 0, frame.patch_table['level'][patch], 0)
+    q = interpolate(frame, patch, x, y)[:components]
+    return frame.t, q, level
+
+
+def sample_frames(outdir='_output', x=None, y=None, framenos=None,
+                  nproc=None, dtype=np.float32):
+    """
+    Return the dictionary of virtual gauge time series (see the module
+    docstring) at the points x, y for the frames framenos (all if None) in
+    outdir, sampled on nproc processes.  q is stored with dtype.
+    """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    y = np.atleast_1d(np.asarray(y, dtype=float))
+    if framenos is None:
+        framenos = framereader.frame_numbers(outdir)
+    n = len(framenos)
+    t = np.zeros(n)
+    q = np.zeros((4, n, len(x)), dtype=dtype)
+    level = np.zeros((n, len(x)), dtype=np.int8)
+
+    jobs = [(frameno, outdir, x, y) for frameno in framenos]
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        results = pool.map(sample_frame, *zip(*jobs)) if jobs else []
+        for k, (tk, qk, levelk) in enumerate(results):
+            t[k] = tk
+            q[:, k, :] = qk
+            level[k] = levelk
+
+    order = np.argsort(t, kind='stable')
+    return {'x': x, 'y': y, 't': t[order], 'q': q[:, order, :],
+            'level': level[order], 'framenos': np.asarray(framenos)[order]}
+
+
+def write_results(result, outdir='_output', fname=results_file):
+    """
+    Write the result of sample_frames to outdir/fname.
+    """
+    fname = os.path.join(outdir, fname)
+    tmp_fname = fname + '.tmp%i.npz' % os.getpid()
+    np.savez(tmp_fname, **result)
+    os.replace(tmp_fname, fname)
+
+
+def read_results(outdir='_output', fname=results_file):
+    """
+    Return the dictionary written by write_results.
+    """
+    with np.load(os.path.join(outdir, fname)) as f:
+        return dict((name, f[name]) for name in f.files)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Sample virtual gauges from the frames.')
+    parser.add_argument('outdir', nargs='?', default='_output')
+    parser.add_argument('--points', help='text file with columns x y')
+    parser.add_argument('--transect', type=float, nargs=5, action='append',
+                        default=[], metavar=('X1', 'Y1', 'X2', 'Y2', 'N'))
+    parser.add_argument('--output', default=results_file)
+    parser.add_argument('--nproc', type=int, default=None)
+    args = parser.parse_args()
+
+    xs, ys = [], []
+    if args.points:
+        points = np.loadtxt(args.points, ndmin=2)
+        xs.append(points[:,0])
+        ys.append(points[:,1])
+    for x1, y1, x2, y2, npoints in args.transect:
+        x, y = transect(x1, y1, x2, y2, int(npoints))
+        xs.append(x)
+        ys.append(y)
+    if not xs:
+        parser.error('give --points or --transect')
+    result = sample_frames(args.outdir, np.concatenate(xs), np.concatenate(ys),
+                           nproc=args.nproc)
+    write_results(result, args.outdir, args.output)
+    print("Sampled %i points in %i frames, wrote %s"
+          % (len(result['x']), len(result['t']),
+             os.path.join(args.outdir, args.output)))